@@ -0,0 +1,165 @@
+# Benchmarks for the networking code that run on a real Pico W. Copy this file to a
+# node alongside the usual files and call init() to register the benchmark messages,
+# then trigger them with a tool that can set headers, such as:
+#   curl -H "Data: 192.168.1.84" http://<node>/benchmark/pool
+# The DATA header is the IP address of the node to send the benchmark messages to.
+import logger
+import messages
+import pico
+
+import gc
+import time
+
+BENCHMARK_POOL = '/benchmark/pool'  # Compares a connection per message to pooled connections.
+BENCHMARK_PIPELINE = '/benchmark/pipeline'  # Compares waiting for each response to pipelining.
+BENCHMARK_ROUTES = '/benchmark/routes'  # Compares the memory used by flat routes and route patterns.
+
+BENCHMARK_MESSAGES = 20
+
+
+# Returns the average time in milliseconds to send an alive message to the node.
+async def time_alive_messages(ip, count):
+    start = time.ticks_ms()
+    for i in range(count):
+        await pico.send_message(ip, "GET", messages.ALIVE_MESSAGE)
+
+    return time.ticks_diff(time.ticks_ms(), start) / count
+
+
+# Returns the average time per message when opening a new connection for every
+# message and when reusing a pooled keep-alive connection.
+async def benchmark_pool(ip, count=BENCHMARK_MESSAGES):
+    pool_enabled = pico.pool_enabled
+    try:
+        pico.pool_enabled = False
+        connect_per_message = await time_alive_messages(ip, count)
+
+        # Make sure there is a pooled connection before timing.
+        pico.pool_enabled = True
+        await pico.send_message(ip, "GET", messages.ALIVE_MESSAGE)
+        pooled = await time_alive_messages(ip, count)
+    finally:
+        pico.pool_enabled = pool_enabled
+
+    logger.debug("Connect per message: %s ms; pooled: %s ms", connect_per_message, pooled)
+    return connect_per_message, pooled
+
+
+# Returns the average time per message when waiting for each response in turn and
+# when pipelining all the messages on one connection.
+async def benchmark_pipeline(ip, count=BENCHMARK_MESSAGES):
+    sequential = await time_alive_messages(ip, count)
+
+    start = time.ticks_ms()
+    task = await pico.send_pipelined(ip, [("GET", messages.ALIVE_MESSAGE, None)] * count)
+    await task
+    pipelined = time.ticks_diff(time.ticks_ms(), start) / count
+
+    logger.debug("Sequential: %s ms; pipelined: %s ms", sequential, pipelined)
+    return sequential, pipelined
+
+
+# Source for the numbered routes as they were registered before route patterns, with
+# a responder and a dictionary entry for each number.
+FLAT_ROUTES_SOURCE = '''
+async def respond_to(method, request, headers, response_headers):
+    return ''
+'''
+FLAT_ROUTE_SOURCE = '''
+async def respond_to_%s_%s(method, request, headers, response_headers):
+    headers['Data'] = '%s'
+    return await respond_to(method, request, headers, response_headers)
+responders['/%s/%s'] = respond_to_%s_%s
+'''
+
+
+# Returns the bytes allocated by running build().
+def measure_allocated(build):
+    gc.collect()
+    before = gc.mem_alloc()
+    kept = build()
+    gc.collect()
+    allocated = gc.mem_alloc() - before
+    del kept
+    return allocated
+
+
+def build_flat_routes():
+    source = FLAT_ROUTES_SOURCE
+    for prefix in ('sounds_play', 'lights_on'):
+        for num in range(1, 7):
+            source += FLAT_ROUTE_SOURCE % (prefix, num, num, prefix.replace('_', '/'), num, prefix, num)
+    code = compile(source, 'flat_routes', 'exec')
+    source = None
+    routes = {'responders': {}}
+    exec(code, routes)
+    return routes
+
+
+async def respond_to_pattern(method, request, headers, response_headers):
+    return ''
+
+
+def build_route_patterns():
+    tree = pico.new_route_node()
+    pico.add_route('/sounds/play/{%s}' % pico.HEADER_DATA, respond_to_pattern, tree)
+    pico.add_route('/lights/on/{%s}' % pico.HEADER_DATA, respond_to_pattern, tree)
+    return tree
+
+
+# Returns the bytes used by the twelve numbered sound and light routes registered
+# one by one and as two route patterns.
+def benchmark_routes():
+    flat = measure_allocated(build_flat_routes)
+    patterns = measure_allocated(build_route_patterns)
+
+    logger.debug("Flat routes: %s bytes; route patterns: %s bytes", flat, patterns)
+    return flat, patterns
+
+
+async def respond_to_benchmark_pool(method, request, headers, response_headers):
+    logger.debug("Responding to benchmark pool message.")
+    response_headers[messages.HEADER_CONTENT_TYPE] = messages.CONTENT_TYPE_PLAIN
+
+    ip = headers[pico.HEADER_DATA]
+    if len(ip) <= 0:
+        response_headers[pico.HEADER_DATA] = 'NO IP ADDRESS SPECIFIED FOR DATA HEADER'
+        return response_headers[pico.HEADER_DATA]
+
+    connect_per_message, pooled = await benchmark_pool(ip)
+    response_headers[pico.HEADER_DATA] = '%s,%s' % (connect_per_message, pooled)
+    return ('CONNECT PER MESSAGE: %s MS PER MESSAGE; POOLED: %s MS PER MESSAGE' %
+            (connect_per_message, pooled))
+
+
+async def respond_to_benchmark_pipeline(method, request, headers, response_headers):
+    logger.debug("Responding to benchmark pipeline message.")
+    response_headers[messages.HEADER_CONTENT_TYPE] = messages.CONTENT_TYPE_PLAIN
+
+    ip = headers[pico.HEADER_DATA]
+    if len(ip) <= 0:
+        response_headers[pico.HEADER_DATA] = 'NO IP ADDRESS SPECIFIED FOR DATA HEADER'
+        return response_headers[pico.HEADER_DATA]
+
+    sequential, pipelined = await benchmark_pipeline(ip)
+    response_headers[pico.HEADER_DATA] = '%s,%s' % (sequential, pipelined)
+    return ('SEQUENTIAL: %s MS PER MESSAGE; PIPELINED: %s MS PER MESSAGE' %
+            (sequential, pipelined))
+
+
+async def respond_to_benchmark_routes(method, request, headers, response_headers):
+    logger.debug("Responding to benchmark routes message.")
+    response_headers[messages.HEADER_CONTENT_TYPE] = messages.CONTENT_TYPE_PLAIN
+
+    flat, patterns = benchmark_routes()
+    response_headers[pico.HEADER_DATA] = '%s,%s' % (flat, patterns)
+    return ('FLAT ROUTES: %s BYTES; ROUTE PATTERNS: %s BYTES; SAVED: %s BYTES' %
+            (flat, patterns, flat - patterns))
+
+
+def init():
+    pico.message_responders[BENCHMARK_POOL] = respond_to_benchmark_pool
+    pico.message_responders[BENCHMARK_PIPELINE] = respond_to_benchmark_pipeline
+    pico.message_responders[BENCHMARK_ROUTES] = respond_to_benchmark_routes
+
+# There is no run() function as this is just designed to be used by other modules.
@@ -0,0 +1,100 @@
+# Host side benchmark of the heap used by the coordinator's directory, run with CPython:
+#
+#   python benchmarks/directory_memory.py [--endpoints 10,100,500]
+#
+# For each number of endpoints a fresh directory.py is loaded with the simulation
+# harness and that many endpoints registered with it, as if each had sent a register
+# message. The bytes per endpoint are compared with the same endpoints held the way
+# directory.py used to hold them, a dictionary of IP address, role and expiry for
+# each. The slot layout's figure includes the name and role lookups and the change
+# log, whose fixed cost shows with only a few endpoints. The names, IP addresses and
+# roles are made new for each endpoint, as they are when read from the headers of a
+# message, and counted for both. Memory is measured
+# with tracemalloc; CPython objects are larger than their MicroPython equivalents, so
+# compare the two figures rather than taking either as what a Pico W would use.
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulation'))
+
+import harness
+
+ENDPOINTS = '10,100,500'
+ROLES = ('path', 'cauldron', 'button', 'sensor', 'sounds')
+
+
+# Returns the name, IP address and role of the endpoint as new strings, as they would
+# be when taken from the headers of the endpoint's message.
+def endpoint_strings(i):
+    header = 'endpoint-%s 192.168.%s.%s %s' % (i, 1 + i // 250, 1 + i % 250, ROLES[i % len(ROLES)])
+    return header.split(' ')
+
+
+def register_as_dictionaries(count):
+    directory = {}
+    for i in range(count):
+        name, ip, role = endpoint_strings(i)
+        directory[name] = {'ip': ip, 'role': role, 'expire': int(time.time()) + 120}
+    return directory
+
+
+def load_directory():
+    return harness.load_node_modules({
+        'ssid': 'benchmark',
+        'password': '',
+        'coordinator': None,
+        'name': 'coordinator',
+        'role': 'coordinator',
+        'logging': False,
+        'boot_state_file': None,
+    }, '127.0.0.2', 'directory')['directory']
+
+
+# register_endpoint() never waits, so it is run to completion here rather than with
+# asyncio.run(), whose event loop would otherwise be counted with the directory.
+def register_in_slots(directory, count):
+    for i in range(count):
+        name, ip, role = endpoint_strings(i)
+        try:
+            directory.register_endpoint(ip, name, role).send(None)
+        except StopIteration:
+            pass
+
+
+# Returns the bytes still allocated after running build(), which keeps what it builds.
+def measure(build):
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    del kept
+    return allocated
+
+
+def benchmark(count):
+    dictionaries = measure(lambda: register_as_dictionaries(count))
+
+    directory = load_directory()
+    slots = measure(lambda: register_in_slots(directory, count))
+    return dictionaries, slots
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Heap used per endpoint by the directory.')
+    parser.add_argument('--endpoints', default=ENDPOINTS, help='comma separated numbers of endpoints')
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    print('%9s %11s %11s %16s %16s' % ('endpoints', 'dict bytes', 'slot bytes', 'dict bytes/node', 'slot bytes/node'))
+    for count in [int(count) for count in args.endpoints.split(',')]:
+        dictionaries, slots = benchmark(count)
+        print('%9s %11s %11s %16.0f %16.0f' % (count, dictionaries, slots, dictionaries / count, slots / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# Load and latency benchmark for the pico HTTP server, run with CPython against the
+# host simulation:
+#
+#   python benchmarks/load.py [--concurrency C] [--requests N] [--mix alive=4,sounds=2,...]
+#                             [--output results.json]
+#
+# A coordinator node is started with the simulation harness and its directory filled
+# with endpoints. Each of the concurrent clients keeps a connection open to it and
+# sends requests one after another, picking the route from the mix. Requests/s,
+# p50/p95/p99 latency, error rate and peak heap are printed for the whole run and for
+# each route, and written to a JSON results file so runs before and after a change
+# can be compared. The peak heap comes from tracemalloc and covers the whole process,
+# including the clients, so compare it between runs rather than with a Pico W.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulation'))
+
+import harness
+
+# Each route in the mix, with the request and the Data header sent for it.
+ROUTES = {
+    'alive': ('/alive', None),
+    'sounds': ('/sounds/play', '1'),
+    'lookup': ('/lookup/role', 'path'),
+    'inspect': ('/inspect', None),
+}
+MIX = 'alive=4,sounds=2,lookup=2,inspect=1'
+
+CONCURRENCY = 4
+REQUESTS = 2000
+WARMUP_REQUESTS = 50  # Sent before measuring, so connections are open.
+ENDPOINTS = 20  # Entries in the coordinator's directory.
+TIMEOUT_S = 5
+
+STATUS_OK = b'200'
+CLIENT_ADDRESS = '127.0.0.1'
+
+
+# Returns a list of route names in which each appears as often as its weight.
+def parse_mix(mix):
+    weighted = []
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        if name not in ROUTES:
+            raise ValueError('Unknown route %s, expected one of %s' % (name, ', '.join(ROUTES)))
+        weighted.extend([name] * int(weight))
+    return weighted
+
+
+def encode_request(name):
+    request, data = ROUTES[name]
+    lines = ['GET %s HTTP/1.1' % request,
+             'Sender: %s' % CLIENT_ADDRESS,
+             'Name: load',
+             'Role: benchmark',
+             'Connection: keep-alive']
+    if data is not None:
+        lines.append('Data: %s' % data)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+
+# Reads a response, returning True if it was a 200 and the connection will stay open.
+async def read_response(reader):
+    status = await reader.readline()
+    if len(status) == 0:
+        raise EOFError('Connection closed')
+
+    length = 0
+    keep_alive = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'connection':
+            keep_alive = value.strip().lower() == b'keep-alive'
+
+    if length > 0:
+        await reader.readexactly(length)
+    elif not keep_alive:
+        await reader.read()  # A streamed body is ended by closing the connection.
+
+    parts = status.split(b' ')
+    return len(parts) > 1 and parts[1] == STATUS_OK, keep_alive
+
+
+class Client:
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+        self.reader = self.writer = None
+
+    # Returns whether the request succeeded.
+    async def send(self, request):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.address, self.port)
+
+        self.writer.write(request)
+        await self.writer.drain()
+        ok, keep_alive = await read_response(self.reader)
+        if not keep_alive:
+            await self.close()
+        return ok
+
+
+def percentile(latencies, fraction):
+    if len(latencies) == 0:
+        return None
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+def summarise(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    count = len(latencies) + errors
+    return {
+        'requests': count,
+        'errors': errors,
+        'error_rate': errors / count if count > 0 else 0,
+        'requests_per_second': count / seconds if seconds > 0 else 0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if len(latencies) > 0 else None,
+    }
+
+
+async def benchmark(target, args):
+    weighted = parse_mix(args.mix)
+    requests = dict((name, encode_request(name)) for name in sorted(set(weighted)))
+    chooser = random.Random(args.seed)
+    schedule = [chooser.choice(weighted) for _ in range(args.requests)]
+
+    directory = target.module('directory')
+    for i in range(args.endpoints):
+        await directory.register_endpoint('127.0.1.%s' % (i + 1), 'path-%s' % i, 'path')
+
+    latencies = dict((name, []) for name in requests)
+    errors = dict((name, 0) for name in requests)
+    clients = [Client(target.address, target.pico.PORT) for _ in range(args.concurrency)]
+
+    async def worker(client, names):
+        for name in names:
+            started = time.perf_counter()
+            try:
+                ok = await asyncio.wait_for(client.send(requests[name]), TIMEOUT_S)
+            except Exception:
+                ok = False
+                await client.close()
+
+            if ok:
+                latencies[name].append((time.perf_counter() - started) * 1000)
+            else:
+                errors[name] += 1
+
+    # Warm up without measuring, so connections are open and caches are filled.
+    warmup = [weighted[i % len(weighted)] for i in range(WARMUP_REQUESTS)]
+    await asyncio.gather(*[worker(client, warmup[i::len(clients)]) for i, client in enumerate(clients)])
+    for name in requests:
+        latencies[name] = []
+        errors[name] = 0
+
+    tracemalloc.reset_peak()
+    heap_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(client, schedule[i::len(clients)]) for i, client in enumerate(clients)])
+    seconds = time.perf_counter() - started
+    heap_peak = tracemalloc.get_traced_memory()[1]
+
+    for client in clients:
+        await client.close()
+
+    all_latencies = [latency for name in latencies for latency in latencies[name]]
+    results = summarise(all_latencies, sum(errors.values()), seconds)
+    results['seconds'] = seconds
+    results['peak_heap_bytes'] = heap_peak
+    results['peak_heap_growth_bytes'] = heap_peak - heap_before
+    results['routes'] = dict((name, summarise(latencies[name], errors[name], seconds)) for name in requests)
+    results['settings'] = {
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'mix': args.mix,
+        'endpoints': args.endpoints,
+        'seed': args.seed,
+    }
+    return results
+
+
+def format_ms(value):
+    return '-' if value is None else '%.2f' % value
+
+
+def print_results(results):
+    print('%-8s %9s %8s %8s %8s %8s %7s' % ('route', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    rows = list(results['routes'].items()) + [('all', results)]
+    for name, row in rows:
+        print('%-8s %9s %8.1f %8s %8s %8s %6.2f%%' % (
+            name, row['requests'], row['requests_per_second'], format_ms(row['p50_ms']),
+            format_ms(row['p95_ms']), format_ms(row['p99_ms']), row['error_rate'] * 100))
+    print('Peak heap: %s bytes (%s bytes above the start of the run)' % (
+        results['peak_heap_bytes'], results['peak_heap_growth_bytes']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and latency benchmark for the pico HTTP server.')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='clients sending at once')
+    parser.add_argument('--requests', type=int, default=REQUESTS, help='requests to measure')
+    parser.add_argument('--mix', default=MIX, help='route weights, from %s' % ', '.join(ROUTES))
+    parser.add_argument('--endpoints', type=int, default=ENDPOINTS, help='endpoints in the directory')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the order of the requests')
+    parser.add_argument('--port', type=int, default=harness.PORT, help='port the node listens on')
+    parser.add_argument('--output', default='load_results.json', help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    simulation = harness.Simulation(args.port)
+    target = simulation.add_node('coordinator', 'coordinator')
+
+    # The coordinator answers lookups; the sounds messages are added so one node can
+    # serve the whole mix.
+    target.module('sounds').init()
+
+    results = asyncio.run(simulation.run(lambda simulation: benchmark(target, args)))
+    print_results(results)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 # The button box nodes have a button event that they can send and sounds.
 # The button has a light that can be turned on or off.
 import config
+import logger
 import messages
 import pico
 import sounds
@@ -14,24 +15,28 @@ import uasyncio as asyncio
 BUTTON_LIGHT_OFF = '/button/light/off'
 BUTTON_LIGHT_ON = '/button/light/on'
 
+# Sending these again while they are in flight changes nothing, so the sends are shared.
+pico.idempotent_requests.add(BUTTON_LIGHT_OFF)
+pico.idempotent_requests.add(BUTTON_LIGHT_ON)
+
 light_on = False
 led = leds.LED(16, 0)
 
 
 def button_pressed():
-    if config.logging: print("Button pressed")
+    logger.info("Button pressed")
     turn_button_light_on()
-    if config.coordinator is not None:
+    if messages.coordinator is not None:
         # See https://www.joeltok.com/posts/2021-02-python-async-sync/
         loop = asyncio.get_event_loop()
-        coroutine = coordinator.send_event_message(config.coordinator, config.button_event)
+        coroutine = coordinator.send_event_message(messages.coordinator, config.button_event)
         loop.run_until_complete(coroutine)
     else:
-        if config.logging: print("Coordinator not set, no event message sent.")
+        logger.warning("Coordinator not set, no event message sent.")
 
 
 def button_released():
-    if config.logging: print("Button released")
+    logger.info("Button released")
 
 
 button = Button(17)
@@ -52,17 +57,17 @@ def turn_button_light_on():
 
 
 async def send_button_light_off_message(ip):
-    if config.logging: print("Sending button light off message to %s." % ip)
-    await pico.send_message(ip, "GET", BUTTON_LIGHT_OFF)
+    logger.debug("Sending button light off message to %s.", ip)
+    await pico.send_nowait(ip, "GET", BUTTON_LIGHT_OFF, priority=pico.PRIORITY_CUE)
 
 
 async def send_button_light_on_message(ip):
-    if config.logging: print("Sending button light on message to %s." % ip)
-    await pico.send_message(ip, "GET", BUTTON_LIGHT_ON)
+    logger.debug("Sending button light on message to %s.", ip)
+    await pico.send_nowait(ip, "GET", BUTTON_LIGHT_ON, priority=pico.PRIORITY_CUE)
 
 
 async def respond_to_button_light_off(method, request, headers, response_headers):
-    if config.logging: print("Responding to button light off message.")
+    logger.debug("Responding to button light off message.")
 
     turn_button_light_off()
 
@@ -72,7 +77,7 @@ async def respond_to_button_light_off(method, request, headers, response_headers
 
 
 async def respond_to_button_light_on(method, request, headers, response_headers):
-    if config.logging: print("Responding to button light on message.")
+    logger.debug("Responding to button light on message.")
     turn_button_light_on()
 
     response_headers[messages.HEADER_CONTENT_TYPE] = messages.CONTENT_TYPE_PLAIN
@@ -1,6 +1,6 @@
 # The path nodes controls the lights and sounds in the cauldron
 # There are 12 neopixels.
-import config
+import logger
 import messages
 import pico
 import neopixels
@@ -11,6 +11,9 @@ import uasyncio as asyncio
 LIGHTS_OFF = '/lights/off'
 LIGHTS_ON = '/lights/on'
 
+# Sending these again while they are in flight changes nothing, so the sends are shared.
+pico.idempotent_requests.add(LIGHTS_OFF)
+
 # NeoPixels.
 NUM_PIXELS = 12
 lights_on = False
@@ -33,17 +36,17 @@ async def turn_lights_on():
 
 
 async def send_lights_off_message(ip):
-    if config.logging: print("Sending lights off message to %s." % ip)
-    await pico.send_message(ip, "GET", LIGHTS_OFF)
+    logger.debug("Sending lights off message to %s.", ip)
+    await pico.send_nowait(ip, "GET", LIGHTS_OFF, priority=pico.PRIORITY_CUE)
 
 
 async def send_lights_on_message(ip):
-    if config.logging: print("Sending lights on message to %s." % ip)
-    await pico.send_message(ip, "GET", LIGHTS_ON)
+    logger.debug("Sending lights on message to %s.", ip)
+    await pico.send_datagram(ip, LIGHTS_ON, ack=True)
 
 
 async def respond_to_lights_off(method, request, headers, response_headers):
-    if config.logging: print("Responding to lights off message.")
+    logger.debug("Responding to lights off message.")
 
     await turn_lights_off()
 
@@ -53,7 +56,7 @@ async def respond_to_lights_off(method, request, headers, response_headers):
 
 
 async def respond_to_lights_on(method, request, headers, response_headers):
-    if config.logging: print("Responding to lights on message.")
+    logger.debug("Responding to lights on message.")
 
     await turn_lights_on()
 
@@ -1,8 +1,20 @@
 ssid = "something"
 password = "another"
 coordinator = "ip address"
+# The standby coordinator's IP address, on the primary coordinator and its endpoints, or None.
+standby = None
+# On a standby coordinator, the primary coordinator's IP address, otherwise None.
+primary = None
 name = "one"
 role = "path"
 logging = True
+# Lowest level of log message kept: "debug", "info", "warning" or "error".
+log_level = "debug"
+# File the log is written to in batches, or None to only keep it in memory.
+log_file = None
+# File the network state is cached in so the node can connect faster next time, or None.
+boot_state_file = "boot_state.json"
+# File the coordinator keeps its directory of endpoints in across restarts, or None.
+directory_file = "directory.json"
 # If this node has a single button (i.e. button box), this determines the event message sent.
 button_event = "none"
@@ -1,7 +1,7 @@
 # Co-ordinator code.
 import time
 
-import config
+import logger
 import directory
 import messages
 import pico
@@ -56,49 +56,49 @@ reset_all = False
 # All nodes (except the sensor box) have sounds. we do not do the sounds off concurrently
 # as we will run out of memory.
 async def all_sounds_off():
-    if config.logging: print("Turning off all sounds.")
+    logger.debug("Turning off all sounds.")
     endpoints = await directory.lookup_all_endpoints()
     for name, ip in endpoints.items():
         if name == "sensor-door":
-            if config.logging: print("Ignoring the sensor box")
+            logger.debug("Ignoring the sensor box")
 
-        if config.logging: print("Turning sounds off for node %s:%s" % (name, ip))
+        logger.debug("Turning sounds off for node %s:%s", name, ip)
         await sounds.send_sounds_off_message(ip)
 
 
 # All lights off on the path, cauldron and buttons.
 async def all_lights_off():
-    if config.logging: print("Turning off all lights.")
+    logger.debug("Turning off all lights.")
 
     tasks = []
     path_nodes = await directory.lookup_endpoints_by_role(PATH_ROLE)
     for name, ip in path_nodes.items():
-        if config.logging: print("Turning lights off for path node %s:%s" % (name, ip))
+        logger.debug("Turning lights off for path node %s:%s", name, ip)
         tasks.append(path_box.send_lights_off_message(ip))
     await asyncio.gather(*tasks)
 
     tasks = []
     button_nodes = await directory.lookup_endpoints_by_role(BUTTON_ROLE)
     for name, ip in button_nodes.items():
-        if config.logging: print("Turning lights off for button node %s:%s" % (name, ip))
+        logger.debug("Turning lights off for button node %s:%s", name, ip)
         tasks.append(button_box.send_button_light_off_message(ip))
     await asyncio.gather(*tasks)
 
     tasks = []
     cauldron_nodes = await directory.lookup_endpoints_by_role(CAULDRON_ROLE)
     for name, ip in cauldron_nodes.items():
-        if config.logging: print("Turning lights off for cauldron node %s:%s" % (name, ip))
+        logger.debug("Turning lights off for cauldron node %s:%s", name, ip)
         tasks.append(cauldron_box.send_lights_off_message(ip))
     await asyncio.gather(*tasks)
 
 
 async def reset_sensors():
-    if config.logging: print("Resetting all sensors.")
+    logger.debug("Resetting all sensors.")
 
     tasks = []
     sensor_nodes = await directory.lookup_endpoints_by_role(SENSOR_ROLE)
     for name, ip in sensor_nodes.items():
-        if config.logging: print("Resetting sensor node %s:%s" % (name, ip))
+        logger.debug("Resetting sensor node %s:%s", name, ip)
         tasks.append(sensor_box.send_proximity_events_reset(ip))
     await asyncio.gather(*tasks)
 
@@ -106,7 +106,7 @@ async def reset_sensors():
 # This puts the setup into it's waiting state.
 async def reset(headers):
     global reset_all
-    if config.logging: print("Running system reset.")
+    logger.info("Running system reset.")
     reset_all = True
 
     # All sounds off except for the background noise.
@@ -132,7 +132,7 @@ async def reset(headers):
 
 async def enter_button_pressed(headers):
     global reset_all
-    if config.logging: print("Triggering enter button script.")
+    logger.info("Triggering enter button script.")
 
     # Enter (red) Button Pressed
     # ==========================
@@ -146,7 +146,7 @@ async def enter_button_pressed(headers):
     cauldron = await directory.lookup_endpoint_by_name(CAULDRON_NAME)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     # Trigger the enter button with witches laugh 1.
@@ -162,7 +162,7 @@ async def enter_button_pressed(headers):
     #  - 23 seconds
     #  - 28 seconds
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     deadline = time.ticks_add(time.ticks_ms(), 600)
@@ -175,7 +175,7 @@ async def enter_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -194,7 +194,7 @@ async def enter_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -210,7 +210,7 @@ async def enter_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -229,7 +229,7 @@ async def enter_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -245,7 +245,7 @@ async def enter_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -264,7 +264,7 @@ async def enter_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -334,7 +334,7 @@ async def one_meter_trigger(headers):
 
 async def door_button_pressed(headers):
     global reset_all
-    if config.logging: print("Triggering door button script.")
+    logger.info("Triggering door button script.")
 
     enter_button = await directory.lookup_endpoint_by_name(ENTER_BUTTON_NAME)
     door_button = await directory.lookup_endpoint_by_name(DOOR_BUTTON_NAME)
@@ -342,7 +342,7 @@ async def door_button_pressed(headers):
     path_right = await directory.lookup_endpoint_by_name(PATH_RIGHT_NAME)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     # Trigger the witches laugh 2 from path-left
@@ -375,7 +375,7 @@ async def door_button_pressed(headers):
     #  - 23 seconds
     #  - 28 seconds
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     deadline = time.ticks_add(time.ticks_ms(), 600)
@@ -388,7 +388,7 @@ async def door_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -408,7 +408,7 @@ async def door_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -424,7 +424,7 @@ async def door_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -447,7 +447,7 @@ async def door_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -467,7 +467,7 @@ async def door_button_pressed(headers):
     deadline = time.ticks_add(deadline, 5500)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -487,7 +487,7 @@ async def door_button_pressed(headers):
     deadline = time.ticks_add(deadline, 30000)
 
     if reset_all:
-        if config.logging: print("Reset triggered, aborting.")
+        logger.info("Reset triggered, aborting.")
         return
 
     tasks = []
@@ -509,22 +509,22 @@ async def noop(headers):
 
 
 async def event_enter(headers):
-    if config.logging: print("Enter event triggered '%s'" % "ENTER")
+    logger.info("Enter event triggered '%s'", "ENTER")
     asyncio.create_task(enter_button_pressed(headers))
 
 
 async def event_two_point_five_meter(headers):
-    if config.logging: print("2.5 meter event triggered '%s'" % "ENTER")
+    logger.info("2.5 meter event triggered '%s'", "ENTER")
     asyncio.create_task(two_point_five_meter_trigger(headers))
 
 
 async def event_one_meter(headers):
-    if config.logging: print("1 meter event triggered '%s'" % "ENTER")
+    logger.info("1 meter event triggered '%s'", "ENTER")
     asyncio.create_task(one_meter_trigger(headers))
 
 
 async def event_door(headers):
-    if config.logging: print("Door event triggered '%s'" % "DOOR")
+    logger.info("Door event triggered '%s'", "DOOR")
     asyncio.create_task(door_button_pressed(headers))
 
 
@@ -556,7 +556,7 @@ EVENT = '/event'  # The data indicates what event occurred
 
 
 async def respond_to_reset(method, request, headers, response_headers):
-    if config.logging: print("Responding to reset message.")
+    logger.debug("Responding to reset message.")
 
     asyncio.create_task(reset(headers))
 
@@ -566,7 +566,7 @@ async def respond_to_reset(method, request, headers, response_headers):
 
 
 async def respond_to_enter(method, request, headers, response_headers):
-    if config.logging: print("Responding to enter button message.")
+    logger.debug("Responding to enter button message.")
 
     asyncio.create_task(enter_button_pressed(headers))
 
@@ -576,7 +576,7 @@ async def respond_to_enter(method, request, headers, response_headers):
 
 
 async def respond_to_two_point_five_meter(method, request, headers, response_headers):
-    if config.logging: print("Responding to 2.5 meter message.")
+    logger.debug("Responding to 2.5 meter message.")
 
     asyncio.create_task(two_point_five_meter_trigger(headers))
 
@@ -586,7 +586,7 @@ async def respond_to_two_point_five_meter(method, request, headers, response_hea
 
 
 async def respond_to_one_meter(method, request, headers, response_headers):
-    if config.logging: print("Responding to 1 meter message.")
+    logger.debug("Responding to 1 meter message.")
 
     asyncio.create_task(one_meter_trigger(headers))
 
@@ -596,7 +596,7 @@ async def respond_to_one_meter(method, request, headers, response_headers):
 
 
 async def respond_to_door(method, request, headers, response_headers):
-    if config.logging: print("Responding to door button message.")
+    logger.debug("Responding to door button message.")
 
     asyncio.create_task(door_button_pressed(headers))
 
@@ -606,12 +606,12 @@ async def respond_to_door(method, request, headers, response_headers):
 
 
 async def send_event_message(ip, event):
-    if config.logging: print("Sending event %s message to %s." % (event, ip))
+    logger.debug("Sending event %s message to %s.", event, ip)
     await pico.send_message(ip, "GET", EVENT, event)
 
 
 async def respond_to_event(method, request, headers, response_headers):
-    if config.logging: print("Responding to event message.")
+    logger.debug("Responding to event message.")
 
     # Extract event data header and check we know the event.
     event = headers[pico.HEADER_DATA]
@@ -1,7 +1,7 @@
 # Co-ordinator code.
 import time
 
-import config
+import logger
 import directory
 import messages
 import pico
@@ -25,52 +25,61 @@ PATH_RIGHT_NAME = "path-right"
 CAULDRON_NAME = "cauldron"
 
 
-# All nodes (except the sensor box) have sounds. we do not do the sounds off concurrently
-# as we will run out of memory.
+# All nodes (except the sensor box) have sounds. A single broadcast reaches them all; if
+# datagrams are unavailable we do not do the sounds off concurrently as we will run out
+# of memory.
 async def all_sounds_off():
-    if config.logging: print("Turning off all sounds.")
+    logger.debug("Turning off all sounds.")
+    if await pico.send_group_datagram(pico.DATAGRAM_GROUP_ALL, sounds.SOUNDS_OFF):
+        return
+
     endpoints = await directory.lookup_all_endpoints()
     for name, ip in endpoints.items():
         if name == "sensor-door":
-            if config.logging: print("Ignoring the sensor box")
+            logger.debug("Ignoring the sensor box")
 
-        if config.logging: print("Turning sounds off for node %s:%s" % (name, ip))
+        logger.debug("Turning sounds off for node %s:%s", name, ip)
         await sounds.send_sounds_off_message(ip)
 
 
 # All lights off on the path, cauldron and buttons.
 async def all_lights_off():
-    if config.logging: print("Turning off all lights.")
+    logger.debug("Turning off all lights.")
+    if (await pico.send_group_datagram(PATH_ROLE + "," + CAULDRON_ROLE, path_box.LIGHTS_OFF) and
+            await pico.send_group_datagram(BUTTON_ROLE, button_box.BUTTON_LIGHT_OFF)):
+        return
 
     tasks = []
     path_nodes = await directory.lookup_endpoints_by_role(PATH_ROLE)
     for name, ip in path_nodes.items():
-        if config.logging: print("Turning lights off for path node %s:%s" % (name, ip))
+        logger.debug("Turning lights off for path node %s:%s", name, ip)
         tasks.append(path_box.send_lights_off_message(ip))
     await asyncio.gather(*tasks)
 
     tasks = []
     button_nodes = await directory.lookup_endpoints_by_role(BUTTON_ROLE)
     for name, ip in button_nodes.items():
-        if config.logging: print("Turning lights off for button node %s:%s" % (name, ip))
+        logger.debug("Turning lights off for button node %s:%s", name, ip)
         tasks.append(button_box.send_button_light_off_message(ip))
     await asyncio.gather(*tasks)
 
     tasks = []
     cauldron_nodes = await directory.lookup_endpoints_by_role(CAULDRON_ROLE)
     for name, ip in cauldron_nodes.items():
-        if config.logging: print("Turning lights off for cauldron node %s:%s" % (name, ip))
+        logger.debug("Turning lights off for cauldron node %s:%s", name, ip)
         tasks.append(cauldron_box.send_lights_off_message(ip))
     await asyncio.gather(*tasks)
 
 
 async def reset_sensors():
-    if config.logging: print("Resetting all sensors.")
+    logger.debug("Resetting all sensors.")
+    if await pico.send_group_datagram(SENSOR_ROLE, sensor_box.PROXIMITY_EVENTS_RESET):
+        return
 
     tasks = []
     sensor_nodes = await directory.lookup_endpoints_by_role(SENSOR_ROLE)
     for name, ip in sensor_nodes.items():
-        if config.logging: print("Resetting sensor node %s:%s" % (name, ip))
+        logger.debug("Resetting sensor node %s:%s", name, ip)
         tasks.append(sensor_box.send_proximity_events_reset(ip))
     await asyncio.gather(*tasks)
 
@@ -87,13 +96,13 @@ door_running = False
 async def reset(headers):
     global reset_all, reset_running
     if reset_running:
-        if config.logging: print("System reset already running, skipping.")
+        logger.debug("System reset already running, skipping.")
         return
 
     try:
         reset_running = True
         reset_all = True
-        if config.logging: print("Running system reset.")
+        logger.info("Running system reset.")
 
         # All sounds off except for the background noise.
         await all_sounds_off()
@@ -134,12 +143,12 @@ async def enter_button_pressed(headers):
     global reset_all, enter_running
 
     if enter_running:
-        if config.logging: print("Enter button already running, skipping.")
+        logger.debug("Enter button already running, skipping.")
         return
 
     try:
         enter_running = True
-        if config.logging: print("Triggering enter button script.")
+        logger.info("Triggering enter button script.")
 
         enter_button = await directory.lookup_endpoint_by_name(ENTER_BUTTON_NAME)
         path_left = await directory.lookup_endpoint_by_name(PATH_LEFT_NAME)
@@ -147,7 +156,7 @@ async def enter_button_pressed(headers):
         cauldron = await directory.lookup_endpoint_by_name(CAULDRON_NAME)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         # Trigger the church bells on path-left
@@ -161,7 +170,7 @@ async def enter_button_pressed(headers):
             await asyncio.sleep_ms(50)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         tasks = []
@@ -191,7 +200,7 @@ async def enter_button_pressed(headers):
             await asyncio.sleep_ms(50)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         tasks = []
@@ -217,7 +226,7 @@ async def enter_button_pressed(headers):
             await asyncio.sleep_ms(50)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         tasks = []
@@ -229,14 +238,14 @@ async def enter_button_pressed(headers):
 
         await asyncio.sleep_ms(3500)
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
         # Now we are at about 15 seconds
 
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         # Dragon (lion will be playing at path left)
@@ -246,14 +255,14 @@ async def enter_button_pressed(headers):
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
         # Now we are at about 25 seconds
 
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         # Lion
@@ -263,19 +272,19 @@ async def enter_button_pressed(headers):
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         await asyncio.sleep_ms(2000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
         # Now we are at about 45 seconds
 
@@ -286,7 +295,7 @@ async def enter_button_pressed(headers):
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         # Lion
@@ -302,14 +311,14 @@ async def enter_button_pressed(headers):
         tasks = []
         cauldron_nodes = await directory.lookup_endpoints_by_role(CAULDRON_ROLE)
         for name, ip in cauldron_nodes.items():
-            if config.logging: print("Turning lights off for cauldron node %s:%s" % (name, ip))
+            logger.debug("Turning lights off for cauldron node %s:%s", name, ip)
             tasks.append(cauldron_box.send_lights_off_message(ip))
         await asyncio.gather(*tasks)
 
         tasks = []
         path_nodes = await directory.lookup_endpoints_by_role(PATH_ROLE)
         for name, ip in path_nodes.items():
-            if config.logging: print("Turning lights off for path node %s:%s" % (name, ip))
+            logger.debug("Turning lights off for path node %s:%s", name, ip)
             tasks.append(path_box.send_lights_off_message(ip))
         await asyncio.gather(*tasks)
 
@@ -321,12 +330,12 @@ async def two_point_five_meter_trigger(headers):
     global reset_all, ultrasonic_running
 
     if ultrasonic_running:
-        if config.logging: print("Ultrasonic event already running, skipping.")
+        logger.debug("Ultrasonic event already running, skipping.")
         return
 
     try:
         ultrasonic_running = True
-        if config.logging: print("Triggering ultrasonic script.")
+        logger.info("Triggering ultrasonic script.")
 
         path_right = await directory.lookup_endpoint_by_name(PATH_RIGHT_NAME)
 
@@ -337,19 +346,19 @@ async def two_point_five_meter_trigger(headers):
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         # Lion
@@ -359,19 +368,19 @@ async def two_point_five_meter_trigger(headers):
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
     finally:
@@ -384,12 +393,12 @@ async def door_button_pressed(headers):
     global reset_all, door_running
 
     if door_running:
-        if config.logging: print("Door already running, skipping.")
+        logger.debug("Door already running, skipping.")
         return
 
     try:
         door_running = True
-        if config.logging: print("Triggering door button script.")
+        logger.info("Triggering door button script.")
 
         door_button = await directory.lookup_endpoint_by_name(DOOR_BUTTON_NAME)
 
@@ -402,13 +411,13 @@ async def door_button_pressed(headers):
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         await asyncio.sleep_ms(5000)
 
         if reset_all:
-            if config.logging: print("Reset triggered, aborting.")
+            logger.info("Reset triggered, aborting.")
             return
 
         await asyncio.sleep_ms(5000)
@@ -422,17 +431,17 @@ async def noop(headers):
 
 
 async def event_enter(headers):
-    if config.logging: print("Enter event triggered '%s'" % "ENTER")
+    logger.info("Enter event triggered '%s'", "ENTER")
     asyncio.create_task(enter_button_pressed(headers))
 
 
 async def event_two_point_five_meter(headers):
-    if config.logging: print("2.5 meter event triggered '%s'" % "ENTER")
+    logger.info("2.5 meter event triggered '%s'", "ENTER")
     asyncio.create_task(two_point_five_meter_trigger(headers))
 
 
 async def event_door(headers):
-    if config.logging: print("Door event triggered '%s'" % "DOOR")
+    logger.info("Door event triggered '%s'", "DOOR")
     asyncio.create_task(door_button_pressed(headers))
 
 
@@ -463,7 +472,7 @@ EVENT = '/event'  # The data indicates what event occurred
 
 
 async def respond_to_reset(method, request, headers, response_headers):
-    if config.logging: print("Responding to reset message.")
+    logger.debug("Responding to reset message.")
 
     asyncio.create_task(reset(headers))
 
@@ -473,7 +482,7 @@ async def respond_to_reset(method, request, headers, response_headers):
 
 
 async def respond_to_enter(method, request, headers, response_headers):
-    if config.logging: print("Responding to enter button message.")
+    logger.debug("Responding to enter button message.")
 
     asyncio.create_task(enter_button_pressed(headers))
 
@@ -483,7 +492,7 @@ async def respond_to_enter(method, request, headers, response_headers):
 
 
 async def respond_to_two_point_five_meter(method, request, headers, response_headers):
-    if config.logging: print("Responding to 2.5 meter message.")
+    logger.debug("Responding to 2.5 meter message.")
 
     asyncio.create_task(two_point_five_meter_trigger(headers))
 
@@ -493,7 +502,7 @@ async def respond_to_two_point_five_meter(method, request, headers, response_hea
 
 
 async def respond_to_door(method, request, headers, response_headers):
-    if config.logging: print("Responding to door button message.")
+    logger.debug("Responding to door button message.")
 
     asyncio.create_task(door_button_pressed(headers))
 
@@ -503,12 +512,12 @@ async def respond_to_door(method, request, headers, response_headers):
 
 
 async def send_event_message(ip, event):
-    if config.logging: print("Sending event %s message to %s." % (event, ip))
+    logger.debug("Sending event %s message to %s.", event, ip)
     await pico.send_message(ip, "GET", EVENT, event)
 
 
 async def respond_to_event(method, request, headers, response_headers):
-    if config.logging: print("Responding to event message.")
+    logger.debug("Responding to event message.")
 
     # Extract event data header and check we know the event.
     event = headers[pico.HEADER_DATA]
@@ -1,29 +1,188 @@
 import config
+import logger
 import pico
 
-VERSION: str = "0.2.4"
+VERSION: str = "0.5.2"
 
 import uasyncio as asyncio
 
+import json
+import os
 import time
+from array import array
 
+# Each endpoint has a numbered slot holding its name, role and expiry in lists shared
+# by all the endpoints, rather than a dictionary of its own, which keeps the heap used
+# per endpoint small on a coordinator with many of them. Its IP address is only kept
+# in the lookups below. Slots freed by endpoints that have gone are reused. Every
+# endpoint in a role shares one copy of the role's name. endpoint() returns the
+# details of an endpoint for showing.
+directory = {}  # Maps names to slots.
+slot_names = []
+slot_roles = []
+slot_expiries = array('I')  # time.time() in seconds when each endpoint expires.
+free_slots = []
+roles = {}  # Each role name once.
 
-# Maps names to IP address and role.
-directory = {}
+# Positions in what endpoint() returns.
+IP = 0
+ROLE = 1
+EXPIRE = 2
 
-IP = "ip"
-ROLE = "role"
-EXPIRE = "expire"
+EXPIRY_S = 120  # How long an endpoint stays registered without being heard from.
+
+# Changes whenever an endpoint is added, removed or changes its IP address or role, so
+# endpoints can tell when the lookups they have cached are out of date.
+version = 0
+
+# The last CHANGES_MAX changes, oldest first, so a standby coordinator can be sent the
+# changes it has missed. The changes are numbered one after another up to version, so
+# only the kind of each change and the endpoint's name are kept. An endpoint is sent
+# with the IP address and role it has when the change is sent, which a later change
+# would have given it anyway.
+CHANGE_REGISTER = 'register'
+CHANGE_UNREGISTER = 'unregister'
+CHANGE_EXPIRE = 'expire'
+CHANGES_MAX = 32
+change_kinds = []
+change_names = []
+
+
+def record_change(change, name):
+    change_kinds.append(change)
+    change_names.append(name)
+    if len(change_names) > CHANGES_MAX:
+        change_kinds.pop(0)
+        change_names.pop(0)
+
+
+def forget_changes():
+    del change_kinds[:]
+    del change_names[:]
+
+
+# Returns the version of the oldest change kept, or None if none are.
+def oldest_change():
+    if len(change_names) == 0:
+        return None
+    return version - len(change_names) + 1
+
+
+# Returns the change numbered number, which must be kept, as (version, change, name,
+# ip, role). ip and role are None for an endpoint removed; an endpoint registered that
+# has been removed since is sent as removed, as it is by a later change.
+def change(number):
+    i = number - version + len(change_names) - 1
+    kind = change_kinds[i]
+    name = change_names[i]
+    slot = directory.get(name)
+    if kind != CHANGE_REGISTER:
+        return number, kind, name, None, None
+    if slot is None:
+        return number, CHANGE_UNREGISTER, name, None, None
+    return number, kind, name, endpoint_ips[name], slot_roles[slot]
+
+# The lookups are kept up to date as endpoints come and go so they can be returned
+# without scanning the directory. Each dictionary of names to IP addresses is replaced
+# rather than changed, so a script can carry on using one while endpoints come and
+# go; the lookups must not be changed by their callers.
+endpoint_ips = {}  # Maps names to IP addresses for every endpoint.
+role_endpoints = {}  # Maps roles to a dictionary of names to IP addresses.
+NO_ENDPOINTS = {}
+
+
+def add_to_lookups(name, ip, role):
+    global endpoint_ips
+    ips = dict(endpoint_ips)
+    ips[name] = ip
+    endpoint_ips = ips
+
+    ips = dict(role_endpoints.get(role, NO_ENDPOINTS))
+    ips[name] = ip
+    role_endpoints[role] = ips
+
+
+def remove_from_lookups(name, role):
+    global endpoint_ips
+    ips = dict(endpoint_ips)
+    del ips[name]
+    endpoint_ips = ips
+
+    ips = dict(role_endpoints[role])
+    del ips[name]
+    if len(ips) > 0:
+        role_endpoints[role] = ips
+    else:
+        del role_endpoints[role]
+
+
+def remove_endpoint(name, change):
+    global version
+    slot = directory.pop(name)
+    remove_from_lookups(name, slot_roles[slot])
+    slot_names[slot] = None
+    slot_roles[slot] = None
+    free_slots.append(slot)
+    version += 1
+    record_change(change, name)
+    save_later(SAVE_DELAY_MS)
+
+
+# Adds the endpoint, or changes its IP address or role, to expire at the time given.
+def set_endpoint(name, ip, role, expiry):
+    global version
+    slot = directory.get(name)
+    if slot is None:
+        slot = new_slot()
+        directory[name] = slot
+        slot_names[slot] = name
+    else:
+        remove_from_lookups(name, slot_roles[slot])
+
+    if role not in roles:
+        roles[role] = role
+    role = roles[role]
+    slot_roles[slot] = role
+    slot_expiries[slot] = expiry
+    add_to_lookups(name, ip, role)
+    version += 1
+    record_change(CHANGE_REGISTER, name)
+    save_later(SAVE_DELAY_MS)
+
+
+def new_slot():
+    if len(free_slots) > 0:
+        return free_slots.pop()
+
+    slot_names.append(None)
+    slot_roles.append(None)
+    slot_expiries.append(0)
+    return len(slot_names) - 1
+
+
+# Returns (ip, role, expiry) for the endpoint, or None if it is not registered.
+def endpoint(name):
+    slot = directory.get(name)
+    if slot is None:
+        return None
+    return endpoint_ips[name], slot_roles[slot], slot_expiries[slot]
 
 
 async def register_endpoint(ip, name, role):
     global directory
-    expiry = time.time() + 120
+    expiry = int(time.time()) + EXPIRY_S
     name = name.strip()
     if len(name) <= 0:
         return ''
 
-    directory[name] = {IP: ip.strip(), ROLE: role.strip(), EXPIRE: expiry}
+    ip = ip.strip()
+    role = role.strip()
+    slot = directory.get(name)
+    if slot is not None and endpoint_ips[name] == ip and slot_roles[slot] == role:
+        slot_expiries[slot] = expiry
+        save_later(REFRESH_SAVE_MS)
+    else:
+        set_endpoint(name, ip, role, expiry)
     return 'Registered'
 
 
@@ -36,7 +195,7 @@ async def unregister_endpoint(ip, name, role):
     if name not in directory:
         return 'Unknown'
 
-    del directory[name]
+    remove_endpoint(name, CHANGE_UNREGISTER)
     return 'Unregistered'
 
 
@@ -45,47 +204,185 @@ async def heartbeat_from_endpoint(ip, name, role):
     return 'Heartbeat'
 
 
-# Returns the IP address for all the known nodes
+# Every message carries the sender's name, so any message from a registered endpoint
+# is as good as a heartbeat and it is kept registered for longer. The response tells
+# the endpoint the directory's version, as the response to a heartbeat would.
+refreshes = 0  # Registrations refreshed by a message from the endpoint.
+
+
+def refresh_from_message(headers, response_headers):
+    global refreshes
+    slot = directory.get(headers[pico.HEADER_NAME])
+    if slot is None or endpoint_ips[headers[pico.HEADER_NAME]] != headers[pico.HEADER_SENDER]:
+        return
+
+    slot_expiries[slot] = int(time.time()) + EXPIRY_S
+    save_later(REFRESH_SAVE_MS)
+    refreshes += 1
+    if response_headers is not None:
+        response_headers[pico.HEADER_DIRECTORY_VERSION] = str(version)
+
+
+# Returns a dictionary of names to IPs for all the known nodes, which must not be changed.
 async def lookup_all_endpoints():
-    global directory
-    return dict((name, value[IP]) for name, value in directory.items())
+    return endpoint_ips
 
 
 # Returns the IP address for the first matching name
 async def lookup_endpoint_by_name(name):
-    global directory
-    name = name.strip()
+    return endpoint_ips.get(name.strip(), '')
 
-    if name not in directory:
-        return ''
 
-    return directory[name][IP]
+# Return a dictionary of names to IPs, which must not be changed.
+async def lookup_endpoints_by_role(role):
+    return role_endpoints.get(role, NO_ENDPOINTS)
 
 
-# Return a dictionary of names to IPs.
-async def lookup_endpoints_by_role(role):
-    global directory
-    return dict((name, value[IP]) for name, value in directory.items() if value[ROLE] == role)
+# A standby coordinator is sent the endpoints its primary expires, as it doesn't hear
+# the heartbeats, so it keeps its endpoints until it takes over.
+expiring = getattr(config, 'primary', None) is None
+
 
+# Starts expiring endpoints, giving each the full time to be heard from first.
+def start_expiring():
+    global expiring
+    expiring = True
+    expiry = int(time.time()) + EXPIRY_S
+    for slot in directory.values():
+        slot_expiries[slot] = expiry
 
-# Periodically look into the set of registered nodes and look for expired endpoints.
+
+# Removes endpoints as they expire. Looks through the expiries for the earliest and
+# sleeps until it is due, so a refreshed endpoint only has its expiry changed. An
+# endpoint registering while it sleeps expires later than that, so never needs it
+# woken early.
 async def expire_endpoints():
-    global directory
     while True:
-        await asyncio.sleep(120)
-        if config.logging: print("Checking for endpoint expiration.")
         now = time.time()
-        to_remove = []
-        for name, value in directory.items():
-            if value[EXPIRE] < now:
-                to_remove.append(name)
+        earliest = now + EXPIRY_S
+        for slot in range(len(slot_names)):
+            name = slot_names[slot]
+            if name is None:
+                continue
+
+            expiry = slot_expiries[slot]
+            if expiry <= now and not expiring:
+                slot_expiries[slot] = expiry = int(now) + EXPIRY_S
+            if expiry <= now:
+                logger.info("Endpoint %s has expired.", name)
+                remove_endpoint(name, CHANGE_EXPIRE)
+            elif expiry < earliest:
+                earliest = expiry
+
+        await asyncio.sleep(earliest - now)
+
+
+# ********************************************************************************
+# Persistence
+# ********************************************************************************
+# The coordinator's directory is written to flash so that after a restart it can run
+# scripts straight away rather than waiting for every endpoint's next heartbeat.
+# Changes are written behind: an endpoint added, removed or changed is written after
+# SAVE_DELAY_MS, so endpoints registering together are written together, and
+# heartbeats, which only move expiries on, wait up to REFRESH_SAVE_MS, so the flash is
+# written at most a couple of times a minute however many endpoints there are.
+#
+# Each endpoint is saved with the seconds it had left. The Pico's clock starts again
+# when it is powered up, so when it has gone backwards the time spent restarting can't
+# be known and the endpoints are given the seconds they had left; otherwise the time
+# since the directory was saved is taken off. Set config.directory_file to None to
+# turn this off.
+SAVE_DELAY_MS = 2000
+REFRESH_SAVE_MS = 30000
+
+directory_file = getattr(config, 'directory_file', 'directory.json')
+save_due = None  # time.ticks_ms() when the changes waiting are to be written.
+save_wanted = asyncio.Event()  # Set when changes are waiting to be written.
+saves = 0  # Times the directory has been written.
+loaded = 0  # Endpoints loaded when the node started.
+
+
+def save_later(delay_ms):
+    global save_due
+    if directory_file is None:
+        return
+
+    due = time.ticks_add(time.ticks_ms(), delay_ms)
+    if save_due is None or time.ticks_diff(due, save_due) < 0:
+        save_due = due
+        save_wanted.set()
+
+
+# Writes the directory an endpoint at a time, to a new file that then replaces the old
+# one, so a restart part way through leaves the last directory saved.
+def save_directory():
+    global saves
+    now = int(time.time())
+    with open(directory_file + '.new', 'w') as file:
+        file.write('{"saved": %s, "version": %s, "endpoints": [' % (now, version))
+        separator = ''
+        for name in list(directory):
+            slot = directory.get(name)
+            if slot is not None:
+                file.write(separator)
+                file.write(json.dumps([name, endpoint_ips[name], slot_roles[slot], slot_expiries[slot] - now]))
+                separator = ', '
+        file.write(']}')
+    os.rename(directory_file + '.new', directory_file)
+    saves += 1
+
+
+def load_directory():
+    global version, loaded
+    if directory_file is None:
+        return
+
+    try:
+        with open(directory_file) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return  # Nothing has been saved yet.
+
+    now = int(time.time())
+    elapsed = max(0, now - state['saved'])
+    for name, ip, role, remaining in state['endpoints']:
+        if remaining - elapsed > 0:
+            set_endpoint(name, ip, role, now + remaining - elapsed)
+            loaded += 1
+
+    # Endpoints may have changed while the node was restarting, so the version moves
+    # on from the one saved for endpoints to drop the lookups they have cached. The
+    # changes made loading it are not numbered from that version so are forgotten.
+    version = state['version'] + 1
+    forget_changes()
+    logger.info('Loaded %s endpoints from %s.', loaded, directory_file)
+
+
+async def save_task():
+    global save_due
+    while True:
+        await save_wanted.wait()
+        save_wanted.clear()
+        wait_ms = time.ticks_diff(save_due, time.ticks_ms())
+        if wait_ms > 0:
+            try:
+                await asyncio.wait_for_ms(save_wanted.wait(), wait_ms)
+                continue  # A change needs writing sooner.
+            except asyncio.TimeoutError:
+                pass
 
-        for name in to_remove:
-            del directory[name]
+        save_due = None
+        try:
+            save_directory()
+        except OSError as e:
+            logger.warning('Could not save the directory: %s', e)
 
 
 async def directory_task():
+    load_directory()
     asyncio.create_task(expire_endpoints())
+    asyncio.create_task(save_task())
 
 
 pico.directory_task = directory_task
+pico.message_received = refresh_from_message
@@ -1,6 +1,6 @@
 # This is a sample application that repeatedly sends blink messages to all hardcoded
 # known nodes. This is for testing only
-import config
+import logger
 import directory
 import messages
 import pico
@@ -41,7 +41,7 @@ nodes = [PINK, BLUE, GREEN, ORANGE]
 # Custom messages
 
 async def respond_to_turn_on_all_lights(method, request, headers, response_headers):
-    if config.logging: print("Responding to turn on all lights message.")
+    logger.debug("Responding to turn on all lights message.")
 
     tasks = [messages.send_light_on_message(node) for node in nodes]
     await asyncio.gather(*tasks)
@@ -52,7 +52,7 @@ async def respond_to_turn_on_all_lights(method, request, headers, response_heade
 
 
 async def respond_to_turn_off_all_lights(method, request, headers, response_headers):
-    if config.logging: print("Responding to turn off all lights message.")
+    logger.debug("Responding to turn off all lights message.")
 
     tasks = [messages.send_light_off_message(node) for node in nodes]
     await asyncio.gather(*tasks)
@@ -63,7 +63,7 @@ async def respond_to_turn_off_all_lights(method, request, headers, response_head
 
 
 async def respond_to_blink_all_lights(method, request, headers, response_headers):
-    if config.logging: print("Responding to blink all lights message.")
+    logger.debug("Responding to blink all lights message.")
 
     tasks = [messages.send_light_blink_message(node) for node in nodes]
     await asyncio.gather(*tasks)
@@ -79,7 +79,7 @@ pico.message_responders[BLINK_ALL_LIGHTS] = respond_to_blink_all_lights
 
 
 async def respond_to_directory_local_blink_all(method, request, headers, response_headers):
-    if config.logging: print("Responding to local blink all nodes message.")
+    logger.debug("Responding to local blink all nodes message.")
 
     all_nodes = await directory.lookup_all_endpoints()
     tasks = [messages.send_light_blink_message(ip) for ip in all_nodes.values()]
@@ -91,7 +91,7 @@ async def respond_to_directory_local_blink_all(method, request, headers, respons
 
 
 async def respond_to_directory_local_blink_role_blue(method, request, headers, response_headers):
-    if config.logging: print("Responding to local blink blue role message.")
+    logger.debug("Responding to local blink blue role message.")
 
     blue_role_nodes = await directory.lookup_endpoints_by_role("role-blue")
     tasks = [messages.send_light_blink_message(ip) for ip in blue_role_nodes.values()]
@@ -103,7 +103,7 @@ async def respond_to_directory_local_blink_role_blue(method, request, headers, r
 
 
 async def respond_to_directory_local_blink_node_pink(method, request, headers, response_headers):
-    if config.logging: print("Responding to local blink pink node message.")
+    logger.debug("Responding to local blink pink node message.")
 
     pink_node = await directory.lookup_endpoint_by_name("pink")
     if len(pink_node) > 0:
@@ -120,11 +120,11 @@ pico.message_responders[DIRECTORY_BLINK_LOCAL_PINK_NODE_LIGHTS] = respond_to_dir
 
 
 async def respond_to_directory_remote_blink_all(method, request, headers, response_headers):
-    if config.logging: print("Responding to remote blink all nodes message.")
-    if config.coordinator is None:
+    logger.debug("Responding to remote blink all nodes message.")
+    if messages.coordinator is None:
         return
 
-    all_ips = await messages.send_lookup_all_message(config.coordinator)
+    all_ips = await messages.send_lookup_all_message(messages.coordinator)
     tasks = [messages.send_light_blink_message(ip) for ip in all_ips]
     await asyncio.gather(*tasks)
 
@@ -134,11 +134,11 @@ async def respond_to_directory_remote_blink_all(method, request, headers, respon
 
 
 async def respond_to_directory_remote_blink_role_green(method, request, headers, response_headers):
-    if config.logging: print("Responding to remote blink green role message.")
-    if config.coordinator is None:
+    logger.debug("Responding to remote blink green role message.")
+    if messages.coordinator is None:
         return
 
-    all_ips = await messages.send_lookup_role_message(config.coordinator, 'role-green')
+    all_ips = await messages.send_lookup_role_message(messages.coordinator, 'role-green')
     tasks = [messages.send_light_blink_message(ip) for ip in all_ips]
     await asyncio.gather(*tasks)
 
@@ -148,11 +148,11 @@ async def respond_to_directory_remote_blink_role_green(method, request, headers,
 
 
 async def respond_to_directory_remote_blink_node_orange(method, request, headers, response_headers):
-    if config.logging: print("Responding to remote blink orange node message.")
-    if config.coordinator is None:
+    logger.debug("Responding to remote blink orange node message.")
+    if messages.coordinator is None:
         return
 
-    ip = await messages.send_lookup_name_message(config.coordinator, 'orange')
+    ip = await messages.send_lookup_name_message(messages.coordinator, 'orange')
     if len(ip) > 0:
         await messages.send_light_blink_message(ip)
 
@@ -170,7 +170,7 @@ make_blink = False
 
 
 async def blink_all_lights():
-    if config.logging: print("Sending message to blink all lights.")
+    logger.debug("Sending message to blink all lights.")
     tasks = [messages.send_light_blink_message(node) for node in nodes]
     await asyncio.gather(*tasks)
 
@@ -179,8 +179,8 @@ async def blink_all_lights():
 async def background_tasks():
     global blinking_enabled, make_blink
     while True:
-        if config.coordinator is not None:
-            await messages.send_light_blink_message(config.coordinator)
+        if messages.coordinator is not None:
+            await messages.send_light_blink_message(messages.coordinator)
             await asyncio.sleep(3)
 
         if make_blink:
@@ -200,13 +200,13 @@ button2 = Button(20)
 
 
 def button1_event():
-    if config.logging: print("***** Button 1 pressed")
+    logger.debug("***** Button 1 pressed")
     global make_blink
     make_blink = True
 
 
 def button2_event():
-    if config.logging: print("***** Button 2 pressed")
+    logger.debug("***** Button 2 pressed")
     global blinking_enabled
     blinking_enabled = not blinking_enabled
 
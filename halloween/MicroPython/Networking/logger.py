@@ -0,0 +1,160 @@
+import config
+
+VERSION: str = "0.1.1"
+
+# Logging for all nodes. Messages are only formatted when they are read, not when they
+# are logged, so logging a message below the current level costs a function call and
+# logging one at or above it costs storing a reference in a ring buffer held in RAM.
+# The ring buffer can be read at /log. When config.logging is True each message is
+# also printed as it is logged, which is slow, so it is only for development. Strings
+# and numbers are kept as they are; any other argument, such as a dictionary or an
+# exception, is turned into a string when it is logged, so the ring buffer doesn't
+# keep it alive or show what it was changed to later.
+#
+#   logger.debug("Sending message '%s' to %s.", request, node)
+#
+# config.log_level sets the lowest level kept ("debug", "info", "warning" or "error"),
+# defaulting to debug when config.logging is True and info otherwise. If
+# config.log_file is set the ring buffer is also appended to that file in batches.
+import os
+import time
+import uasyncio as asyncio
+from array import array
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+
+LOG_SIZE = 64  # Messages kept in the ring buffer.
+FLUSH_MS = 10000  # How often the ring buffer is written to the log file.
+FILE_MAX_BYTES = 32768  # The log file is moved to log_file.1 when it grows beyond this.
+
+to_console = config.logging
+level = LEVELS.get(getattr(config, 'log_level', ''), DEBUG if config.logging else INFO)
+log_file = getattr(config, 'log_file', None)
+
+# The ring buffer, allocated up front. Each message has the time it was logged, its
+# level, the message and the arguments to format it with.
+ring_ticks = array('I', [0] * LOG_SIZE)
+ring_levels = bytearray(LOG_SIZE)
+ring_messages = [None] * LOG_SIZE
+ring_args = [None] * LOG_SIZE
+ring_next = 0  # Where the next message goes.
+logged = 0  # Messages logged since the node started.
+flushed = 0  # Messages written to the log file.
+
+
+KEPT_TYPES = (str, int, float)
+
+
+# Returns the arguments with any that are not kept as they are turned into strings.
+def kept_args(args):
+    for arg in args:
+        if arg is not None and not isinstance(arg, KEPT_TYPES):
+            return tuple([arg if arg is None or isinstance(arg, KEPT_TYPES) else str(arg) for arg in args])
+    return args
+
+
+def log(message_level, message, args):
+    global ring_next, logged
+    args = kept_args(args)
+    i = ring_next
+    ring_ticks[i] = time.ticks_ms()
+    ring_levels[i] = message_level
+    ring_messages[i] = message
+    ring_args[i] = args
+    ring_next = (i + 1) % LOG_SIZE
+    logged += 1
+
+    if to_console:
+        print(format_message(i))
+
+
+def debug(message, *args):
+    if level <= DEBUG:
+        log(DEBUG, message, args)
+
+
+def info(message, *args):
+    if level <= INFO:
+        log(INFO, message, args)
+
+
+def warning(message, *args):
+    if level <= WARNING:
+        log(WARNING, message, args)
+
+
+def error(message, *args):
+    if level <= ERROR:
+        log(ERROR, message, args)
+
+
+def format_message(i):
+    message = ring_messages[i]
+    args = ring_args[i]
+    if len(args) > 0:
+        try:
+            message = message % args
+        except Exception:
+            message = '%s %s' % (message, args)
+
+    return '%s %s %s' % (ring_ticks[i], LEVEL_NAMES[ring_levels[i]], message)
+
+
+# Returns the messages logged since the count given that are still in the ring buffer,
+# oldest first, with at least the level given.
+def messages(since=0, minimum=DEBUG):
+    first = max(since, logged - LOG_SIZE)
+    lines = []
+    for count in range(first, logged):
+        i = count % LOG_SIZE
+        if ring_levels[i] >= minimum:
+            lines.append(format_message(i))
+
+    return lines
+
+
+def rotate():
+    try:
+        os.remove(log_file + '.1')
+    except OSError:
+        pass  # There is no older log file.
+    os.rename(log_file, log_file + '.1')
+
+
+# Appends the messages logged since the last flush to the log file in a single write.
+def flush():
+    global flushed
+    if log_file is None or flushed == logged:
+        return
+
+    since = flushed
+    flushed = logged
+    if since < logged - LOG_SIZE:
+        lines = ['%s messages were lost' % (logged - LOG_SIZE - since)]
+    else:
+        lines = []
+    lines.extend(messages(since))
+
+    try:
+        if os.stat(log_file)[6] > FILE_MAX_BYTES:
+            rotate()
+    except OSError:
+        pass  # There is no log file yet.
+
+    with open(log_file, 'a') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+async def flush_task():
+    while True:
+        await asyncio.sleep_ms(FLUSH_MS)
+        try:
+            flush()
+        except Exception as e:
+            print("An exception occurred writing the log file: %s" % e)
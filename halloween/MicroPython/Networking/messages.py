@@ -1,10 +1,11 @@
 import config
+import logger
 import pico
 import directory
 
-VERSION: str = "0.3.9"
+VERSION: str = "0.6.6"
 
-import os, gc, machine
+import os, gc, json, machine
 import uasyncio as asyncio
 
 import time
@@ -13,10 +14,14 @@ import time
 HEADER_CONTENT_TYPE = 'Content-type'
 CONTENT_TYPE_PLAIN = 'text/plain'
 CONTENT_TYPE_HTML = 'text/html'
+CONTENT_TYPE_JSON = 'application/json'
 
 # All nodes
 ROOT_MESSAGE = '/'
 INSPECT_MESSAGE = '/inspect'
+INSPECT_JSON_MESSAGE = '/inspect/json'
+METRICS_MESSAGE = '/metrics'
+LOG_MESSAGE = '/log'  # The DATA header can give the lowest level to return, such as warning.
 LED_ON_MESSAGE = "/led/on"
 LED_OFF_MESSAGE = "/led/off"
 LED_BLINK_MESSAGE = "/led/blink"
@@ -28,6 +33,7 @@ NAME_MESSAGE = '/name'
 RESTART_MESSAGE = '/restart'
 REGISTER_SELF_MESSAGE = '/register/self'
 UNREGISTER_SELF_MESSAGE = '/unregister/self'
+COORDINATOR_MESSAGE = '/coordinator'  # Sent by a standby coordinator when it takes over.
 
 # Primarily for coordinator nodes
 REGISTER_MESSAGE = '/register'
@@ -36,6 +42,7 @@ HEARTBEAT_MESSAGE = '/heartbeat'
 LOOKUP_ALL_MESSAGE = '/lookup/all'
 LOOKUP_NAME_MESSAGE = '/lookup/name'
 LOOKUP_ROLE_MESSAGE = '/lookup/role'
+REPLICATE_MESSAGE = '/replicate'  # Directory changes sent by a primary coordinator to its standby.
 
 ALIVE_RESPONSE_YES = 'Yes'
 RESTART_RESPONSE_YES = 'Yes'
@@ -43,6 +50,15 @@ REGISTER_RESPONSE_YES = 'Registered'
 REGISTER_RESPONSE_NO = 'No coordinator'
 UNREGISTER_RESPONSE_YES = 'Unregistered'
 UNREGISTER_RESPONSE_NO = 'No coordinator'
+REPLICATE_RESPONSE_ACTIVE = 'Active'
+REPLICATE_RESPONSE_REFUSED = 'Not my primary'  # A standby only takes changes from its primary.
+HEARTBEAT_RESPONSE_YES = 'Heartbeat'
+STANDING_BY_RESPONSE = 'Standing by'  # A standby refuses endpoints until it takes over.
+
+# Sending these again while they are in flight changes nothing, so the sends are shared.
+for request in (LED_ON_MESSAGE, LED_OFF_MESSAGE, ALIVE_MESSAGE, ROLE_MESSAGE, NAME_MESSAGE, REGISTER_MESSAGE,
+                HEARTBEAT_MESSAGE, LOOKUP_ALL_MESSAGE, LOOKUP_NAME_MESSAGE, LOOKUP_ROLE_MESSAGE):
+    pico.idempotent_requests.add(request)
 
 from machine import Pin
 
@@ -57,78 +73,165 @@ async def restart_node(seconds):
 # ********************************************************************************
 # Standard response handlers for all nodes
 # ********************************************************************************
-# Status response which returns a web page of all node data.
-async def respond_to_inspect_message(method, request, headers, response_headers):
-    html = """<!DOCTYPE html>
-    <html>
-        <head><title>%s Inspect</title></head>
-        <body>
-            <h1>Inspect details for node: %s</h1>
-            <p>Network: %s</p>
-            <p>IP Address: %s</p>
-            <p>Version of pico.py: %s</p>
-            <p>Version of directory.py: %s</p>
-            <p>Version of messages.py: %s</p>
-            <p>Name: %s</p>
-            <p>Coordinator: %s</p>
-            <p>Role: %s</p>
-            <p>Logging: %s</p>
-            <h2>Machine info</h2>
-            <p>CPU Frequency: %s Mhz</p>
-            <p>Heap RAM used: %s bytes</p>
-            <p>Heap RAM free: %s bytes</p>
-            <p>Free storage: %s Kb</p>
-            <h2>Supported messages</h2>
-            %s
-            %s
-        </body>
-    </html>
-    """
-    supported_messages = ""
-    try:
-        for route in sorted(pico.message_responders):
-            supported_messages += "<p>%s</p>" % route
-    except:
-        if config.logging: print("An exception occurred producing supported messages for inspect!")
-
-    nodes = "<h2>Directory</h2><p>Time now: %s</p>" % time.time()
-
-    try:
-        for key, value in directory.directory.items():
-            nodes += ("<p>%s has IP: %s; Role: %s; Expiry: %s</p>" %
-                      (key, value[directory.IP], value[directory.ROLE], value[directory.EXPIRE]))
-    except:
-        if config.logging: print("An exception occurred producing directory of nodes for inspect!")
-
+# The node's details shown by /inspect and /inspect/json, in sections each with a
+# heading and (label, key, value, units) for each detail.
+def inspect_sections():
     # From: https://raspberrypi.stackexchange.com/questions/140902/useful-statistics-from-pi-pico
-    cpu_freq = machine.freq() / 1000000
-    heap_ram_used = gc.mem_alloc()
-    heap_ram_free = gc.mem_free()
     s = os.statvfs('/')
-    storage_free = s[0] * s[3] / 1024
-
-    response = html % (
-        config.name,
-        config.name,
-        config.ssid,
-        pico.ip,
-        pico.VERSION,
-        directory.VERSION,
-        VERSION,
-        config.name,
-        config.coordinator,
-        config.role,
-        config.logging,
-        cpu_freq,
-        heap_ram_used,
-        heap_ram_free,
-        storage_free,
-        supported_messages,
-        nodes,
+    return (
+        (None, (
+            ('Network', 'network', config.ssid, ''),
+            ('IP Address', 'ip', pico.ip, ''),
+            ('Version of pico.py', 'pico_version', pico.VERSION, ''),
+            ('Version of directory.py', 'directory_version', directory.VERSION, ''),
+            ('Version of messages.py', 'messages_version', VERSION, ''),
+            ('Name', 'name', config.name, ''),
+            ('Coordinator', 'coordinator', config.coordinator, ''),
+            ('Role', 'role', config.role, ''),
+            ('Logging', 'logging', logger.LEVEL_NAMES[logger.level], ''),
+        )),
+        ('Machine info', (
+            ('CPU Frequency', 'cpu_mhz', machine.freq() / 1000000, ' Mhz'),
+            ('Heap RAM used', 'heap_used', gc.mem_alloc(), ' bytes'),
+            ('Heap RAM free', 'heap_free', gc.mem_free(), ' bytes'),
+            ('Free storage', 'storage_free_kb', s[0] * s[3] / 1024, ' Kb'),
+        )),
+        ('Server', (
+            ('Connections active', 'connections_active', pico.server_active, ''),
+            ('Connections allowed', 'connections_allowed', pico.SERVER_MAX_CONNECTIONS, ''),
+            ('Connections accepted', 'connections_accepted', pico.server_accepted, ''),
+            ('Connections queued', 'connections_queued', pico.server_queued, ''),
+            ('Connections shed', 'connections_shed', pico.server_shed, ''),
+            ('Idle connections closed for another', 'idle_closed', pico.server_idle_closed, ''),
+            ('Messages received too late', 'late_dropped', pico.late_dropped, ''),
+        )),
+        ('Lookups', (
+            ('Lookups cached', 'lookups_cached', len(lookup_cache), ''),
+            ('Lookups answered from the cache', 'lookup_cache_hits', lookup_cache_hits, ''),
+            ('Lookups sent to the coordinator', 'lookup_cache_misses', lookup_cache_misses, ''),
+        )),
+        ('Heartbeats', (
+            ('Heartbeats sent', 'heartbeats_sent', heartbeats_sent, ''),
+            ('Registrations refreshed by messages', 'directory_refreshes', directory.refreshes, ''),
+        )),
+        ('Directory', (
+            ('Endpoints registered', 'directory_endpoints', len(directory.directory), ''),
+            ('Endpoints loaded from flash', 'directory_loaded', directory.loaded, ''),
+            ('Times written to flash', 'directory_saves', directory.saves, ''),
+        )),
+        ('Failover', (
+            ('Coordinator in use', 'coordinator_in_use', coordinator, ''),
+            ('Standby coordinator', 'standby', standby, ''),
+            ('Primary coordinator', 'primary', primary, ''),
+            ('Standing by', 'standing_by', standing_by, ''),
+            ('Replicated directory version', 'replica_version', replica_version, ''),
+            ('Failovers', 'failovers', failovers, ''),
+            ('Last failover took', 'failover_ms', failover_ms, ' ms'),
+        )),
     )
 
+
+# The supported messages, the destinations and the directory can be any size, so the
+# page is produced a piece at a time as it is sent rather than built up in memory.
+# Entries added or removed while it is being sent may or may not be shown.
+def inspect_html():
+    yield ('<!DOCTYPE html>\n<html>\n<head><title>%s Inspect</title></head>\n<body>\n'
+           '<h1>Inspect details for node: %s</h1>\n' % (config.name, config.name))
+    for heading, details in inspect_sections():
+        if heading is not None:
+            yield '<h2>%s</h2>\n' % heading
+        for label, key, value, units in details:
+            yield '<p>%s: %s%s</p>\n' % (label, value, units)
+
+    yield '<h2>Destinations</h2>\n'
+    for node in list(pico.destination_stats):
+        stats = pico.destination_stats.get(node)
+        if stats is not None:
+            yield ('<p>%s timeouts: %s; dropped: %s; coalesced: %s</p>\n' %
+                   (node, stats[pico.STAT_TIMEOUTS], stats[pico.STAT_DROPPED], stats[pico.STAT_COALESCED]))
+
+    yield '<h2>Supported messages</h2>\n'
+    for route in sorted(pico.message_responders):
+        yield '<p>%s</p>\n' % route
+    for route in sorted(pico.route_patterns()):
+        yield '<p>%s</p>\n' % route
+
+    yield '<h2>Directory</h2>\n<p>Time now: %s</p>\n' % time.time()
+    for name in list(directory.directory):
+        value = directory.endpoint(name)
+        if value is not None:
+            yield ('<p>%s has IP: %s; Role: %s; Expiry: %s</p>\n' %
+                   (name, value[directory.IP], value[directory.ROLE], value[directory.EXPIRE]))
+
+    yield '</body>\n</html>\n'
+
+
+# The same as inspect_html() as compact JSON for tools.
+def inspect_json():
+    separator = '{'
+    for heading, details in inspect_sections():
+        for label, key, value, units in details:
+            yield '%s"%s":%s' % (separator, key, json.dumps(value))
+            separator = ','
+
+    yield ',"destinations":{'
+    separator = ''
+    for node in list(pico.destination_stats):
+        stats = pico.destination_stats.get(node)
+        if stats is not None:
+            yield ('%s%s:{"timeouts":%s,"dropped":%s,"coalesced":%s}' %
+                   (separator, json.dumps(node), stats[pico.STAT_TIMEOUTS], stats[pico.STAT_DROPPED],
+                    stats[pico.STAT_COALESCED]))
+            separator = ','
+
+    yield '},"messages":['
+    separator = ''
+    for route in sorted(pico.message_responders):
+        yield separator + json.dumps(route)
+        separator = ','
+    for route in sorted(pico.route_patterns()):
+        yield separator + json.dumps(route)
+        separator = ','
+
+    yield '],"time":%s,"directory":{' % time.time()
+    separator = ''
+    for name in list(directory.directory):
+        value = directory.endpoint(name)
+        if value is not None:
+            yield ('%s%s:{"ip":%s,"role":%s,"expire":%s}' %
+                   (separator, json.dumps(name), json.dumps(value[directory.IP]),
+                    json.dumps(value[directory.ROLE]), value[directory.EXPIRE]))
+            separator = ','
+
+    yield '}}'
+
+
+# Status response which returns a web page of all node data.
+async def respond_to_inspect_message(method, request, headers, response_headers):
+    logger.debug("Responding to inspect message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_HTML
-    return response
+    return inspect_html()
+
+
+async def respond_to_inspect_json_message(method, request, headers, response_headers):
+    logger.debug("Responding to inspect JSON message.")
+    response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_JSON
+    return inspect_json()
+
+
+# Counters and latency histograms for each route and node as comma separated values.
+async def respond_to_metrics_message(method, request, headers, response_headers):
+    logger.debug("Responding to metrics message.")
+    response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
+    return '\n'.join(pico.metrics_lines())
+
+
+# The messages in the log's ring buffer, oldest first.
+async def respond_to_log_message(method, request, headers, response_headers):
+    logger.debug("Responding to log message.")
+    response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
+    minimum = logger.LEVELS.get(headers[pico.HEADER_DATA].lower(), logger.DEBUG)
+    return '\n'.join(logger.messages(0, minimum))
 
 
 async def respond_to_led_on(method, request, headers, response_headers):
@@ -157,6 +260,9 @@ async def respond_to_led_blink(method, request, headers, response_headers):
 
 pico.message_responders[ROOT_MESSAGE] = respond_to_inspect_message
 pico.message_responders[INSPECT_MESSAGE] = respond_to_inspect_message
+pico.message_responders[INSPECT_JSON_MESSAGE] = respond_to_inspect_json_message
+pico.message_responders[METRICS_MESSAGE] = respond_to_metrics_message
+pico.message_responders[LOG_MESSAGE] = respond_to_log_message
 pico.message_responders[LED_ON_MESSAGE] = respond_to_led_on
 pico.message_responders[LED_OFF_MESSAGE] = respond_to_led_off
 pico.message_responders[LED_BLINK_MESSAGE] = respond_to_led_blink
@@ -166,7 +272,7 @@ pico.message_responders[LED_BLINK_MESSAGE] = respond_to_led_blink
 # Standard request methods for all nodes
 # ********************************************************************************
 async def send_light_on_off_message(node, state):
-    await pico.send_message(node, "GET", b"/led/%s" % state)
+    await pico.send_nowait(node, "GET", "/led/%s" % state, priority=pico.PRIORITY_BACKGROUND)
 
 
 async def send_light_on_message(node):
@@ -185,28 +291,28 @@ async def send_light_blink_message(node):
 # Standard response handlers for endpoints.
 # ********************************************************************************
 async def respond_to_alive_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to alive message.")
+    logger.debug("Responding to alive message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
     response_headers[pico.HEADER_DATA] = ALIVE_RESPONSE_YES
     return response_headers[pico.HEADER_DATA]
 
 
 async def respond_to_role_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to role message.")
+    logger.debug("Responding to role message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
     response_headers[pico.HEADER_DATA] = config.role
     return response_headers[pico.HEADER_DATA]
 
 
 async def respond_to_name_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to name message.")
+    logger.debug("Responding to name message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
     response_headers[pico.HEADER_DATA] = config.name
     return response_headers[pico.HEADER_DATA]
 
 
 async def respond_to_restart_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to restart message.")
+    logger.debug("Responding to restart message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
     response_headers[pico.HEADER_DATA] = RESTART_RESPONSE_YES
     asyncio.create_task(restart_node(5))
@@ -215,10 +321,10 @@ async def respond_to_restart_message(method, request, headers, response_headers)
 
 
 async def respond_to_register_self_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to register self message.")
+    logger.debug("Responding to register self message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
-    if config.coordinator is not None:
-        await send_register_message(config.coordinator)
+    if coordinator is not None:
+        await send_register_message(coordinator)
         response_headers[pico.HEADER_DATA] = REGISTER_RESPONSE_YES
     else:
         response_headers[pico.HEADER_DATA] = REGISTER_RESPONSE_NO
@@ -227,10 +333,10 @@ async def respond_to_register_self_message(method, request, headers, response_he
 
 
 async def respond_to_unregister_self_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to unregister self message.")
+    logger.debug("Responding to unregister self message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
-    if config.coordinator is not None:
-        await send_unregister_message(config.coordinator)
+    if coordinator is not None:
+        await send_unregister_message(coordinator)
         response_headers[pico.HEADER_DATA] = UNREGISTER_RESPONSE_YES
     else:
         response_headers[pico.HEADER_DATA] = UNREGISTER_RESPONSE_NO
@@ -249,35 +355,37 @@ pico.message_responders[UNREGISTER_SELF_MESSAGE] = respond_to_unregister_self_me
 # ********************************************************************************
 # Standard request methods to send to an endpoint.
 # ********************************************************************************
+# Each returns an empty result if the endpoint did not respond, or the message was
+# dropped, which background messages are when the node is busy.
 async def send_alive_message(ip):
-    if config.logging: print("Sending alive message to %s." % ip)
-    headers = await pico.send_message(ip, "GET", ALIVE_MESSAGE)
-    alive = headers[pico.HEADER_DATA]
-    if config.logging: print("Alive response for %s is %s." % (ip, alive))
+    logger.debug("Sending alive message to %s.", ip)
+    headers = await pico.send_message(ip, "GET", ALIVE_MESSAGE, priority=pico.PRIORITY_BACKGROUND)
+    alive = '' if headers is None else headers[pico.HEADER_DATA]
+    logger.debug("Alive response for %s is %s.", ip, alive)
     return alive == ALIVE_RESPONSE_YES
 
 
 async def send_role_message(ip):
-    if config.logging: print("Sending role message to %s." % ip)
-    headers = await pico.send_message(ip, "GET", ROLE_MESSAGE)
-    role = headers[pico.HEADER_DATA]
-    if config.logging: print("Role for %s is %s." % (ip, role))
+    logger.debug("Sending role message to %s.", ip)
+    headers = await pico.send_message(ip, "GET", ROLE_MESSAGE, priority=pico.PRIORITY_BACKGROUND)
+    role = '' if headers is None else headers[pico.HEADER_DATA]
+    logger.debug("Role for %s is %s.", ip, role)
     return role
 
 
 async def send_name_message(ip):
-    if config.logging: print("Sending name message to %s." % ip)
-    headers = await pico.send_message(ip, "GET", NAME_MESSAGE)
-    name = headers[pico.HEADER_DATA]
-    if config.logging: print("Name for %s is %s." % (ip, name))
+    logger.debug("Sending name message to %s.", ip)
+    headers = await pico.send_message(ip, "GET", NAME_MESSAGE, priority=pico.PRIORITY_BACKGROUND)
+    name = '' if headers is None else headers[pico.HEADER_DATA]
+    logger.debug("Name for %s is %s.", ip, name)
     return name
 
 
 async def send_restart_message(ip):
-    if config.logging: print("Sending restart message to %s." % ip)
+    logger.debug("Sending restart message to %s.", ip)
     headers = await pico.send_message(ip, "GET", RESTART_MESSAGE)
-    restart = headers[pico.HEADER_DATA]
-    if config.logging: print("Restart response for %s is %s." % (ip, restart))
+    restart = '' if headers is None else headers[pico.HEADER_DATA]
+    logger.debug("Restart response for %s is %s.", ip, restart)
     return restart == RESTART_RESPONSE_YES
 
 
@@ -285,19 +393,26 @@ async def send_restart_message(ip):
 # Standard response handlers for coordinators.
 # ********************************************************************************
 async def respond_to_register_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to register message.")
+    logger.debug("Responding to register message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
+    if standing_by:
+        response_headers[pico.HEADER_DATA] = STANDING_BY_RESPONSE
+        return response_headers[pico.HEADER_DATA]
 
     result = await directory.register_endpoint(
         headers[pico.HEADER_SENDER], headers[pico.HEADER_NAME], headers[pico.HEADER_ROLE])
     response_headers[pico.HEADER_DATA] = result
+    response_headers[pico.HEADER_DIRECTORY_VERSION] = str(directory.version)
 
     return result
 
 
 async def respond_to_unregister_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to unregister message.")
+    logger.debug("Responding to unregister message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
+    if standing_by:
+        response_headers[pico.HEADER_DATA] = STANDING_BY_RESPONSE
+        return response_headers[pico.HEADER_DATA]
 
     result = await directory.unregister_endpoint(
         headers[pico.HEADER_SENDER], headers[pico.HEADER_NAME], headers[pico.HEADER_ROLE])
@@ -307,18 +422,22 @@ async def respond_to_unregister_message(method, request, headers, response_heade
 
 
 async def respond_to_heartbeat_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to heartbeat message.")
+    logger.debug("Responding to heartbeat message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
+    if standing_by:
+        response_headers[pico.HEADER_DATA] = STANDING_BY_RESPONSE
+        return response_headers[pico.HEADER_DATA]
 
     result = await directory.heartbeat_from_endpoint(
         headers[pico.HEADER_SENDER], headers[pico.HEADER_NAME], headers[pico.HEADER_ROLE])
     response_headers[pico.HEADER_DATA] = result
+    response_headers[pico.HEADER_DIRECTORY_VERSION] = str(directory.version)
 
     return result
 
 
 async def respond_to_lookup_all_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to lookup all message.")
+    logger.debug("Responding to lookup all message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
 
     # This returns a dictionary of names to IPs.
@@ -330,7 +449,7 @@ async def respond_to_lookup_all_message(method, request, headers, response_heade
 
 
 async def respond_to_lookup_name_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to lookup name message.")
+    logger.debug("Responding to lookup name message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
 
     result = await directory.lookup_endpoint_by_name(headers[pico.HEADER_DATA])
@@ -340,7 +459,7 @@ async def respond_to_lookup_name_message(method, request, headers, response_head
 
 
 async def respond_to_lookup_role_message(method, request, headers, response_headers):
-    if config.logging: print("Responding to lookup role message.")
+    logger.debug("Responding to lookup role message.")
     response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
 
     # This returns a dictionary of names to IPs.
@@ -362,76 +481,433 @@ pico.message_responders[LOOKUP_ROLE_MESSAGE] = respond_to_lookup_role_message
 # ********************************************************************************
 # Standard request methods to send to a coordinator.
 # ********************************************************************************
+# Returns True if the coordinator registered this node.
 async def send_register_message(ip):
-    if config.logging: print("Sending register message to %s." % ip)
-    await pico.send_message(ip, "GET", REGISTER_MESSAGE)
+    logger.debug("Sending register message to %s.", ip)
+    headers = await pico.send_message(ip, "GET", REGISTER_MESSAGE)
+    if headers is None or headers[pico.HEADER_DATA] != REGISTER_RESPONSE_YES:
+        return False
+
+    pico.record_boot_phase('registered')
+    return True
 
 
 async def send_unregister_message(ip):
-    if config.logging: print("Sending unregister message to %s." % ip)
+    logger.debug("Sending unregister message to %s.", ip)
     await pico.send_message(ip, "GET", UNREGISTER_MESSAGE)
 
 
+# Returns True if the coordinator took the heartbeat.
 async def send_heartbeat_message(ip):
-    if config.logging: print("Sending heartbeat message to %s." % ip)
-    await pico.send_message(ip, "GET", HEARTBEAT_MESSAGE)
+    logger.debug("Sending heartbeat message to %s.", ip)
+    headers = await pico.send_message(ip, "GET", HEARTBEAT_MESSAGE, priority=pico.PRIORITY_BACKGROUND)
+    return headers is not None and headers[pico.HEADER_DATA] == HEARTBEAT_RESPONSE_YES
+
+
+# Lookups are cached so endpoints can look up the same names and roles as often as
+# they like without going to the coordinator each time. Each cached lookup expires
+# after LOOKUP_CACHE_TTL_MS, or sooner for lookups that found nothing as the node may
+# be about to register. The coordinator sends the version of its directory with its
+# responses to registered endpoints, and the whole cache is cleared
+# when it changes, so a node that moves is not looked up at its old address for long.
+LOOKUP_CACHE_TTL_MS = 60000
+LOOKUP_CACHE_NEGATIVE_TTL_MS = 10000
+LOOKUP_CACHE_MAX = 16
+
+# Keyed by (coordinator, request, data); each entry is [time it expires, result].
+lookup_cache = {}
+lookup_cache_versions = {}  # The directory version of each coordinator the cache holds.
+lookup_cache_hits = 0
+lookup_cache_misses = 0
+
+
+# Clears the cache if the coordinator's directory has changed since it was filled.
+def check_directory_version(ip, headers):
+    if len(headers[pico.HEADER_DIRECTORY_VERSION]) == 0:
+        return
+
+    version = headers[pico.HEADER_DIRECTORY_VERSION]
+    if lookup_cache_versions.get(ip) != version:
+        if ip in lookup_cache_versions:
+            logger.debug("Directory of %s changed to version %s, clearing lookups.", ip, version)
+        lookup_cache_versions[ip] = version
+        lookup_cache.clear()
+
+
+# Returns the cached result of the lookup, or None if it has not been cached.
+def cached_lookup(ip, request, data):
+    global lookup_cache_hits, lookup_cache_misses
+    key = (ip, request, data)
+    entry = lookup_cache.get(key)
+    if entry is not None and time.ticks_diff(entry[0], time.ticks_ms()) > 0:
+        lookup_cache_hits += 1
+        return entry[1]
+
+    if entry is not None:
+        del lookup_cache[key]
+    lookup_cache_misses += 1
+    return None
+
+
+def cache_lookup(ip, request, data, result):
+    if len(lookup_cache) >= LOOKUP_CACHE_MAX:
+        now = time.ticks_ms()
+        for key in [key for key, entry in lookup_cache.items() if time.ticks_diff(entry[0], now) <= 0]:
+            del lookup_cache[key]
+        if len(lookup_cache) >= LOOKUP_CACHE_MAX:
+            del lookup_cache[next(iter(lookup_cache))]
+
+    ttl = LOOKUP_CACHE_TTL_MS if len(result) > 0 else LOOKUP_CACHE_NEGATIVE_TTL_MS
+    lookup_cache[(ip, request, data)] = [time.ticks_add(time.ticks_ms(), ttl), result]
+
+
+# Returns the lookup's Data header from the cache or the coordinator, or an empty
+# string if the coordinator did not respond, which is not cached.
+async def send_lookup(ip, request, data=None):
+    result = cached_lookup(ip, request, data)
+    if result is not None:
+        return result
+
+    headers = await pico.send_message(ip, "GET", request, data)
+    if headers is None:
+        return ''
+
+    result = headers[pico.HEADER_DATA]
+    cache_lookup(ip, request, data, result)
+    return result
 
 
 # Returns all IP addresses registered with the coordinator, except ourselves
 async def send_lookup_all_message(ip):
-    if config.logging: print("Sending lookup all message to %s." % ip)
-    headers = await pico.send_message(ip, "GET", LOOKUP_ALL_MESSAGE)
-    all_ips = headers[pico.HEADER_DATA].split(",")
+    logger.debug("Sending lookup all message to %s.", ip)
+    all_ips = (await send_lookup(ip, LOOKUP_ALL_MESSAGE)).split(",")
     result = []
     for ip in all_ips:
         ip = ip.strip()
         if len(ip) > 0 and ip != pico.ip:  # Remove ourselves from the list
             result.append(ip)
 
-    if config.logging: print("All lookup return %s." % result)
+    logger.debug("All lookup return %s.", result)
     return result
 
 
 # Returns the IP address registered with the coordinator with that name (does NOT exclude ourselves)
 
 async def send_lookup_name_message(ip, name):
-    if config.logging: print("Sending lookup name message to %s for %s." % (ip, name))
-    headers = await pico.send_message(ip, "GET", LOOKUP_NAME_MESSAGE, name)
-    name_ip = headers[pico.HEADER_DATA]
-    if config.logging: print("Name %s lookup return %s." % (name, name_ip))
+    logger.debug("Sending lookup name message to %s for %s.", ip, name)
+    name_ip = await send_lookup(ip, LOOKUP_NAME_MESSAGE, name)
+    logger.debug("Name %s lookup return %s.", name, name_ip)
     return name_ip
 
 
 # Returns all IP addresses registered with the coordinator for the role, except ourselves
 
 async def send_lookup_role_message(ip, role):
-    if config.logging: print("Sending lookup role message to %s for %s." % (ip, role))
-    headers = await pico.send_message(ip, "GET", LOOKUP_ROLE_MESSAGE, role)
-    role_ips = headers[pico.HEADER_DATA].split(",")
+    logger.debug("Sending lookup role message to %s for %s.", ip, role)
+    role_ips = (await send_lookup(ip, LOOKUP_ROLE_MESSAGE, role)).split(",")
     result = []
     for role_ip in role_ips:
         role_ip = role_ip.strip()
         if len(role_ip) > 0 and ip != pico.ip:  # Remove ourselves from the list
             result.append(role_ip)
 
-    if config.logging: print("Role %s lookup return %s." % (role, result))
+    logger.debug("Role %s lookup return %s.", role, result)
     return result
 
 
-# Registers with the coordinator and periodically runs a heartbeat message.
+# The coordinator keeps an endpoint registered while it hears from it, so a heartbeat
+# is only sent once nothing has been heard back from the coordinator for
+# HEARTBEAT_INTERVAL_MS. A busy endpoint rarely needs to send one. Only responses with
+# the directory version count, as the coordinator only sends it to endpoints it has
+# registered; one that has restarted and forgotten us still answers other messages.
+# A registration or heartbeat that fails is tried again after HEARTBEAT_RETRY_MS.
+HEARTBEAT_INTERVAL_MS = 60000
+HEARTBEAT_RETRY_MS = 5000
+
+coordinator = config.coordinator  # The coordinator in use, which changes on a failover.
+coordinator_heard = time.ticks_ms()  # When the coordinator last responded to us as registered.
+heartbeats_sent = 0
+
+
+def response_received(ip, headers):
+    global coordinator_heard, primary_heard
+    check_directory_version(ip, headers)
+    if ip == coordinator:
+        if len(headers[pico.HEADER_DIRECTORY_VERSION]) > 0:
+            coordinator_heard = time.ticks_ms()
+    elif ip == primary:
+        primary_heard = time.ticks_ms()
+
+
+# Registers with the coordinator and runs a heartbeat message when needed.
 async def heartbeat():
-    await send_register_message(config.coordinator)
+    global heartbeats_sent
+    while not await send_register_message(coordinator):
+        if await fail_over_if_unreachable():
+            break
+        await asyncio.sleep_ms(HEARTBEAT_RETRY_MS)
+
+    while True:
+        quiet = time.ticks_diff(time.ticks_ms(), coordinator_heard)
+        if quiet < HEARTBEAT_INTERVAL_MS:
+            await asyncio.sleep_ms(HEARTBEAT_INTERVAL_MS - quiet)
+            continue
+
+        heartbeats_sent += 1
+        if not await send_heartbeat_message(coordinator) and not await fail_over_if_unreachable():
+            await asyncio.sleep_ms(HEARTBEAT_RETRY_MS)
+
+
+# ********************************************************************************
+# Standby coordinator
+# ********************************************************************************
+# A second coordinator can stand by to take over if the first fails. The primary has
+# config.standby set to the standby's address and sends it every change to its
+# directory, numbered by directory version, so the standby knows the same endpoints.
+# The standby has config.primary set to the primary's address. If it hears nothing
+# from the primary for PRIMARY_TIMEOUT_MS and the primary doesn't answer an alive
+# message, it takes over and tells the endpoints with a broadcast. Until then it
+# refuses registrations and heartbeats, so endpoints stay with the primary. Endpoints
+# with config.standby set also move to the other coordinator themselves once
+# FAILOVER_FAILURES messages in a row to the one they are using have had no response,
+# if the other will register them. Messages dropped before they were sent, or that
+# arrived too late, don't count. To move back, restart the standby once the primary
+# is running again.
+#
+# Each change is sent as 'version,change,name,ip,role', several to a message
+# separated by ';'. A standby that has missed changes the primary no longer has, or
+# whose primary has restarted, is sent every endpoint instead: 'version,reset'
+# followed by 'version,snapshot,name,ip,role' for each endpoint.
+REPLICATE_POLL_MS = 250  # How often the primary looks for changes to send.
+REPLICATE_KEEPALIVE_MS = 2000  # The longest the primary leaves the standby without a message.
+REPLICATE_DATA_MAX = 200  # Characters of changes in a message, so the header fits in a line.
+PRIMARY_TIMEOUT_MS = 5000  # How long the standby waits to hear from the primary.
+FAILOVER_FAILURES = 3  # Messages in a row with no response before an endpoint moves.
+
+CHANGE_RESET = 'reset'
+CHANGE_SNAPSHOT = 'snapshot'
+
+standby = getattr(config, 'standby', None)
+primary = getattr(config, 'primary', None)
+standing_by = primary is not None  # Whether this is a standby that hasn't taken over.
+primary_heard = time.ticks_ms()  # When the standby last heard from the primary.
+replica_version = None  # The primary's directory version the standby has caught up to.
+failovers = 0  # Times this node has taken over or moved to the other coordinator.
+failover_ms = None  # From last hearing from the failed coordinator to the failover.
+
+
+# Moves this endpoint to the other coordinator if it will register us, returning True
+# if it did.
+async def fail_over():
+    global coordinator, coordinator_heard, failovers, failover_ms
+    if standby is None:
+        return False
+
+    other = standby if coordinator == config.coordinator else config.coordinator
+    if not await send_register_message(other):
+        return False
+
+    failover_ms = time.ticks_diff(time.ticks_ms(), coordinator_heard)
+    failovers += 1
+    logger.warning("Moved from coordinator %s to %s, %s ms after last hearing from it.",
+                   coordinator, other, failover_ms)
+    coordinator = other
+    coordinator_heard = time.ticks_ms()
+    lookup_cache.clear()
+    return True
+
+
+async def fail_over_if_unreachable():
+    if pico.destination_failures(coordinator) < FAILOVER_FAILURES:
+        return False
+    return await fail_over()
+
+
+async def respond_to_coordinator_message(method, request, headers, response_headers):
+    logger.debug("Responding to coordinator message.")
+    response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
+    sender = headers[pico.HEADER_SENDER]
+    if coordinator is not None and sender != coordinator and sender in (config.coordinator, standby):
+        await fail_over()
+
+    response_headers[pico.HEADER_DATA] = coordinator
+    return response_headers[pico.HEADER_DATA]
+
+
+def format_change(change):
+    version, change, name, ip, role = change
+    if ip is None:
+        return '%s,%s,%s' % (version, change, name)
+    return '%s,%s,%s,%s,%s' % (version, change, name, ip, role)
+
+
+# Adds the entry to a message's entries, returning False if there is no room for it.
+def add_entry(entries, entry):
+    if len(entries) > 0 and sum([len(added) + 1 for added in entries]) + len(entry) > REPLICATE_DATA_MAX:
+        return False
+
+    entries.append(entry)
+    return True
+
+
+# Sends the standby the changes to the directory it hasn't had. acked is the version
+# the standby last said it had caught up to, None if it has none or hasn't said.
+async def replicate():
+    acked = None
+    snapshot = None  # Names still to send in a snapshot taken at snapshot_version.
+    snapshot_version = None
+    sent = time.ticks_ms()
     while True:
-        await asyncio.sleep(60)
-        await send_heartbeat_message(config.coordinator)
+        await asyncio.sleep_ms(REPLICATE_POLL_MS)
+        oldest = directory.oldest_change()
+        if (snapshot is None and acked == directory.version and
+                time.ticks_diff(time.ticks_ms(), sent) < REPLICATE_KEEPALIVE_MS):
+            continue
+
+        entries = []
+        if snapshot is None and acked != directory.version and (
+                acked is None or acked > directory.version or oldest is None or oldest > acked + 1):
+            snapshot = list(directory.directory)
+            snapshot_version = directory.version
+            entries.append('%s,%s' % (snapshot_version, CHANGE_RESET))
+
+        if snapshot is not None:
+            while len(snapshot) > 0:
+                endpoint = directory.endpoint(snapshot[-1])
+                if endpoint is not None and not add_entry(entries, '%s,%s,%s,%s,%s' % (
+                        snapshot_version, CHANGE_SNAPSHOT, snapshot[-1], endpoint[directory.IP],
+                        endpoint[directory.ROLE])):
+                    break
+                snapshot.pop()
+        else:
+            for number in range(acked + 1, directory.version + 1):
+                if not add_entry(entries, format_change(directory.change(number))):
+                    break
+
+        sent = time.ticks_ms()
+        headers = await pico.send_message(standby, "GET", REPLICATE_MESSAGE, ';'.join(entries),
+                                          priority=pico.PRIORITY_BACKGROUND)
+        if headers is None or headers[pico.HEADER_DATA] == REPLICATE_RESPONSE_ACTIVE:
+            # The standby is down or has taken over, so it is sent every endpoint once
+            # it is standing by again.
+            if headers is not None and acked is not None:
+                logger.warning("Standby coordinator %s has taken over.", standby)
+            acked = None
+            snapshot = None
+            await asyncio.sleep_ms(REPLICATE_KEEPALIVE_MS)
+            continue
+
+        data = headers[pico.HEADER_DATA]
+        if data == REPLICATE_RESPONSE_REFUSED:
+            # The standby was told another address for its primary.
+            logger.warning("Standby coordinator %s does not take changes from us.", standby)
+            acked = None
+            snapshot = None
+            await asyncio.sleep_ms(REPLICATE_KEEPALIVE_MS)
+            continue
+
+        acked = int(data) if len(data) > 0 else None
+        if snapshot is not None and (acked != snapshot_version or len(snapshot) == 0):
+            snapshot = None  # Finished, or the standby missed the start so it begins again.
+
+
+# Applies the changes sent by the primary that follow on from those already applied.
+def apply_changes(data):
+    global replica_version
+    expiry = int(time.time()) + directory.EXPIRY_S
+    for entry in data.split(';'):
+        fields = entry.split(',')
+        if len(fields) < 2:
+            continue
+
+        version = int(fields[0])
+        change = fields[1]
+        if change == CHANGE_RESET:
+            for name in list(directory.directory):
+                directory.remove_endpoint(name, directory.CHANGE_UNREGISTER)
+            replica_version = version
+        elif change == CHANGE_SNAPSHOT:
+            if version == replica_version:
+                directory.set_endpoint(fields[2], fields[3], fields[4], expiry)
+        elif replica_version is None or version > replica_version + 1:
+            break  # Changes have been missed, so the primary sends them again.
+        elif version == replica_version + 1:
+            if change == directory.CHANGE_REGISTER:
+                directory.set_endpoint(fields[2], fields[3], fields[4], expiry)
+            elif fields[2] in directory.directory:
+                directory.remove_endpoint(fields[2], change)
+            replica_version = version
+
+
+async def respond_to_replicate_message(method, request, headers, response_headers):
+    global primary_heard
+    logger.debug("Responding to replicate message.")
+    response_headers[HEADER_CONTENT_TYPE] = CONTENT_TYPE_PLAIN
+    if not standing_by:
+        response_headers[pico.HEADER_DATA] = REPLICATE_RESPONSE_ACTIVE
+    elif headers[pico.HEADER_SENDER] == primary:
+        primary_heard = time.ticks_ms()
+        apply_changes(headers[pico.HEADER_DATA])
+        response_headers[pico.HEADER_DATA] = '' if replica_version is None else str(replica_version)
+    else:
+        logger.warning("Refusing to replicate from %s, which is not the primary.", headers[pico.HEADER_SENDER])
+        response_headers[pico.HEADER_DATA] = REPLICATE_RESPONSE_REFUSED
+
+    return response_headers[pico.HEADER_DATA]
+
+
+# Takes over from the primary, expiring endpoints from now on, and tells the endpoints
+# to move to this coordinator.
+async def take_over():
+    global standing_by, failovers, failover_ms
+    standing_by = False
+    failover_ms = time.ticks_diff(time.ticks_ms(), primary_heard)
+    failovers += 1
+    directory.start_expiring()
+    logger.warning("Primary coordinator %s has failed, taking over %s ms after last hearing from it.",
+                   primary, failover_ms)
+    if not await pico.send_group_datagram(pico.DATAGRAM_GROUP_ALL, COORDINATOR_MESSAGE):
+        for ip in list(directory.endpoint_ips.values()):
+            await pico.send_nowait(ip, "GET", COORDINATOR_MESSAGE)
+
+
+# Takes over once the primary has gone quiet and doesn't answer an alive message.
+async def watch_primary():
+    global primary_heard
+    while standing_by:
+        quiet = time.ticks_diff(time.ticks_ms(), primary_heard)
+        if quiet < PRIMARY_TIMEOUT_MS:
+            await asyncio.sleep_ms(PRIMARY_TIMEOUT_MS - quiet)
+        elif await pico.send_message(primary, "GET", ALIVE_MESSAGE, priority=pico.PRIORITY_BACKGROUND) is not None:
+            primary_heard = time.ticks_ms()
+        else:
+            await take_over()
+
+
+pico.message_responders[COORDINATOR_MESSAGE] = respond_to_coordinator_message
+pico.message_responders[REPLICATE_MESSAGE] = respond_to_replicate_message
 
 
 async def messages_task():
     if config.coordinator is not None:
         asyncio.create_task(heartbeat())
+    elif standby is not None:
+        asyncio.create_task(replicate())
+
+    if primary is not None:
+        asyncio.create_task(watch_primary())
+
+
+# The coordinator may have expired this node while the network was down, so register
+# again rather than waiting for the next heartbeat.
+async def network_reconnected():
+    if coordinator is not None and not await send_register_message(coordinator):
+        await fail_over_if_unreachable()
 
 
 pico.messages_task = messages_task
+pico.network_reconnected = network_reconnected
+pico.response_received = response_received
 
 
 # This is provided to make it simpler for a node as they only need to import
@@ -1,6 +1,6 @@
 # The path nodes controls the lights and sounds down the walkway.
 # There are six lights, each of which contains two neopixels.
-import config
+import logger
 import messages
 import pico
 import neopixels
@@ -11,12 +11,14 @@ import uasyncio as asyncio
 # Custom sound messages that can be triggered.
 LIGHTS_OFF = '/lights/off'
 LIGHTS_ON = '/lights/on'  # The DATA header indicates the number of lights to enable.
-LIGHTS_ON_1 = '/lights/on/1'
-LIGHTS_ON_2 = '/lights/on/2'
-LIGHTS_ON_3 = '/lights/on/3'
-LIGHTS_ON_4 = '/lights/on/4'
-LIGHTS_ON_5 = '/lights/on/5'
-LIGHTS_ON_6 = '/lights/on/6'
+LIGHTS_ON_NUM = '/lights/on/{%s}' % pico.HEADER_DATA  # The number of lights is part of the route.
+
+# Lights that cannot be turned on within this time would be out of sync with the
+# sounds so the message is dropped instead.
+LIGHTS_ON_DEADLINE_MS = 500
+
+# Sending these again while they are in flight changes nothing, so the sends are shared.
+pico.idempotent_requests.add(LIGHTS_OFF)
 
 # NeoPixels.
 NUM_PIXELS = 12
@@ -42,17 +44,17 @@ async def turn_lights_on(num):
 
 
 async def send_lights_off_message(ip):
-    if config.logging: print("Sending lights off message to %s." % ip)
-    await pico.send_message(ip, "GET", LIGHTS_OFF)
+    logger.debug("Sending lights off message to %s.", ip)
+    await pico.send_nowait(ip, "GET", LIGHTS_OFF, priority=pico.PRIORITY_CUE)
 
 
 async def send_lights_on_message(ip, num):
-    if config.logging: print("Sending %s lights on message to %s." % (num, ip))
-    await pico.send_message(ip, "GET", LIGHTS_ON, str(num))
+    logger.debug("Sending %s lights on message to %s.", num, ip)
+    await pico.send_datagram(ip, LIGHTS_ON, str(num), ack=True, deadline_ms=LIGHTS_ON_DEADLINE_MS)
 
 
 async def respond_to_lights_off(method, request, headers, response_headers):
-    if config.logging: print("Responding to lights off message.")
+    logger.debug("Responding to lights off message.")
     await turn_lights_off()
 
     response_headers[messages.HEADER_CONTENT_TYPE] = messages.CONTENT_TYPE_PLAIN
@@ -61,7 +63,7 @@ async def respond_to_lights_off(method, request, headers, response_headers):
 
 
 async def respond_to_lights_on(method, request, headers, response_headers):
-    if config.logging: print("Responding to lights on message.")
+    logger.debug("Responding to lights on message.")
     # Extract number of lights from data header and check range value
     num = int(headers[pico.HEADER_DATA])
     if num < 0 or num > 6:
@@ -76,35 +78,6 @@ async def respond_to_lights_on(method, request, headers, response_headers):
     return response_headers[pico.HEADER_DATA]
 
 
-async def respond_to_lights_on_1(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '1'
-    return await respond_to_lights_on(method, request, headers, response_headers)
-
-
-async def respond_to_lights_on_2(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '2'
-    return await respond_to_lights_on(method, request, headers, response_headers)
-
-
-async def respond_to_lights_on_3(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '3'
-    return await respond_to_lights_on(method, request, headers, response_headers)
-
-
-async def respond_to_lights_on_4(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '4'
-    return await respond_to_lights_on(method, request, headers, response_headers)
-
-
-async def respond_to_lights_on_5(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '5'
-    return await respond_to_lights_on(method, request, headers, response_headers)
-
-
-async def respond_to_lights_on_6(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '6'
-    return await respond_to_lights_on(method, request, headers, response_headers)
-
 
 # This must not be too greedy otherwise it will interfere with the HTTP server.
 async def background_tasks():
@@ -119,12 +92,7 @@ async def background_tasks():
 def init():
     pico.message_responders[LIGHTS_OFF] = respond_to_lights_off
     pico.message_responders[LIGHTS_ON] = respond_to_lights_on
-    pico.message_responders[LIGHTS_ON_1] = respond_to_lights_on_1
-    pico.message_responders[LIGHTS_ON_2] = respond_to_lights_on_2
-    pico.message_responders[LIGHTS_ON_3] = respond_to_lights_on_3
-    pico.message_responders[LIGHTS_ON_4] = respond_to_lights_on_4
-    pico.message_responders[LIGHTS_ON_5] = respond_to_lights_on_5
-    pico.message_responders[LIGHTS_ON_6] = respond_to_lights_on_6
+    pico.add_route(LIGHTS_ON_NUM, respond_to_lights_on)
     sounds.init()
     neopixels.init()
 
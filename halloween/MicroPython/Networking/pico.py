@@ -1,9 +1,15 @@
 import config
+import logger
 
-VERSION: str = "0.2.6"
+VERSION: str = "0.3.24"
 
 # The code in this file is MicroPython and common to both the coordinator and endpoint nodes.
+import gc
+import json
 import network
+import random
+from array import array
+import socket
 import time
 import uasyncio as asyncio
 
@@ -13,82 +19,544 @@ HEADER_HOST = 'Host'  # Address this message is being sent to (i.e. us).
 HEADER_NAME = 'Name'  # Name of the sender.
 HEADER_ROLE = 'Role'  # Role of the sender.
 HEADER_DATA = 'Data'  # Data from the sender.
+HEADER_CONNECTION = 'Connection'  # Whether the connection is kept open after this message.
+HEADER_CONTENT_LENGTH = 'Content-Length'  # Number of bytes in the body.
+HEADER_DEADLINE = 'Deadline'  # Milliseconds the message has left to be acted on.
+HEADER_DIRECTORY_VERSION = 'Directory-Version'  # Version of the coordinator's directory.
+
+CONNECTION_KEEP_ALIVE = 'keep-alive'
+CONNECTION_CLOSE = 'close'
 
 RESPONSE_OK = 'HTTP/1.0 200 OK'
 RESPONSE_NOT_FOUND = 'HTTP/1.0 404 NOT_FOUND'
+RESPONSE_UNAVAILABLE = 'HTTP/1.0 503 SERVICE_UNAVAILABLE'
+RESPONSE_TOO_LATE = 'HTTP/1.0 408 REQUEST_TIMEOUT'
+
+# Port the HTTP server listens on and messages are sent to.
+PORT = 80
+
+# The server keeps a connection open for further requests when the client asks for
+# keep-alive, until it has been idle for the timeout or another connection is waiting
+# for its turn. Only a limited number of connections are kept open so a busy node
+# does not run out of memory.
+KEEP_ALIVE_TIMEOUT_MS = 60000
+KEEP_ALIVE_MAX_CONNECTIONS = 4
+
+# The server only handles a limited number of connections at once as each one holds
+# buffers on the heap. Further connections wait in a queue for their turn. When the
+# queue is full, the wait is too long or the heap is running low they are turned away
+# straight away with a 503 response. The limit must allow for the connections being
+# kept alive so new connections can still get through.
+SERVER_MAX_CONNECTIONS = 6
+SERVER_MAX_QUEUED = 6
+SERVER_QUEUE_TIMEOUT_MS = 2000
+SERVER_IDLE_CLOSE_MS = 250  # How long a keep-alive connection must be idle to be closed for another.
+SERVER_MIN_FREE_HEAP = 16384
+
+# Default limits on how long sending a message may take. A node that is dead or slow
+# would otherwise hold up whatever is sending to it.
+SEND_CONNECT_TIMEOUT_MS = 2000
+SEND_WRITE_TIMEOUT_MS = 1000
+SEND_READ_TIMEOUT_MS = 3000
+
+# Connections to other nodes are pooled so repeated messages to the same node do
+# not pay for a TCP connect and teardown each time. Idle connections are closed
+# well before the server side gives up on them. The number of idle connections is
+# capped by the heap available; together they may use up to a quarter of free RAM.
+POOL_IDLE_TIMEOUT_MS = 30000
+POOL_MAX_CONNECTIONS = 6
+POOL_CONNECTION_BYTES = 2048
 
 wlan = network.WLAN(network.STA_IF)
 ip = None
 
+WIFI_STATUS_UP = 3  # wlan.status() once connected with an IP address; failures are negative.
+WIFI_JOIN_WAIT_MS = 10000  # How long joining the network can take when the node starts.
+
+# ********************************************************************************
+# Fast boot
+# ********************************************************************************
+# The access point, channel and address from the last boot are cached in flash. When
+# the cache is there the node joins that access point with the same static address,
+# skipping DHCP, and falls back to a normal connection if that fails. The cache is
+# only used for the network and coordinator in config.py it was saved for. Set
+# config.boot_state_file to None to turn fast boot off.
+#
+# The time since power-up is recorded as the node reaches each phase of booting:
+# its modules imported, Wi-Fi connected, server listening and registered with the
+# coordinator. They are shown in /metrics.
+BOOT_PHASES = ('import', 'wifi', 'server', 'registered')
+FAST_BOOT_WAIT_MS = 5000  # How long joining with the cached state can take before falling back.
 
+boot_state_file = getattr(config, 'boot_state_file', 'boot_state.json')
+boot_state = None  # What was loaded from boot_state_file, if anything.
+fast_boot = False  # Whether the node connected using the cached state.
+boot_ms = {}
+
+
+def record_boot_phase(phase):
+    if phase not in boot_ms:
+        boot_ms[phase] = time.ticks_ms()
+        logger.info('Boot phase %s reached after %s ms.', phase, boot_ms[phase])
+
+
+def load_boot_state():
+    if boot_state_file is None:
+        return None
+
+    try:
+        with open(boot_state_file) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return None  # There is no cache yet, or it was only partly written.
+
+    if state.get('ssid') != config.ssid or state.get('coordinator') != config.coordinator:
+        return None
+    return state
+
+
+# Returns the BSSID and channel of the access point the node has joined. The BSSID
+# isn't available from every port's wlan.config() so then it is found with a scan,
+# which only happens when the cache is being written.
+def access_point():
+    try:
+        return wlan.config('bssid'), wlan.config('channel')
+    except Exception:
+        pass
+
+    ssid = config.ssid.encode('utf-8')
+    best = None
+    for found in wlan.scan():
+        if found[0] == ssid and (best is None or found[3] > best[3]):
+            best = found
+    if best is None:
+        return None, None
+    return best[1], best[2]
+
+
+# Writes the cache when it differs from the one loaded, to spare the flash.
+def save_boot_state():
+    if boot_state_file is None:
+        return
+
+    state = {
+        'ssid': config.ssid,
+        'coordinator': config.coordinator,
+        'ifconfig': list(wlan.ifconfig()),
+    }
+    if boot_state is not None and boot_state['ifconfig'] == state['ifconfig']:
+        state['bssid'] = boot_state.get('bssid')
+        state['channel'] = boot_state.get('channel')
+    else:
+        bssid, channel = access_point()
+        state['bssid'] = None if bssid is None else bssid.hex()
+        state['channel'] = channel
+    if state == boot_state:
+        return
+
+    try:
+        with open(boot_state_file, 'w') as file:
+            json.dump(state, file)
+    except OSError as e:
+        logger.warning('Could not save the boot state: %s', e)
+
+
+# Joins the network, using the cached state if given. Returns True once connected.
+def join_network(state, wait_ms):
+    if state is None:
+        wlan.connect(config.ssid, config.password)
+    else:
+        logger.info('Fast boot to %s on channel %s.', state['ifconfig'][0], state.get('channel'))
+        wlan.ifconfig(tuple(state['ifconfig']))
+        if state.get('bssid') is None:
+            wlan.connect(config.ssid, config.password)
+        else:
+            wlan.connect(config.ssid, config.password, bssid=bytes.fromhex(state['bssid']))
+
+    waited = 0
+    while waited < wait_ms:
+        status = wlan.status()
+        if status < 0 or status >= WIFI_STATUS_UP:
+            break
+        logger.debug('Waiting for connection...')
+        time.sleep_ms(100)
+        waited += 100
+
+    return wlan.status() == WIFI_STATUS_UP
+
+
+# Connects when the node starts, before the event loop is running. Returns False if
+# the connection failed, in which case wifi_task() keeps trying once the loop starts.
 def connect_to_network():
-    global ip
+    global ip, boot_state, fast_boot
     wlan.active(True)
     wlan.config(pm=0xa11140)  # Disable power-save mode
-    wlan.connect(config.ssid, config.password)
 
-    if config.logging: print('Connecting to network...')
-    max_wait = 10
-    while max_wait > 0:
-        if wlan.status() < 0 or wlan.status() >= 3:
-            break
-        max_wait -= 1
-        if config.logging: print('Waiting for connection...')
-        time.sleep(1)
+    logger.info('Connecting to network...')
+    boot_state = load_boot_state()
+    if boot_state is not None:
+        fast_boot = join_network(boot_state, FAST_BOOT_WAIT_MS)
+        if not fast_boot:
+            # Restarting the interface drops the static address so DHCP is used again.
+            logger.warning('Fast boot failed, connecting normally.')
+            wlan.disconnect()
+            wlan.active(False)
+            wlan.active(True)
+            wlan.config(pm=0xa11140)
 
-    if wlan.status() != 3:
-        raise RuntimeError('network connection failed')
-    else:
-        if config.logging: print('Connected to network. ' + config.ssid)
-        status = wlan.ifconfig()
-        ip = status[0]
-        if config.logging: print('Network address:' + ip)
+    if not fast_boot and not join_network(None, WIFI_JOIN_WAIT_MS):
+        logger.error('Network connection failed with status %s.', wlan.status())
+        return False
+
+    logger.info('Connected to network. %s', config.ssid)
+    status = wlan.ifconfig()
+    ip = status[0]
+    logger.info('Network address:%s', ip)
+    encode_header_block()
+    record_boot_phase('wifi')
+    save_boot_state()
+    return True
 
 
 # Used to register handlers for requests.
 message_responders = {}
 
+# Routes can also contain parameters, such as '/sounds/play/{Data}', so that a single
+# responder handles a whole family of routes. The value of each parameter is put in
+# the headers passed to the responder under the parameter's name. These routes are
+# added with add_route() and held in a tree with a node for each part of the route.
+# Each node is a list of:
+ROUTE_CHILDREN = 0  # Dictionary of the fixed parts that can come next to their nodes, or None.
+ROUTE_PARAMETER = 1  # Name of the parameter that can come next, or None.
+ROUTE_PARAMETER_NODE = 2  # Node for the parameter that can come next, or None.
+ROUTE_RESPONDER = 3  # Responder for the route ending at this node, or None.
+ROUTE_PATTERN = 4  # The route ending at this node, as it was added, or None.
+
+
+def new_route_node():
+    return [None, None, None, None, None]
+
+
+route_tree = new_route_node()
+
+
+# Adds a route which may contain parameters. Routes that have a parameter in the same
+# place, such as '/lights/{Data}' and '/lights/{Data}/on', must use the same name.
+def add_route(route, responder, tree=None):
+    node = route_tree if tree is None else tree
+    for part in route.split('/')[1:]:
+        if len(part) > 2 and part[0] == '{' and part[-1] == '}':
+            if node[ROUTE_PARAMETER_NODE] is None:
+                node[ROUTE_PARAMETER] = part[1:-1]
+                node[ROUTE_PARAMETER_NODE] = new_route_node()
+            node = node[ROUTE_PARAMETER_NODE]
+        else:
+            if node[ROUTE_CHILDREN] is None:
+                node[ROUTE_CHILDREN] = {}
+            if part not in node[ROUTE_CHILDREN]:
+                node[ROUTE_CHILDREN][part] = new_route_node()
+            node = node[ROUTE_CHILDREN][part]
+
+    node[ROUTE_RESPONDER] = responder
+    node[ROUTE_PATTERN] = route
+
+
+# Returns the node in the route tree for the request, or None, putting the values of
+# any parameters into the headers. Fixed parts take precedence.
+def match_route(request, headers, tree=None):
+    node = route_tree if tree is None else tree
+    parameters = None
+    for part in request.split('/')[1:]:
+        children = node[ROUTE_CHILDREN]
+        if children is not None and part in children:
+            node = children[part]
+        elif node[ROUTE_PARAMETER_NODE] is not None and len(part) > 0:
+            if parameters is None:
+                parameters = []
+            parameters.append((node[ROUTE_PARAMETER], part))
+            node = node[ROUTE_PARAMETER_NODE]
+        else:
+            return None
+
+    if node[ROUTE_RESPONDER] is None:
+        return None
+
+    if parameters is not None:
+        for name, value in parameters:
+            headers[name] = value
+
+    return node
 
-async def extract_headers(reader):
-    headers = {
+
+# Returns all the routes in the route tree.
+def route_patterns(tree=None, prefix=''):
+    node = route_tree if tree is None else tree
+    patterns = []
+    if node[ROUTE_RESPONDER] is not None:
+        patterns.append(prefix)
+    if node[ROUTE_CHILDREN] is not None:
+        for part, child in node[ROUTE_CHILDREN].items():
+            patterns.extend(route_patterns(child, prefix + '/' + part))
+    if node[ROUTE_PARAMETER_NODE] is not None:
+        patterns.extend(route_patterns(node[ROUTE_PARAMETER_NODE], prefix + '/{' + node[ROUTE_PARAMETER] + '}'))
+    return patterns
+
+
+# Returns the route that matches the request and its responder, or None for both if
+# there is no route for it.
+def find_responder(request, headers):
+    if request in message_responders:
+        return request, message_responders[request]
+
+    node = match_route(request, headers)
+    if node is None:
+        return None, None
+
+    return node[ROUTE_PATTERN], node[ROUTE_RESPONDER]
+
+
+# Header names in upper case bytes, grouped by length, so incoming header lines can be
+# matched without decoding them to strings first.
+HEADER_KEYS = {}
+for header_name in (HEADER_SENDER, HEADER_HOST, HEADER_NAME, HEADER_ROLE, HEADER_DATA,
+                    HEADER_CONNECTION, HEADER_CONTENT_LENGTH, HEADER_DEADLINE, HEADER_DIRECTORY_VERSION):
+    key = header_name.upper().encode('utf-8')
+    if len(key) not in HEADER_KEYS:
+        HEADER_KEYS[len(key)] = []
+    HEADER_KEYS[len(key)].append((key, header_name))
+
+# Characters used when parsing lines.
+CHAR_LF = 10
+CHAR_CR = 13
+CHAR_SPACE = 32
+CHAR_TAB = 9
+CHAR_COLON = 58
+
+# Size of the buffer each connection reads lines into. The buffer is doubled for a
+# longer line, such as the Data of a lookup of many endpoints, up to LINE_MAX_SIZE; a
+# message with a longer line is dropped rather than have part of the line used.
+LINE_BUFFER_SIZE = 256
+LINE_MAX_SIZE = 8192
+
+# Buffers from closed connections are kept for reuse by new connections.
+line_buffers = []
+LINE_BUFFERS_KEPT = KEEP_ALIVE_MAX_CONNECTIONS + POOL_MAX_CONNECTIONS
+
+
+# Wraps a stream and reads lines into a buffer that lives as long as the connection,
+# rather than allocating new bytes and strings for every line. After readline() the
+# line is in buffer[line_start:line_end], without the line ending.
+class LineReader:
+    def __init__(self, stream):
+        self.stream = stream
+        if len(line_buffers) > 0:
+            self.buffer = line_buffers.pop()
+        else:
+            self.buffer = bytearray(LINE_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Start of the unread data in the buffer.
+        self.end = 0  # End of the unread data in the buffer.
+        self.line_start = 0
+        self.line_end = 0
+        self.received = 0  # Bytes read from the stream, for the metrics.
+
+    # Fills the buffer from the stream, returning False at the end of the stream.
+    async def fill(self):
+        if self.start > 0:
+            # Move the unread data to the front to make room.
+            count = self.end - self.start
+            self.view[:count] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = count
+        elif self.end >= len(self.buffer):
+            # The line does not fit, so move it to a buffer twice the size.
+            if self.end >= LINE_MAX_SIZE:
+                raise ValueError("Line longer than %s bytes" % LINE_MAX_SIZE)
+            buffer = bytearray(min(2 * self.end, LINE_MAX_SIZE))
+            buffer[:self.end] = self.view[:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+
+        read = await self.stream.readinto(self.view[self.end:])
+        if not read:
+            return False
+
+        self.end += read
+        self.received += read
+        return True
+
+    # Looks for the next line in the data already read, returning False if more
+    # data is needed.
+    def next_line(self):
+        buffer = self.buffer
+        scanned = self.start
+        while scanned < self.end and buffer[scanned] != CHAR_LF:
+            scanned += 1
+
+        if scanned >= self.end:
+            return False
+
+        self.take_line(scanned)
+        return True
+
+    # Makes the data up to end the current line.
+    def take_line(self, end):
+        self.line_start = self.start
+        self.line_end = end
+        self.start = end + 1 if end < self.end else end
+
+        if self.line_end > self.line_start and self.buffer[self.line_end - 1] == CHAR_CR:
+            self.line_end -= 1
+
+    # Reads the next line and returns its length.
+    async def readline(self):
+        while not self.next_line():
+            if not await self.fill():
+                # The stream has ended so whatever is left is the last line.
+                self.take_line(self.end)
+                break
+
+        return self.line_end - self.line_start
+
+    # Returns the part of the current line from start to end as a string, with
+    # surrounding whitespace removed.
+    def text(self, start, end):
+        buffer = self.buffer
+        while start < end and (buffer[start] == CHAR_SPACE or buffer[start] == CHAR_TAB):
+            start += 1
+        while end > start and (buffer[end - 1] == CHAR_SPACE or buffer[end - 1] == CHAR_TAB):
+            end -= 1
+        return str(self.view[start:end], 'utf-8')
+
+    # Reads and throws away count bytes, such as a body that is not needed.
+    async def skip(self, count):
+        while count > 0:
+            if self.start >= self.end and not await self.fill():
+                raise EOFError
+
+            used = min(count, self.end - self.start)
+            self.start += used
+            count -= used
+
+    def close(self):
+        self.stream.close()
+
+    async def wait_closed(self):
+        await self.stream.wait_closed()
+        # Buffers grown for a long line are left for the garbage collector.
+        if (self.buffer is not None and len(self.buffer) == LINE_BUFFER_SIZE and
+                len(line_buffers) < LINE_BUFFERS_KEPT):
+            line_buffers.append(self.buffer)
+        self.buffer = None
+
+
+# Returns the header name for the header key in buffer[start:end], or None if it
+# is not one we are interested in. The key must already be in upper case.
+def match_header(buffer, start, end):
+    length = end - start
+    if length not in HEADER_KEYS:
+        return None
+
+    for key, header_name in HEADER_KEYS[length]:
+        i = 0
+        while i < length and buffer[start + i] == key[i]:
+            i += 1
+        if i == length:
+            return header_name
+
+    return None
+
+
+def new_headers():
+    return {
         HEADER_SENDER: "",
         HEADER_HOST: "",
         HEADER_NAME: "",
         HEADER_ROLE: "",
         HEADER_DATA: "",
+        HEADER_CONNECTION: "",
+        HEADER_CONTENT_LENGTH: "",
+        HEADER_DEADLINE: "",
+        HEADER_DIRECTORY_VERSION: "",
     }
 
+
+# Reads the headers into a new dict, or into headers after emptying it when one is
+# given so a connection can use the same dict for every request.
+async def extract_headers(reader, headers=None):
+    if headers is None:
+        headers = new_headers()
+    else:
+        for header_name in headers:
+            headers[header_name] = ""
+
     # Cycle through the headers, extracting the host, name and role of the response.
     while True:
-        header = (await reader.readline()).decode('utf-8')
-        if len(header.strip()) < 1:
+        # Only wait on the stream when the buffer does not already hold the line.
+        if not reader.next_line():
+            await reader.readline()
+        buffer = reader.buffer  # Replaced if the line was too long for it.
+        if reader.line_end <= reader.line_start:
             break
 
-        header = str(header).strip()
-        kvp = header.split(":")
+        # Find the colon, upper casing the name in place as we go.
+        start = reader.line_start
+        end = reader.line_end
+        colon = start
+        while colon < end and buffer[colon] != CHAR_COLON:
+            if 97 <= buffer[colon] <= 122:
+                buffer[colon] -= 32
+            colon += 1
 
-        if len(kvp) < 2:
-            if config.logging: print("Cannot process header: '%s'" % header)
+        if colon >= end:
+            logger.warning("Cannot process header: '%s'", reader.text(start, end))
             continue
 
-        kvp[0] = kvp[0].strip().upper()
-        kvp[1] = kvp[1].strip()
-        if kvp[0] == HEADER_SENDER.upper(): headers[HEADER_SENDER] = kvp[1]
-        if kvp[0] == HEADER_HOST.upper(): headers[HEADER_HOST] = kvp[1]
-        if kvp[0] == HEADER_NAME.upper(): headers[HEADER_NAME] = kvp[1]
-        if kvp[0] == HEADER_ROLE.upper(): headers[HEADER_ROLE] = kvp[1]
-        if kvp[0] == HEADER_DATA.upper(): headers[HEADER_DATA] = kvp[1]
+        key_end = colon
+        while key_end > start and (buffer[key_end - 1] == CHAR_SPACE or buffer[key_end - 1] == CHAR_TAB):
+            key_end -= 1
+
+        header_name = match_header(buffer, start, key_end)
+        if header_name is not None:
+            headers[header_name] = reader.text(colon + 1, end)
 
     return headers
 
 
-# Returns a pre-populated dictionary containing the default headers.
+# The Sender, Name and Role headers are the same on every message this node sends,
+# so they are encoded once when the network address is known.
+header_block = None
+
+# Header names encoded with their separator, e.g. b'Host: ', built as they are first used.
+header_prefixes = {}
+
+CRLF = b'\r\n'
+CONTENT_LENGTH_PREFIX = b'Content-Length: '
+REQUEST_VERSION = b' HTTP/1.1'
+
+# Messages are assembled in a single buffer so each is sent with one write. Anything
+# that does not fit, such as a large body, is written separately.
+SEND_BUFFER_SIZE = 512
+send_buffer = bytearray(SEND_BUFFER_SIZE)
+send_view = memoryview(send_buffer)
+send_written = 0  # Bytes written so far for the message being sent.
+
+# A responder can return a generator of strings or bytes instead of the whole body,
+# so a large body is never held in memory at once. The chunks are written as they
+# are produced with the connection drained every STREAM_DRAIN_BYTES. As the length
+# isn't known in advance the body is ended by closing the connection.
+STREAM_DRAIN_BYTES = 1024
+
+
+def encode_header_block():
+    global header_block
+    header_block = ('%s: %s\r\n%s: %s\r\n%s: %s\r\n' % (
+        HEADER_SENDER, ip, HEADER_NAME, config.name, HEADER_ROLE, config.role)).encode('utf-8')
+
+
+# Returns a dictionary for any headers beyond the standard ones in header_block.
 def default_populated_headers(host):
-    headers = {
-        HEADER_SENDER: ip,
-        HEADER_NAME: config.name,
-        HEADER_ROLE: config.role,
-    }
+    headers = {}
 
     if host is not None and len(host) > 0:
         headers[HEADER_HOST] = host
@@ -96,115 +564,1410 @@ def default_populated_headers(host):
     return headers
 
 
-async def send(writer, message, headers, body):
-    if config.logging: print("Sending message: '%s'" % message)
-    if config.logging: print("Sending headers: '%s'" % headers)
-    if body is not None:
-        if config.logging: print("Sending body: '%s'" % body)
+# Copies data to the send buffer at position and returns the position after it. If
+# the buffer is full, what is in it is written out first. This must not await so
+# that no other message can use the buffer before it has been written.
+def buffer_data(writer, position, data):
+    global send_written
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    length = len(data)
+    if position + length > SEND_BUFFER_SIZE:
+        if position > 0:
+            writer.write(send_view[:position])
+            send_written += position
+            position = 0
+
+        if length > SEND_BUFFER_SIZE:
+            writer.write(data)
+            send_written += length
+            return 0
+
+    send_buffer[position:position + length] = data
+    return position + length
+
+
+# Returns True if the body is a generator of chunks rather than a string or bytes.
+def is_stream(body):
+    return body is not None and not isinstance(body, (str, bytes, bytearray))
+
+
+# Copies the first line and the headers to the send buffer, returning the position
+# after them.
+def buffer_headers(writer, message, headers, request):
+    if header_block is None:
+        encode_header_block()
+
+    position = buffer_data(writer, 0, message)
+    if request is not None:
+        position = buffer_data(writer, position, b' ')
+        position = buffer_data(writer, position, request)
+        position = buffer_data(writer, position, REQUEST_VERSION)
+    position = buffer_data(writer, position, CRLF)
+    position = buffer_data(writer, position, header_block)
 
-    writer.write(message + "\r\n")
     for key, value in headers.items():
         if value is not None and len(value) > 0:
-            writer.write('%s: %s\r\n' % (key, value))
+            if key not in header_prefixes:
+                header_prefixes[key] = ('%s: ' % key).encode('utf-8')
+            position = buffer_data(writer, position, header_prefixes[key])
+            position = buffer_data(writer, position, value)
+            position = buffer_data(writer, position, CRLF)
+
+    return position
+
+
+# message is the first line of the message. When request is given, message is the
+# method and the first line is built from the two. Returns the number of bytes sent.
+async def send(writer, message, headers, body, request=None):
+    global send_written
+    logger.debug("Sending message: '%s' %s", message, request)
+    logger.debug("Sending headers: '%s'", headers)
+    if body is not None:
+        logger.debug("Sending body of %s characters.", len(body))
+
+    send_written = 0
+    position = buffer_headers(writer, message, headers, request)
+
+    # The length of the body is needed so the other end knows where the message
+    # finishes when the connection is kept open.
+    if body is not None and len(body) > 0:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        position = buffer_data(writer, position, CONTENT_LENGTH_PREFIX)
+        position = buffer_data(writer, position, str(len(body)))
+        position = buffer_data(writer, position, CRLF)
 
     # Blank line to separate the headers from the body.
-    writer.write('\r\n')
+    position = buffer_data(writer, position, CRLF)
 
     if body is not None and len(body) > 0:
-        writer.write(body)
-        writer.write('\r\n')
+        position = buffer_data(writer, position, body)
+
+    if position > 0:
+        writer.write(send_view[:position])
+
+    # Nothing else can have sent since send_written was reset as there was no await.
+    written = send_written + position
+    await writer.drain()
+    return written
+
+
+# Sends a message whose body is a generator of chunks. The send buffer is shared, so
+# it is only used for the headers, before the first await; the chunks are written
+# directly. Returns the number of bytes sent.
+async def send_stream(writer, message, headers, chunks):
+    global send_written
+    logger.debug("Streaming message: '%s'", message)
+    logger.debug("Sending headers: '%s'", headers)
+
+    send_written = 0
+    position = buffer_headers(writer, message, headers, None)
+    position = buffer_data(writer, position, CRLF)
+    writer.write(send_view[:position])
+    written = send_written + position
+
+    pending = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        writer.write(chunk)
+        written += len(chunk)
+        pending += len(chunk)
+        if pending >= STREAM_DRAIN_BYTES:
+            await writer.drain()
+            pending = 0
 
     await writer.drain()
+    return written
 
 
 async def receive(reader):
-    message = (await reader.readline()).decode('utf-8').strip()
-    if config.logging: print("Received message: '%s'" % message)
+    await reader.readline()
+    message = reader.text(reader.line_start, reader.line_end)
+    logger.debug("Received message: '%s'", message)
     headers = await extract_headers(reader)
-    if config.logging: print("Received headers: ", headers)
+    logger.debug("Received headers: %s", headers)
 
-    # Ignore body content.
+    # Ignore body content, but it must be read so the connection can be reused.
+    length = headers[HEADER_CONTENT_LENGTH]
+    if len(length) > 0 and int(length) > 0:
+        await reader.skip(int(length))
 
     return message, headers
 
 
+# Receives a request into headers, returning its method, path and headers. The request
+# line, e.g. b'GET /light/off HTTP/1.1', is parsed in the line buffer with the method
+# upper cased in place. The method is empty if the client has closed the connection
+# and the path is None if there is no path.
+async def receive_request(reader, headers):
+    if not reader.next_line():
+        await reader.readline()
+    buffer = reader.buffer
+    start = reader.line_start
+    end = reader.line_end
+
+    space = start
+    while space < end and buffer[space] != CHAR_SPACE:
+        if 97 <= buffer[space] <= 122:
+            buffer[space] -= 32
+        space += 1
+    method = reader.text(start, space)
+
+    path = None
+    if space < end:
+        path_end = space + 1
+        while path_end < end and buffer[path_end] != CHAR_SPACE:
+            path_end += 1
+        path = reader.text(space + 1, path_end)
+    logger.debug("Received request: '%s %s'", method, path)
+
+    headers = await extract_headers(reader, headers)
+    logger.debug("Received headers: %s", headers)
+
+    length = headers[HEADER_CONTENT_LENGTH]
+    if len(length) > 0 and int(length) > 0:
+        await reader.skip(int(length))
+
+    return method, path, headers
+
+
+# ********************************************************************************
+# Metrics
+# ********************************************************************************
+# Counters and latency histograms for each route handled and each node sent to, shown
+# at /metrics to find slow handlers and flaky nodes. They are held in arrays allocated
+# when the node starts so recording a message does not allocate. Each route or node
+# has a row in the array made up of:
+METRIC_COUNT = 0  # Messages.
+METRIC_ERRORS = 1  # Messages that raised an exception, timed out or were dropped.
+METRIC_BYTES_IN = 2
+METRIC_BYTES_OUT = 3
+METRIC_TOTAL_MS = 4  # Total latency, for the average.
+METRIC_MAX_MS = 5
+METRIC_BUCKETS = 6  # Start of the latency histogram.
+
+# Upper limits of the latency histogram buckets. The last bucket counts anything slower.
+METRIC_BUCKET_MS = (5, 10, 25, 50, 100, 250, 500, 1000)
+METRIC_ROW_SIZE = METRIC_BUCKETS + len(METRIC_BUCKET_MS) + 1
+
+METRICS_MAX_ROUTES = 24
+METRICS_MAX_DESTINATIONS = 12
+METRICS_OTHER = '*'  # The first row counts anything that does not have a row of its own.
+METRICS_NOT_FOUND = '?'  # Row for requests with no route.
+
+# Routes and nodes mapped to their row.
+route_metric_rows = {METRICS_OTHER: 0}
+destination_metric_rows = {METRICS_OTHER: 0}
+route_metrics = array('I', [0] * (METRICS_MAX_ROUTES * METRIC_ROW_SIZE))
+destination_metrics = array('I', [0] * (METRICS_MAX_DESTINATIONS * METRIC_ROW_SIZE))
+
+
+# Returns the start of the row for the key, adding a row if there is room.
+def metric_row(rows, limit, key):
+    if key not in rows:
+        if len(rows) >= limit:
+            return 0
+        rows[key] = len(rows)
+
+    return rows[key] * METRIC_ROW_SIZE
+
+
+def record_metric(metrics, row, started, bytes_in, bytes_out, error):
+    elapsed = time.ticks_diff(time.ticks_ms(), started)
+    metrics[row + METRIC_COUNT] += 1
+    if error:
+        metrics[row + METRIC_ERRORS] += 1
+    metrics[row + METRIC_BYTES_IN] += bytes_in
+    metrics[row + METRIC_BYTES_OUT] += bytes_out
+    metrics[row + METRIC_TOTAL_MS] += elapsed
+    if elapsed > metrics[row + METRIC_MAX_MS]:
+        metrics[row + METRIC_MAX_MS] = elapsed
+
+    bucket = 0
+    while bucket < len(METRIC_BUCKET_MS) and elapsed > METRIC_BUCKET_MS[bucket]:
+        bucket += 1
+    metrics[row + METRIC_BUCKETS + bucket] += 1
+
+
+def record_route_metric(route, started, bytes_in, bytes_out, error):
+    if route is None:
+        route = METRICS_NOT_FOUND
+    row = metric_row(route_metric_rows, METRICS_MAX_ROUTES, route)
+    record_metric(route_metrics, row, started, bytes_in, bytes_out, error)
+
+
+def record_destination_metric(node, started, bytes_in, bytes_out, error):
+    row = metric_row(destination_metric_rows, METRICS_MAX_DESTINATIONS, node)
+    record_metric(destination_metrics, row, started, bytes_in, bytes_out, error)
+
+
+# Returns the metrics as lines of comma separated values, one for each route and node
+# that has been used, then the boot phases and the Wi-Fi supervisor's figures. Each
+# block starts with a line naming its columns.
+def metrics_lines():
+    lines = ['kind,key,count,errors,bytes_in,bytes_out,total_ms,max_ms,' +
+             ','.join(['le_%s' % limit for limit in METRIC_BUCKET_MS]) + ',inf']
+    for kind, rows, metrics in (('route', route_metric_rows, route_metrics),
+                                ('node', destination_metric_rows, destination_metrics)):
+        for key, row in rows.items():
+            start = row * METRIC_ROW_SIZE
+            if metrics[start + METRIC_COUNT] > 0:
+                lines.append('%s,%s,%s' % (kind, key, ','.join(
+                    [str(value) for value in metrics[start:start + METRIC_ROW_SIZE]])))
+
+    lines.append('kind,fast,' + ','.join(['%s_ms' % phase for phase in BOOT_PHASES]))
+    lines.append('boot,%s,%s' % (int(fast_boot), ','.join([str(boot_ms.get(phase, '')) for phase in BOOT_PHASES])))
+
+    # The Wi-Fi supervisor's figures have columns of their own.
+    lines.append('kind,disconnects,reconnects,attempts,last_outage_ms,longest_outage_ms,total_outage_ms')
+    lines.append('wifi,%s,%s,%s,%s,%s,%s' % (wifi_disconnects, wifi_reconnects, wifi_attempts,
+                                            wifi_last_outage_ms, wifi_longest_outage_ms, wifi_total_outage_ms))
+    return lines
+
+
+# Number of connections the server is currently keeping open.
+server_keep_alive = 0
+
+server_active = 0  # Connections currently being handled.
+server_waiting = 0  # Connections currently waiting in the queue.
+server_slot_freed = asyncio.Event()
+server_idle = []  # [task, time.ticks_ms() idle from] of keep-alive connections waiting for a request, oldest first.
+
+# Counters to help size the limits for each type of node.
+server_accepted = 0  # Connections handled.
+server_queued = 0  # Connections that had to wait in the queue.
+server_shed = 0  # Connections turned away with a 503 response.
+server_idle_closed = 0  # Idle keep-alive connections closed to make way for another.
+
+
+# Waits for the server to have capacity for another connection, returning False if
+# the connection should be turned away instead.
+async def acquire_server_slot():
+    global server_active, server_waiting, server_accepted, server_queued, server_shed
+    if gc.mem_free() < SERVER_MIN_FREE_HEAP:
+        gc.collect()
+        if gc.mem_free() < SERVER_MIN_FREE_HEAP:
+            logger.warning("Heap is low, turning connection away.")
+            server_shed += 1
+            return False
+
+    if server_active >= SERVER_MAX_CONNECTIONS:
+        if server_waiting >= SERVER_MAX_QUEUED:
+            logger.warning("Connection queue is full, turning connection away.")
+            server_shed += 1
+            return False
+
+        server_waiting += 1
+        server_queued += 1
+        try:
+            deadline = time.ticks_add(time.ticks_ms(), SERVER_QUEUE_TIMEOUT_MS)
+            while server_active >= SERVER_MAX_CONNECTIONS:
+                remaining = time.ticks_diff(deadline, time.ticks_ms())
+                if remaining <= 0:
+                    logger.warning("Connection waited too long, turning it away.")
+                    server_shed += 1
+                    return False
+
+                # Make room by closing the connection that has been idle longest, once it
+                # has been idle long enough that its client is unlikely to be sending.
+                if (len(server_idle) > 0 and
+                        time.ticks_diff(time.ticks_ms(), server_idle[0][1]) >= SERVER_IDLE_CLOSE_MS):
+                    server_idle.pop(0)[0].cancel()
+                elif len(server_idle) > 0:
+                    remaining = min(remaining, SERVER_IDLE_CLOSE_MS)
+
+                try:
+                    await asyncio.wait_for_ms(server_slot_freed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                server_slot_freed.clear()
+        finally:
+            server_waiting -= 1
+
+    server_active += 1
+    server_accepted += 1
+    return True
+
+
+def release_server_slot():
+    global server_active
+    server_active -= 1
+    server_slot_freed.set()
+
+
+async def shed_connection(writer):
+    try:
+        await send(writer, RESPONSE_UNAVAILABLE, {HEADER_CONNECTION: CONNECTION_CLOSE}, None)
+    except Exception as e:
+        logger.error("An exception occurred turning a connection away!")
+        logger.error("Exception raised: %s", e)
+    finally:
+        await writer.wait_closed()
+
+
+# Number of messages received too late to be acted on.
+late_dropped = 0
+
+
+# Returns True if a message with the deadline header, received at the time given,
+# is now too late to be acted on. Clocks are not synchronised between nodes so the
+# sender gives the time it had left when sending and this is checked against the
+# time since the message arrived, such as waiting in the queue.
+def is_too_late(deadline, received):
+    global late_dropped
+    if len(deadline) < 1 or time.ticks_diff(time.ticks_ms(), received) <= int(deadline):
+        return False
+
+    late_dropped += 1
+    return True
+
+
 async def receive_message(reader, writer):
-    global message_responders
+    accepted = time.ticks_ms()
+    if not await acquire_server_slot():
+        await shed_connection(writer)
+        return
+
     try:
-        # A request line looks like this: b'GET /light/off HTTP/1.1\r\n'
-        if config.logging: print("Receiving request...")
-        request, headers = await receive(reader)
+        await serve_connection(reader, writer, accepted)
+    finally:
+        release_server_slot()
 
-        request_data = str(request).split(" ")
-        if len(request_data) < 2:
-            if config.logging: print("Cannot process request: '%s'" % request)
-            return
 
-        method = request_data[0].strip().upper()
-        request = request_data[1]
+# The first request on the connection is treated as received when the connection
+# was accepted.
+async def serve_connection(reader, writer, received):
+    global message_responders, server_keep_alive, server_idle_closed
+    request = None
+    keep_alive = False
+    reader = LineReader(reader)
+    # The headers of each request on the connection are read into the same dict, so a
+    # responder must copy anything it keeps after it has returned.
+    headers = new_headers()
+    try:
+        while True:
+            logger.debug("Receiving request...")
+            read = reader.received
+            if keep_alive:
+                # While idle the connection can be cancelled by acquire_server_slot().
+                idle = [asyncio.current_task(), time.ticks_ms()]
+                server_idle.append(idle)
+                try:
+                    method, request, headers = await asyncio.wait_for_ms(receive_request(reader, headers),
+                                                                         KEEP_ALIVE_TIMEOUT_MS)
+                except asyncio.TimeoutError:
+                    logger.debug("Closing idle connection.")
+                    return
+                except asyncio.CancelledError:
+                    logger.debug("Closing idle connection for a connection waiting.")
+                    server_idle_closed += 1
+                    return
+                finally:
+                    if idle in server_idle:
+                        server_idle.remove(idle)
+            else:
+                method, request, headers = await receive_request(reader, headers)
+
+            # The client has closed the connection.
+            if len(method) < 1:
+                return
+
+            if received is None:
+                received = time.ticks_ms()
+
+            if request is None:
+                logger.warning("Cannot process request: '%s'", method)
+                return
+
+            # Keep the connection open if the client asked for it and we have capacity.
+            wants_keep_alive = headers[HEADER_CONNECTION].lower() == CONNECTION_KEEP_ALIVE
+            if (wants_keep_alive and not keep_alive and server_waiting == 0 and
+                    server_keep_alive < KEEP_ALIVE_MAX_CONNECTIONS):
+                keep_alive = True
+                server_keep_alive += 1
+
+            response = RESPONSE_NOT_FOUND
+            response_headers = default_populated_headers(headers[HEADER_SENDER])
+            response_body = None
 
-        response = RESPONSE_NOT_FOUND
-        response_headers = default_populated_headers(headers[HEADER_SENDER])
-        response_body = None
+            # Give up the connection if others are waiting for their turn.
+            if keep_alive and wants_keep_alive and server_waiting == 0:
+                response_headers[HEADER_CONNECTION] = CONNECTION_KEEP_ALIVE
+            else:
+                response_headers[HEADER_CONNECTION] = CONNECTION_CLOSE
 
-        # Now see if we have a route to process this message.
-        if request in message_responders:
-            response = RESPONSE_OK
-            responder = message_responders[request]
-            response_body = await responder(method, request, headers, response_headers)
-        
-        if config.logging: print("Sending response...")
-        await send(writer, response, response_headers, response_body)
+            if message_received is not None:
+                message_received(headers, response_headers)
+
+            # Now see if we have a route to process this message.
+            route, responder = find_responder(request, headers)
+            if is_too_late(headers[HEADER_DEADLINE], received):
+                logger.warning("Dropping request '%s' as it is too late.", request)
+                response = RESPONSE_TOO_LATE
+            elif responder is not None:
+                response = RESPONSE_OK
+                try:
+                    response_body = await responder(method, request, headers, response_headers)
+                except:
+                    record_route_metric(route, received, reader.received - read, 0, True)
+                    raise
+
+            logger.debug("Sending response...")
+            if is_stream(response_body):
+                response_headers[HEADER_CONNECTION] = CONNECTION_CLOSE
+                written = await send_stream(writer, response, response_headers, response_body)
+            else:
+                written = await send(writer, response, response_headers, response_body)
+            record_route_metric(route, received, reader.received - read, written, response == RESPONSE_TOO_LATE)
+
+            if response_headers[HEADER_CONNECTION] != CONNECTION_KEEP_ALIVE:
+                return
+
+            received = None
 
     except Exception as e:
-        if config.logging: print("An exception occurred receiving message '%s'!" % request)
-        if config.logging: print("Exception raised: %s" % e)
+        logger.error("An exception occurred receiving message '%s'!", request)
+        logger.error("Exception raised: %s", e)
 
     finally:
+        if keep_alive:
+            server_keep_alive -= 1
+        await reader.wait_closed()
+
+
+# Idle connections to other nodes, keyed by IP address. Each entry is a list of
+# [reader, writer, last used] with the most recently used at the end.
+connection_pool = {}
+pool_idle = 0  # Number of idle connections held across all nodes.
+pool_limit = POOL_MAX_CONNECTIONS  # Resized to the heap by size_connection_pool().
+pool_enabled = True  # When False every message opens and closes its own connection.
+
+
+def size_connection_pool():
+    global pool_limit
+    pool_limit = min(POOL_MAX_CONNECTIONS, gc.mem_free() // 4 // POOL_CONNECTION_BYTES)
+    logger.info("Connection pool limited to %s connections.", pool_limit)
+
+
+async def close_connection(reader, writer):
+    try:
+        reader.close()
+        await reader.wait_closed()
+        writer.close()
         await writer.wait_closed()
+    except:
+        logger.error("An exception occurred closing a connection!")
+
+
+async def open_connection(node):
+    reader, writer = await asyncio.open_connection(node, PORT)
+    return LineReader(reader), writer
+
+
+# Returns a connection to the node, reusing an idle one from the pool if possible.
+# The last value returned is True if the connection came from the pool.
+async def open_pooled_connection(node):
+    global pool_idle
+    if pool_enabled and node in connection_pool and len(connection_pool[node]) > 0:
+        reader, writer, last_used = connection_pool[node].pop()
+        pool_idle -= 1
+        return reader, writer, True
+
+    reader, writer = await open_connection(node)
+    return reader, writer, False
+
+
+# Returns the connection to the pool if the node will keep it open, otherwise closes it.
+async def release_connection(node, reader, writer, keep_alive):
+    global pool_idle
+    if pool_enabled and keep_alive and pool_idle < pool_limit:
+        if node not in connection_pool:
+            connection_pool[node] = []
+        connection_pool[node].append([reader, writer, time.ticks_ms()])
+        pool_idle += 1
+    else:
+        await close_connection(reader, writer)
+
+
+# Closes every idle connection, such as when the network has been down and they are
+# no longer usable.
+async def close_pooled_connections():
+    global pool_idle
+    for node in list(connection_pool):
+        for reader, writer, last_used in connection_pool.pop(node):
+            pool_idle -= 1
+            await close_connection(reader, writer)
+
+
+# Periodically close connections that have been idle in the pool for too long.
+async def pool_task():
+    global pool_idle
+    while True:
+        await asyncio.sleep_ms(POOL_IDLE_TIMEOUT_MS // 2)
+        now = time.ticks_ms()
+        for node in list(connection_pool):
+            idle = connection_pool[node]
+            while len(idle) > 0 and time.ticks_diff(now, idle[0][2]) > POOL_IDLE_TIMEOUT_MS:
+                reader, writer, last_used = idle.pop(0)
+                pool_idle -= 1
+                logger.debug("Closing idle connection to %s.", node)
+                await close_connection(reader, writer)
+
+            if len(idle) == 0 and connection_pool.get(node) is idle:
+                del connection_pool[node]
+
+
+# Messages to a node are sent one at a time, in order of priority and then in the
+# order they were sent, so a heartbeat or diagnostic message can't get in between
+# or ahead of a sequence of show cues. A message waits for the one being sent to
+# finish but is never interrupted. Each node with messages waiting has an entry of
+# [busy, waiting cues, waiting control messages, waiting background messages], each
+# waiting message being an Event set when it is its turn. Nodes with nothing being
+# sent have no entry. Background messages are refused once too many are waiting so
+# a node that is slow to respond can't fill the heap with them; cues and control
+# messages always wait their turn. Datagrams are not queued.
+PRIORITY_CUE = 0  # Show cues, such as sounds and lights.
+PRIORITY_CONTROL = 1  # Events, registration and lookups.
+PRIORITY_BACKGROUND = 2  # Heartbeats and diagnostics.
+SEND_QUEUE_MAX_BACKGROUND = 4
+
+SEND_QUEUE_BUSY = 0
+send_queues = {}
+
+
+# Waits until it is this message's turn to be sent to the node. Returns False if the
+# message was refused because too many messages are waiting.
+async def acquire_send_turn(node, priority):
+    queue = send_queues.get(node)
+    if queue is None:
+        send_queues[node] = [True, [], [], []]
+        return True
+
+    waiting = queue[1 + priority]
+    if priority == PRIORITY_BACKGROUND and len(waiting) >= SEND_QUEUE_MAX_BACKGROUND:
+        return False
+
+    turn = asyncio.Event()
+    waiting.append(turn)
+    try:
+        await turn.wait()
+    except asyncio.CancelledError:
+        # A cancelled message passes its turn on if it had been given it already.
+        if turn.is_set():
+            release_send_turn(node)
+        else:
+            waiting.remove(turn)
+        raise
+    return True
+
+
+# Hands the node over to the next message waiting for it.
+def release_send_turn(node):
+    queue = send_queues[node]
+    for waiting in queue[1:]:
+        if len(waiting) > 0:
+            waiting.pop(0).set()
+            return
+
+    del send_queues[node]
+
+
+# Counts of messages to each node that timed out, were dropped because they were too
+# late or shared another message's result, keyed by IP address, and how many messages
+# in a row have had no response from it because it could not be reached or didn't
+# answer in time. Each entry is [timeouts, dropped, coalesced, failures].
+destination_stats = {}
+STAT_TIMEOUTS = 0
+STAT_DROPPED = 1
+STAT_COALESCED = 2
+STAT_FAILURES = 3
+
+
+def count_destination_stat(node, stat):
+    if node not in destination_stats:
+        destination_stats[node] = [0, 0, 0, 0]
+    destination_stats[node][stat] += 1
+
+
+def clear_destination_failures(node):
+    stats = destination_stats.get(node)
+    if stats is not None:
+        stats[STAT_FAILURES] = 0
+
+
+# Returns how many messages in a row have had no response from the node. Messages
+# dropped before they were sent or that arrived too late don't count.
+def destination_failures(node):
+    stats = destination_stats.get(node)
+    return 0 if stats is None else stats[STAT_FAILURES]
+
+
+# Requests that give the same result however many times they are handled, such as
+# turning lights off or a lookup. When one of these is sent to a node while an
+# identical one (the same method, request and data) is still being sent, and nothing
+# different has been sent to the node in between, the second does not go over the
+# network but waits for the first and returns its result. Sharing it after something
+# different, such as off while lights on is waiting behind an earlier off, would lose
+# the last request. Modules add their own, for example
+# pico.idempotent_requests.add(LIGHTS_OFF).
+idempotent_requests = set()
+
+# Messages being sent that others are able to share, keyed by how they were sent, the
+# node, method, request and data. Each entry is [Event set once it has been sent, result].
+in_flight = {}
+
+# The last request sent to each node, as (method, request, data).
+last_requests = {}
+
+
+def note_request(node, method, request, data):
+    last_requests[node] = (method, request, data)
+
+
+# Returns the result of the coroutine, or of the identical one already in flight if
+# it was the last request sent to the node.
+async def coalesce(key, coroutine):
+    node = key[1]
+    entry = in_flight.get(key)
+    if entry is not None and last_requests.get(node) == key[2:]:
+        coroutine.close()  # Never started, so it is dropped.
+        count_destination_stat(node, STAT_COALESCED)
+        logger.debug("Sharing the result of message '%s' to %s.", key[3], node)
+        await entry[0].wait()
+        return entry[1]
+
+    note_request(node, key[2], key[3], key[4])
+    entry = [asyncio.Event(), None]
+    in_flight[key] = entry
+    try:
+        entry[1] = await coroutine
+    finally:
+        if in_flight.get(key) is entry:
+            del in_flight[key]
+        entry[0].set()
+    return entry[1]
+
+
+# Returns the milliseconds left before the deadline, or None if there is no deadline.
+def deadline_remaining(started, deadline_ms):
+    if deadline_ms is None:
+        return None
+    return deadline_ms - time.ticks_diff(time.ticks_ms(), started)
+
+
+# Returns the headers for a request to the node with our standard headers.
+def request_headers_for(node, data):
+    request_headers = default_populated_headers(node)
+
+    if pool_enabled:
+        request_headers[HEADER_CONNECTION] = CONNECTION_KEEP_ALIVE
+
+    if data is not None:
+        request_headers[HEADER_DATA] = data
+
+    return request_headers
+
+
+async def read_response(reader, read_timeout_ms):
+    # A response looks like this: HTTP/1.0 200 OK
+    logger.debug("Receiving response...")
+    response, headers = await asyncio.wait_for_ms(receive(reader), read_timeout_ms)
+    if len(response) < 1:
+        raise OSError("Connection closed by node")
+
+    return response, headers
+
+
+# Returns the response, its headers and the number of bytes sent.
+async def exchange(reader, writer, method, request, request_headers, request_body,
+                   write_timeout_ms, read_timeout_ms):
+    logger.debug("Sending request...")
+    written = await asyncio.wait_for_ms(
+        send(writer, method, request_headers, request_body, request), write_timeout_ms)
+    response, headers = await read_response(reader, read_timeout_ms)
+    return response, headers, written
 
 
 # node is the IP address to send to
 # method is GET, PUT etc.
 # request is the request to send.
-async def send_message(node, method, request, data=None):
-    reader, writer = await asyncio.open_connection(node, 80)
+# deadline_ms is how long the message is useful for; it is not sent if the deadline
+# passes before it can be and the node drops it if it arrives too late. Time spent
+# waiting behind other messages to the node counts towards the deadline.
+# priority is PRIORITY_CUE, PRIORITY_CONTROL or PRIORITY_BACKGROUND.
+# Returns the response headers, or None if the message failed, timed out or was dropped.
+# Requests in idempotent_requests share the result of an identical one in flight, so
+# the headers returned must not be changed.
+async def send_message(node, method, request, data=None, deadline_ms=None,
+                       connect_timeout_ms=SEND_CONNECT_TIMEOUT_MS,
+                       write_timeout_ms=SEND_WRITE_TIMEOUT_MS,
+                       read_timeout_ms=SEND_READ_TIMEOUT_MS,
+                       priority=PRIORITY_CONTROL):
+    started = time.ticks_ms()
+    coroutine = send_message_queued(node, method, request, data, deadline_ms, started,
+                                    connect_timeout_ms, write_timeout_ms, read_timeout_ms, priority)
+    if request in idempotent_requests:
+        return await coalesce(('message', node, method, request, data), coroutine)
+    note_request(node, method, request, data)
+    return await coroutine
+
+
+async def send_message_queued(node, method, request, data, deadline_ms, started,
+                              connect_timeout_ms, write_timeout_ms, read_timeout_ms, priority):
+    if not await acquire_send_turn(node, priority):
+        logger.warning("Dropping message '%s' to %s as too many are waiting.", request, node)
+        count_destination_stat(node, STAT_DROPPED)
+        return None
+
+    try:
+        return await send_message_now(node, method, request, data, deadline_ms, started,
+                                      connect_timeout_ms, write_timeout_ms, read_timeout_ms)
+    finally:
+        release_send_turn(node)
+
+
+async def send_message_now(node, method, request, data, deadline_ms, started,
+                           connect_timeout_ms, write_timeout_ms, read_timeout_ms):
+    try:
+        reader, writer, reused = await asyncio.wait_for_ms(open_pooled_connection(node), connect_timeout_ms)
+    except asyncio.TimeoutError:
+        logger.warning("Timed out connecting to %s!", node)
+        count_destination_stat(node, STAT_TIMEOUTS)
+        count_destination_stat(node, STAT_FAILURES)
+        record_destination_metric(node, started, 0, 0, True)
+        return None
+    except Exception as e:
+        # Such as the node refusing the connection or being unreachable.
+        logger.error("An exception occurred connecting to %s!", node)
+        logger.error("Exception raised: %s", e)
+        count_destination_stat(node, STAT_FAILURES)
+        record_destination_metric(node, started, 0, 0, True)
+        return None
+
+    keep_alive = False
+    read = reader.received
+    written = 0
+    result = None
     try:
         # Send the request with our standard headers
-        request = b"%s %s HTTP/1.1" % (method, request)
-        request_headers = default_populated_headers(node)
+        request_headers = request_headers_for(node, data)
         request_body = None
 
-        if data is not None:
-            request_headers[HEADER_DATA] = data
+        for attempt in range(2):
+            remaining = deadline_remaining(started, deadline_ms)
+            if remaining is not None:
+                if remaining <= 0:
+                    logger.warning("Dropping message '%s' to %s as it is too late.", request, node)
+                    count_destination_stat(node, STAT_DROPPED)
+                    return None
+                request_headers[HEADER_DEADLINE] = str(remaining)
 
-        if config.logging: print("Sending request...")
-        await send(writer, request, request_headers, request_body)
+            try:
+                response, headers, written = await exchange(
+                    reader, writer, method, request, request_headers, request_body,
+                    write_timeout_ms, read_timeout_ms)
+                break
+            except asyncio.TimeoutError:
+                raise
+            except Exception:
+                if not reused or attempt > 0:
+                    raise
 
-        # A response looks like this: HTTP/1.0 200 OK
-        if config.logging: print("Receiving response...")
-        response, headers = await receive(reader)
+            # The node closed the pooled connection while it was idle; try a new one.
+            logger.warning("Pooled connection to %s is stale, reconnecting.", node)
+            await close_connection(reader, writer)
+            reader, writer = await asyncio.wait_for_ms(open_connection(node), connect_timeout_ms)
+            read = 0
 
+        keep_alive = headers[HEADER_CONNECTION].lower() == CONNECTION_KEEP_ALIVE
+        clear_destination_failures(node)
+        if response == RESPONSE_TOO_LATE:
+            logger.warning("Message '%s' arrived too late at %s.", request, node)
+            count_destination_stat(node, STAT_DROPPED)
+            return None
+
+        if response_received is not None:
+            response_received(node, headers)
+
+        result = headers
         return headers
 
+    except asyncio.TimeoutError:
+        logger.warning("Timed out sending message '%s' to %s!", request, node)
+        count_destination_stat(node, STAT_TIMEOUTS)
+        count_destination_stat(node, STAT_FAILURES)
+
     except:
-        if config.logging: print("An exception occurred sending message '%s'!" % request)
+        logger.error("An exception occurred sending message '%s'!", request)
+        count_destination_stat(node, STAT_FAILURES)
 
     finally:
-        reader.close()
-        await reader.wait_closed()
-        writer.close()
-        await writer.wait_closed()
+        record_destination_metric(node, started, reader.received - read, written, result is None)
+        await release_connection(node, reader, writer, keep_alive)
+
+
+# Returns a connection to the node for a message that is not waiting for its
+# response, or None if one could not be opened in time.
+async def open_connection_nowait(node):
+    try:
+        return await asyncio.wait_for_ms(open_pooled_connection(node), SEND_CONNECT_TIMEOUT_MS)
+    except asyncio.TimeoutError:
+        logger.warning("Timed out connecting to %s!", node)
+        count_destination_stat(node, STAT_TIMEOUTS)
+    except Exception as e:
+        logger.error("An exception occurred connecting to %s!", node)
+        logger.error("Exception raised: %s", e)
+
+    return None
+
+
+# Sends the message and returns as soon as it has been written, without waiting for
+# the response. The response is read in the background so the connection can be
+# reused. Returns False if the message could not be sent. The node is only held
+# until the message has been written.
+async def send_nowait(node, method, request, data=None, priority=PRIORITY_CONTROL):
+    coroutine = send_nowait_queued(node, method, request, data, priority)
+    if request in idempotent_requests:
+        return await coalesce(('nowait', node, method, request, data), coroutine)
+    note_request(node, method, request, data)
+    return await coroutine
+
+
+async def send_nowait_queued(node, method, request, data, priority):
+    if not await acquire_send_turn(node, priority):
+        logger.warning("Dropping message '%s' to %s as too many are waiting.", request, node)
+        count_destination_stat(node, STAT_DROPPED)
+        return False
+
+    try:
+        connection = await open_connection_nowait(node)
+        if connection is None:
+            return False
+
+        reader, writer, reused = connection
+        try:
+            logger.debug("Sending request without waiting...")
+            await asyncio.wait_for_ms(
+                send(writer, method, request_headers_for(node, data), None, request), SEND_WRITE_TIMEOUT_MS)
+        except Exception as e:
+            logger.error("An exception occurred sending message '%s'!", request)
+            logger.error("Exception raised: %s", e)
+            await close_connection(reader, writer)
+            return False
+    finally:
+        release_send_turn(node)
+
+    asyncio.create_task(collect_responses(node, reader, writer, reused, [(method, request, data)], 1, priority))
+    return True
+
+
+# Writes several messages to the node one after the other on a single connection
+# without waiting for each response, so a burst of messages does not pay for a round
+# trip per message. The node handles them in order. messages is a list of
+# (method, request, data) tuples. Returns a task that collects the responses; its
+# result is a list of the response headers in the same order as messages, with None
+# for any message that failed, or for all of them if they were dropped or the node
+# could not be reached. If the node closes the connection part way through, responses
+# can be lost and those messages in idempotent_requests are sent again; the others
+# are None as they may have been handled. The node is held until every message has
+# been written.
+async def send_pipelined(node, messages, priority=PRIORITY_CONTROL):
+    if len(messages) > 0:
+        note_request(node, *messages[-1])
+    written = 0
+    connection = None
+    if await acquire_send_turn(node, priority):
+        try:
+            connection = await open_connection_nowait(node)
+            if connection is not None:
+                reader, writer, reused = connection
+                try:
+                    for method, request, data in messages:
+                        await asyncio.wait_for_ms(
+                            send(writer, method, request_headers_for(node, data), None, request),
+                            SEND_WRITE_TIMEOUT_MS)
+                        written += 1
+                except Exception as e:
+                    logger.error("An exception occurred pipelining messages to %s!", node)
+                    logger.error("Exception raised: %s", e)
+        finally:
+            release_send_turn(node)
+    else:
+        logger.warning("Dropping messages to %s as too many are waiting.", node)
+        count_destination_stat(node, STAT_DROPPED)
+
+    if connection is None:
+        reader = writer = None
+        reused = False
+
+    return asyncio.create_task(collect_responses(node, reader, writer, reused, messages, written, priority))
+
+
+# Reads the responses to messages written to the connection. If the node closes the
+# connection before responding to them all, such as a stale pooled connection or a
+# node that will not keep the connection open, the rest that are safe to repeat are
+# sent again on their own. reader is None when there is no connection, as the
+# messages were dropped or the node could not be reached, and nothing is sent again.
+async def collect_responses(node, reader, writer, reused, messages, written, priority):
+    responses = []
+    keep_alive = False
+    resend = reader is not None
+    if reader is not None:
+        try:
+            while len(responses) < written:
+                response, headers = await read_response(reader, SEND_READ_TIMEOUT_MS)
+                responses.append(headers)
+                keep_alive = headers[HEADER_CONNECTION].lower() == CONNECTION_KEEP_ALIVE
+                if not keep_alive:
+                    break
+        except asyncio.TimeoutError:
+            logger.warning("Timed out waiting for responses from %s!", node)
+            count_destination_stat(node, STAT_TIMEOUTS)
+            keep_alive = False
+            resend = False
+        except Exception as e:
+            logger.warning("Connection to %s closed with responses outstanding.", node)
+            keep_alive = False
+        finally:
+            await release_connection(node, reader, writer, keep_alive and len(responses) == len(messages))
+
+    for method, request, data in messages[len(responses):]:
+        if resend and request in idempotent_requests:
+            responses.append(await send_message(node, method, request, data, priority=priority))
+        else:
+            responses.append(None)
+
+    return responses
+
+
+# ********************************************************************************
+# Datagram transport
+# ********************************************************************************
+# Cues that do not need a reply can be sent as a single UDP datagram rather than an
+# HTTP request. Datagrams are dispatched through the same message_responders as HTTP
+# requests, with the response discarded. A datagram looks like this:
+#
+#   b'C 51370 42 /sounds/play\nname\nrole\ndata'
+#
+# The first line is the kind of datagram, the sender's boot id, its sequence number
+# and the route, followed by the name and role of the sender and the data. The
+# sender's address comes from the datagram itself. Sequence numbers let the receiver
+# drop duplicates, which occur when an acknowledged datagram is resent because its ack
+# was lost. The boot id is chosen at random when the node starts, so a sender that has
+# restarted its sequence numbers is not mistaken for one resending old datagrams.
+#
+# A group datagram is broadcast to every node on the network and has the group it is
+# addressed to at the end of its first line, for example:
+#
+#   b'G 51370 43 /lights/off path,cauldron\nname\nrole\n'
+#
+# The group is a comma separated list of roles and names, or * for all nodes. Each
+# node only handles group datagrams that include its role or name. This means one
+# datagram reaches every member of a role however many nodes are registered.
+DATAGRAM_CUE = 'C'  # A cue that is not acknowledged.
+DATAGRAM_CUE_ACK = 'A'  # A cue that must be acknowledged.
+DATAGRAM_ACK = 'K'  # Acknowledges a cue; the route is empty.
+DATAGRAM_GROUP = 'G'  # A cue broadcast to a group of nodes, which is not acknowledged.
+DATAGRAM_GROUP_ALL = '*'
+
+DATAGRAM_PORT = 5005
+DATAGRAM_SIZE = 256  # Largest datagram that will be received.
+DATAGRAM_POLL_MS = 10  # How often the socket is checked for datagrams.
+DATAGRAM_ACK_TIMEOUT_MS = 100  # How long to wait for an ack before resending.
+DATAGRAM_RETRIES = 3
+DATAGRAM_DUPLICATE_WINDOW = 30  # Sequence numbers remembered, at most 30 so the bitmap is a small int.
+DATAGRAM_WINDOW_MASK = (1 << DATAGRAM_DUPLICATE_WINDOW) - 1
+DATAGRAM_GROUP_REPEATS = 2  # Group datagrams cannot be acked so are sent more than once.
+
+datagram_socket = None
+datagram_boot = random.getrandbits(16)  # Identifies this run of the node in its datagrams.
+datagram_sequence = 0
+datagram_pending = {}  # Sequence numbers awaiting an ack, mapped to the node they were sent to.
+datagram_last_sequences = {}  # The boot id, last sequence number and bitmap of those seen from each sender.
+
+
+def open_datagram_socket():
+    global datagram_socket
+    datagram_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagram_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_BROADCAST'):
+        datagram_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    datagram_socket.bind(socket.getaddrinfo('0.0.0.0', DATAGRAM_PORT)[0][-1])
+    datagram_socket.setblocking(False)
+
+
+def next_datagram_sequence():
+    global datagram_sequence
+    datagram_sequence = (datagram_sequence + 1) & 0xFFFF
+    return datagram_sequence
+
+
+# The broadcast address of the network this node is connected to.
+def broadcast_address():
+    status = wlan.ifconfig()
+    address = status[0].split('.')
+    mask = status[1].split('.')
+    return '.'.join([str(int(address[i]) | (~int(mask[i]) & 0xFF)) for i in range(4)])
+
+
+def send_datagram_packet(node, kind, sequence, request, data, group=None, deadline=None):
+    if data is None:
+        data = ''
+    if group is not None:
+        request = '%s %s' % (request, group)
+    packet = '%s %s %s %s\n%s\n%s\n%s' % (kind, datagram_boot, sequence, request, config.name, config.role, data)
+    if deadline is not None:
+        packet = '%s\n%s' % (packet, deadline)
+    packet = packet.encode('utf-8')
+    datagram_socket.sendto(packet, (node, DATAGRAM_PORT))
+
+
+# Returns True if the sequence number has already been seen from the sender.
+# Bit n of the bitmap is set when the sequence number n behind the last has been seen,
+# so a datagram that arrives after a later one, such as a resend of a lost cue while
+# another cue went to the same node, is still handled. Only exact repeats are dropped.
+# A datagram too far behind to be in the bitmap is handled, as it can't be known
+# whether it was seen.
+def is_duplicate_datagram(sender, boot, sequence):
+    last = datagram_last_sequences.get(sender)
+    if last is None or last[0] != boot:
+        # First datagram from the sender since it, or this node, started.
+        datagram_last_sequences[sender] = [boot, sequence, 1]
+        return False
+
+    ahead = (sequence - last[1]) & 0xFFFF
+    if 0 < ahead < 0x8000:
+        if ahead < DATAGRAM_DUPLICATE_WINDOW:
+            # Masked before shifting so it never grows past a small int.
+            last[2] = ((last[2] & (DATAGRAM_WINDOW_MASK >> ahead)) << ahead) | 1
+        else:
+            last[2] = 1
+        last[1] = sequence
+        return False
+
+    behind = (last[1] - sequence) & 0xFFFF
+    if behind >= DATAGRAM_DUPLICATE_WINDOW:
+        return False
+
+    bit = 1 << behind
+    if last[2] & bit:
+        return True
+
+    last[2] |= bit
+    return False
+
+
+# node is the IP address to send to
+# request is the request to send.
+# If ack is True the datagram is resent until it is acknowledged and the return value
+# indicates whether it was, otherwise True is returned once the datagram is sent.
+# deadline_ms is how long the datagram is useful for, as for send_message().
+async def send_datagram(node, request, data=None, ack=False, deadline_ms=None):
+    global datagram_pending
+    if datagram_socket is None:
+        # The datagram transport is not running yet so fall back to HTTP.
+        return await send_message(node, "GET", request, data, deadline_ms, priority=PRIORITY_CUE) is not None
+
+    note_request(node, "GET", request, data)
+    started = time.ticks_ms()
+    sequence = next_datagram_sequence()
+    try:
+        if not ack:
+            send_datagram_packet(node, DATAGRAM_CUE, sequence, request, data, None, deadline_ms)
+            return True
+
+        datagram_pending[sequence] = node
+        for attempt in range(DATAGRAM_RETRIES):
+            remaining = deadline_remaining(started, deadline_ms)
+            if remaining is not None and remaining <= 0:
+                logger.warning("Dropping datagram '%s' to %s as it is too late.", request, node)
+                count_destination_stat(node, STAT_DROPPED)
+                return False
+
+            send_datagram_packet(node, DATAGRAM_CUE_ACK, sequence, request, data, None, remaining)
+            deadline = time.ticks_add(time.ticks_ms(), DATAGRAM_ACK_TIMEOUT_MS)
+            while time.ticks_diff(deadline, time.ticks_ms()) > 0:
+                await asyncio.sleep_ms(DATAGRAM_POLL_MS)
+                if sequence not in datagram_pending:
+                    return True
+
+        logger.warning("No ack for datagram '%s' to %s.", request, node)
+        return False
+
+    except Exception as e:
+        logger.error("An exception occurred sending datagram '%s'!", request)
+        logger.error("Exception raised: %s", e)
+        return False
+
+    finally:
+        if sequence in datagram_pending:
+            del datagram_pending[sequence]
+
+
+# group is a comma separated list of roles and names, or DATAGRAM_GROUP_ALL.
+# request is the request to send.
+# Returns False if the datagram transport is not running, in which case the caller
+# should send the message to each node itself.
+async def send_group_datagram(group, request, data=None):
+    if datagram_socket is None:
+        return False
+
+    sequence = next_datagram_sequence()
+    try:
+        address = broadcast_address()
+        for attempt in range(DATAGRAM_GROUP_REPEATS):
+            send_datagram_packet(address, DATAGRAM_GROUP, sequence, request, data, group)
+            await asyncio.sleep_ms(DATAGRAM_POLL_MS)
+        return True
+
+    except Exception as e:
+        logger.error("An exception occurred sending group datagram '%s'!", request)
+        logger.error("Exception raised: %s", e)
+        return False
+
+
+# Returns True if this node is a member of the group.
+def in_datagram_group(group):
+    for member in group.split(','):
+        if member == DATAGRAM_GROUP_ALL or member == config.role or member == config.name:
+            return True
+
+    return False
+
+
+async def receive_datagram(packet, sender, received):
+    global message_responders
+    request = None
+    try:
+        lines = packet.decode('utf-8').split('\n')
+        first = lines[0].split(' ')
+        if len(lines) < 4 or len(first) < 4:
+            logger.warning("Cannot process datagram: '%s'", packet)
+            return
+
+        kind = first[0]
+        boot = int(first[1])
+        sequence = int(first[2])
+        request = first[3]
+
+        if kind == DATAGRAM_ACK:
+            if datagram_pending.get(sequence) == sender:
+                del datagram_pending[sequence]
+            return
+
+        if kind == DATAGRAM_GROUP:
+            # Broadcasts come back to the sender too.
+            if sender == ip or len(first) < 5 or not in_datagram_group(first[4]):
+                return
+
+        # Ack straight away so the sender is not kept waiting on the handler. Only exact
+        # repeats are dropped as duplicates, and those are acked too as they are resent
+        # because the first ack was lost, so every datagram acked has been handled.
+        if kind == DATAGRAM_CUE_ACK:
+            send_datagram_packet(sender, DATAGRAM_ACK, sequence, '', None)
+
+        if is_duplicate_datagram(sender, boot, sequence):
+            logger.debug("Dropping duplicate datagram %s from %s.", sequence, sender)
+            return
+
+        if len(lines) > 4 and is_too_late(lines[4], received):
+            logger.warning("Dropping datagram '%s' as it is too late.", request)
+            return
+
+        logger.debug("Received datagram: '%s' from %s", request, sender)
+        headers = {
+            HEADER_SENDER: sender,
+            HEADER_HOST: ip,
+            HEADER_NAME: lines[1],
+            HEADER_ROLE: lines[2],
+            HEADER_DATA: lines[3],
+            HEADER_CONNECTION: "",
+            HEADER_CONTENT_LENGTH: "",
+            HEADER_DEADLINE: "",
+            HEADER_DIRECTORY_VERSION: "",
+        }
+        if message_received is not None:
+            message_received(headers, None)
+
+        route, responder = find_responder(request, headers)
+        if responder is None:
+            logger.warning("No route for datagram: '%s'", request)
+            record_route_metric(None, received, len(packet), 0, False)
+            return
+
+        try:
+            await responder("GET", request, headers, default_populated_headers(sender))
+        except:
+            record_route_metric(route, received, len(packet), 0, True)
+            raise
+        record_route_metric(route, received, len(packet), 0, False)
+
+    except Exception as e:
+        logger.error("An exception occurred receiving datagram '%s'!", request)
+        logger.error("Exception raised: %s", e)
+
+
+# Datagrams are handled one at a time so cues from a sender are run in order.
+async def datagram_task():
+    while True:
+        try:
+            packet, address = datagram_socket.recvfrom(DATAGRAM_SIZE)
+        except OSError:
+            await asyncio.sleep_ms(DATAGRAM_POLL_MS)
+            continue
+
+        await receive_datagram(packet, address[0], time.ticks_ms())
+
+
+# ********************************************************************************
+# Wi-Fi supervisor
+# ********************************************************************************
+# Watches the Wi-Fi connection and reconnects if it drops, without blocking the event
+# loop. Attempts back off from one second up to 30 seconds while the network is
+# unavailable. Once reconnected the server is restarted if the address has changed,
+# pooled connections are dropped and the network_reconnected hook is run so the node
+# can register with the coordinator again.
+WIFI_CHECK_MS = 1000  # How often the connection is checked.
+WIFI_CONNECT_TIMEOUT_MS = 10000  # How long a single attempt to connect can take.
+WIFI_BACKOFF_MIN_MS = 1000
+WIFI_BACKOFF_MAX_MS = 30000
+
+server = None  # The HTTP server, once the network is up.
+
+# Timings of network outages for the metrics.
+wifi_disconnects = 0
+wifi_reconnects = 0
+wifi_attempts = 0  # Attempts to reconnect, successful or not.
+wifi_disconnected = None  # When the current outage started, or None when connected.
+wifi_last_outage_ms = 0
+wifi_longest_outage_ms = 0
+wifi_total_outage_ms = 0
+
+
+async def start_http_server():
+    global server
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+    server = await asyncio.start_server(receive_message, ip, PORT)
+    record_boot_phase('server')
+
+
+# Returns True once connected, or False if the attempt failed or took too long.
+async def reconnect_to_network():
+    global wifi_attempts
+    wifi_attempts += 1
+    try:
+        wlan.disconnect()
+        wlan.active(True)
+        wlan.connect(config.ssid, config.password)
+    except Exception as e:
+        logger.error("An exception occurred connecting to the network: %s", e)
+        return False
+
+    waited = 0
+    while waited < WIFI_CONNECT_TIMEOUT_MS:
+        status = wlan.status()
+        if status == WIFI_STATUS_UP:
+            return True
+        if status < 0:
+            logger.warning("Network connection failed with status %s.", status)
+            return False
+        await asyncio.sleep_ms(100)
+        waited += 100
+
+    logger.warning("Timed out connecting to the network.")
+    return False
+
+
+async def network_connected():
+    global ip
+    previous = ip
+    ip = wlan.ifconfig()[0]
+    encode_header_block()
+    logger.info("Network address:%s", ip)
+    record_boot_phase('wifi')
+
+    await close_pooled_connections()
+    if server is None or ip != previous:
+        await start_http_server()
+
+    if network_reconnected is not None:
+        asyncio.create_task(network_reconnected())
+
+
+def record_disconnect():
+    global wifi_disconnects, wifi_disconnected
+    wifi_disconnects += 1
+    wifi_disconnected = time.ticks_ms()
+    logger.warning("Network connection lost with status %s.", wlan.status())
+
+
+def record_reconnect():
+    global wifi_reconnects, wifi_disconnected, wifi_last_outage_ms, wifi_longest_outage_ms, wifi_total_outage_ms
+    wifi_reconnects += 1
+    wifi_last_outage_ms = time.ticks_diff(time.ticks_ms(), wifi_disconnected)
+    wifi_longest_outage_ms = max(wifi_longest_outage_ms, wifi_last_outage_ms)
+    wifi_total_outage_ms += wifi_last_outage_ms
+    wifi_disconnected = None
+    logger.info("Network reconnected after %s ms.", wifi_last_outage_ms)
+
+
+async def wifi_task():
+    backoff = WIFI_BACKOFF_MIN_MS
+    while True:
+        if wlan.status() == WIFI_STATUS_UP and server is not None:
+            await asyncio.sleep_ms(WIFI_CHECK_MS)
+            continue
+
+        if wlan.status() != WIFI_STATUS_UP:
+            if wifi_disconnected is None:
+                record_disconnect()
+
+            if not await reconnect_to_network():
+                await asyncio.sleep_ms(backoff)
+                backoff = min(backoff * 2, WIFI_BACKOFF_MAX_MS)
+                continue
+
+            record_reconnect()
+
+        backoff = WIFI_BACKOFF_MIN_MS
+        try:
+            await network_connected()
+        except Exception as e:
+            logger.error("An exception occurred starting the network: %s", e)
+            await asyncio.sleep_ms(WIFI_CHECK_MS)
 
 
 directory_task = None  # This is a hook to allow the directory file to define a regular schedule task.
 messages_task = None  # This is a hook to allow the messages file to define a regular schedule task.
 user_task = None  # This is a hook to allow the user code file to define a regular schedule task.
+network_reconnected = None  # This is a hook run after the network has been reconnected.
+# Hooks called for every message received, with its headers and the response headers
+# (None for a datagram), and for every response received, with the node and headers.
+message_received = None
+response_received = None
 
 
 async def main_loop():
     global directory_task, messages_task, user_task
-    asyncio.create_task(asyncio.start_server(receive_message, ip, 80))
+    if ip is not None:
+        await start_http_server()
+    asyncio.create_task(wifi_task())
+    asyncio.create_task(pool_task())
+
+    try:
+        open_datagram_socket()
+        asyncio.create_task(datagram_task())
+    except Exception as e:
+        logger.warning("Datagrams unavailable, messages will use HTTP: %s", e)
+
+    if logger.log_file is not None:
+        asyncio.create_task(logger.flush_task())
 
     # If a directory_task has been defined then execute it now.
     if directory_task is not None:
@@ -228,7 +1991,9 @@ async def main_loop():
 def run(callback=None):
     global user_task
     user_task = callback
+    record_boot_phase('import')
     connect_to_network()
+    size_connection_pool()
     try:
         asyncio.run(main_loop())
     finally:
@@ -1,5 +1,5 @@
 # The sensor box has a range of sensors that can be used to send events to the co-ordinator.
-import config
+import logger
 import messages
 import pico
 import coordinator
@@ -18,6 +18,9 @@ ds = DistanceSensor(echo=2, trigger=3, max_distance=MAX_DISTANCE)
 
 PROXIMITY_EVENTS_RESET = '/events/reset'
 
+# Sending these again while they are in flight changes nothing, so the sends are shared.
+pico.idempotent_requests.add(PROXIMITY_EVENTS_RESET)
+
 
 # Returns the distance of the ultrasonic sensor in cm
 async def get_distance():
@@ -28,13 +31,13 @@ async def get_distance():
 
 
 async def send_distance_get_message(ip):
-    if config.logging: print("Sending distance message to %s." % ip)
+    logger.debug("Sending distance message to %s.", ip)
     distance = await get_distance()
     await pico.send_message(ip, "GET", DISTANCE_GET, distance)
 
 
 async def respond_to_distance_get(method, request, headers, response_headers):
-    if config.logging: print("Responding to distance message.")
+    logger.debug("Responding to distance message.")
 
     distance = await get_distance()
 
@@ -54,11 +57,11 @@ proximity_250 = 0
 
 
 async def trigger_event(event):
-    if config.logging: print("Triggering event %s." % event)
-    if config.coordinator is not None:
-        await coordinator.send_event_message(config.coordinator, event)
+    logger.info("Triggering event %s.", event)
+    if messages.coordinator is not None:
+        await coordinator.send_event_message(messages.coordinator, event)
     else:
-        if config.logging: print("Coordinator not set, no event message sent.")
+        logger.warning("Coordinator not set, no event message sent.")
 
 
 async def check_for_events():
@@ -69,7 +72,7 @@ async def check_for_events():
     global proximity_250
 
     distance = await get_distance()
-    if config.logging: print("Checking for events based on distance of %s." % distance)
+    logger.debug("Checking for events based on distance of %s.", distance)
 
     now = time.time()
     expiry = now + PROXIMITY_EVENT_TIMEOUT
@@ -101,12 +104,12 @@ async def check_for_events():
 
 
 async def send_proximity_events_reset(ip):
-    if config.logging: print("Sending proximity events reset message to %s." % ip)
+    logger.debug("Sending proximity events reset message to %s.", ip)
     await pico.send_message(ip, "GET", PROXIMITY_EVENTS_RESET)
 
 
 async def respond_to_proximity_events_reset(method, request, headers, response_headers):
-    if config.logging: print("Responding to proximity events reset message.")
+    logger.debug("Responding to proximity events reset message.")
 
     global proximity_50
     global proximity_100
@@ -126,7 +129,7 @@ async def respond_to_proximity_events_reset(method, request, headers, response_h
 
 # This must not be too greedy otherwise it will interfere with the HTTP server.
 async def background_tasks():
-    if config.logging: print("The maximum distance the sensor can return is %s meters." % ds.max_distance)
+    logger.info("The maximum distance the sensor can return is %s meters.", ds.max_distance)
     while True:
         await asyncio.sleep_ms(50)
         await check_for_events()
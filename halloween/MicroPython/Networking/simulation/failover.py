@@ -0,0 +1,98 @@
+# Measures how long the show takes to fail over to a standby coordinator, with CPython:
+#
+#   python simulation/failover.py [--extra-paths N] [--logging]
+#
+# A primary and a standby coordinator are started with the show's endpoints, which are
+# told the standby's address. Once the standby has caught up with the primary's
+# directory the primary is powered off. The time until the standby takes over and
+# until each endpoint has moved to it is printed, with the failover times the nodes
+# report in /inspect, and the red button is pressed to check the standby runs the show.
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness
+
+TIMEOUT_S = 30  # How long the failover can take before giving up.
+POLL_S = 0.05
+
+
+def build(simulation, extra_paths):
+    standby_address = simulation.next_address(1)
+    primary = simulation.add_node('coordinator', 'coordinator', standby=standby_address)
+    simulation.add_node('standby', 'coordinator', primary=primary)
+    simulation.add_node('path-left', 'path', primary, standby=standby_address)
+    simulation.add_node('path-right', 'path', primary, standby=standby_address)
+    simulation.add_node('cauldron', 'cauldron', primary, standby=standby_address)
+    simulation.add_node('button-red', 'button', primary, button_event='ENTER_BTN_PRESSED', standby=standby_address)
+    simulation.add_node('button-blue', 'button', primary, button_event='DOOR_BTN_PRESSED', standby=standby_address)
+    simulation.add_node('sensor-door', 'sensor', primary, standby=standby_address)
+    for i in range(extra_paths):
+        simulation.add_node('path-%s' % (i + 1), 'path', primary, standby=standby_address)
+
+
+# Waits until the test is true, returning the seconds taken or None if it never was.
+async def wait_until(test, started):
+    while not test():
+        if time.monotonic() - started > TIMEOUT_S:
+            return None
+        await asyncio.sleep(POLL_S)
+    return time.monotonic() - started
+
+
+def format_seconds(seconds):
+    return 'did not happen' if seconds is None else '%.2f s' % seconds
+
+
+async def scenario(simulation):
+    primary = simulation.node('coordinator')
+    standby = simulation.node('standby')
+    endpoints = [node for node in simulation.nodes if node.role != 'coordinator']
+    primary_directory = primary.module('directory')
+    standby_messages = standby.module('messages')
+
+    caught_up = await wait_until(lambda: standby_messages.replica_version == primary_directory.version,
+                                 time.monotonic())
+    print('Standby caught up with the directory in %s, %s endpoints at version %s.' % (
+        format_seconds(caught_up), len(standby.module('directory').directory), standby_messages.replica_version))
+
+    primary.stop()
+    stopped = time.monotonic()
+    print('Primary powered off.')
+
+    taken_over = await wait_until(lambda: not standby_messages.standing_by, stopped)
+    print('Standby took over after %s (it reports %s ms since last hearing from the primary).' % (
+        format_seconds(taken_over), standby_messages.failover_ms))
+
+    print('%-12s %14s %14s' % ('endpoint', 'moved after', 'reported ms'))
+    slowest = 0
+    for node in endpoints:
+        messages = node.module('messages')
+        moved = await wait_until(lambda: messages.coordinator == standby.address, stopped)
+        slowest = None if moved is None or slowest is None else max(slowest, moved)
+        print('%-12s %14s %14s' % (node.name, format_seconds(moved), messages.failover_ms))
+    print('Every endpoint had moved after %s.' % format_seconds(slowest))
+
+    simulation.node('button-red').box.button.press()
+    handled = await wait_until(lambda: '/event' in standby.pico.route_metric_rows, time.monotonic())
+    print('Red button event handled by the standby: %s' % ('yes' if handled is not None else 'no'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure failing over to a standby coordinator.')
+    parser.add_argument('--extra-paths', type=int, default=0, help='additional path nodes')
+    parser.add_argument('--port', type=int, default=harness.PORT, help='port every node listens on')
+    parser.add_argument('--logging', action='store_true', help='turn on logging in every node')
+    args = parser.parse_args()
+
+    simulation = harness.Simulation(args.port, args.logging)
+    build(simulation, args.extra_paths)
+    asyncio.run(simulation.run(scenario))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+# Runs several virtual nodes in one CPython process so the networking code can be
+# tested and measured without Pico Ws. Each node gets its own copy of pico.py,
+# messages.py, directory.py, its box module and the stand-ins for the MicroPython
+# modules in stubs/, so nodes share nothing but the event loop. Every node listens on
+# its own loopback address (127.0.0.2, 127.0.0.3, ...) on the same port, just as the
+# Pico Ws each have their own IP address on port 80.
+#
+#   simulation = harness.Simulation()
+#   coordinator = simulation.add_node('coordinator', 'coordinator')
+#   simulation.add_node('path-left', 'path', coordinator=coordinator)
+#   asyncio.run(simulation.run(scenario))
+#
+# where scenario is an async function called with the simulation once every node is up.
+# A node can be powered off during the scenario with node.stop().
+import asyncio
+import contextvars
+import gc
+import importlib
+import os
+import socket
+import sys
+import time
+import tracemalloc
+import types
+
+SIMULATION_DIR = os.path.dirname(os.path.abspath(__file__))
+STUBS_DIR = os.path.join(SIMULATION_DIR, 'stubs')
+NETWORKING_DIR = os.path.dirname(SIMULATION_DIR)
+
+# The module each role runs, with its init() and background_tasks().
+ROLE_MODULES = {
+    'coordinator': 'coordinator',
+    'path': 'path_box',
+    'cauldron': 'cauldron_box',
+    'button': 'button_box',
+    'sensor': 'sensor_box',
+}
+
+# Modules shared by all nodes; everything else imported for a node is its own copy.
+SHARED_MODULES = ('uasyncio',)
+
+PORT = 8080  # Port 80 needs root on most machines.
+FIRST_ADDRESS = 2  # Nodes are given 127.0.0.2 onwards.
+LAST_ADDRESS = 254  # 127.0.0.255 stands in for the broadcast address.
+HEAP_BYTES = 192 * 1024  # Roughly the heap of a Pico W running MicroPython.
+START_DELAY_MS = 100  # Time for a node's server to start before the next node starts.
+SETTLE_TIMEOUT_MS = 10000  # How long to wait for the endpoints to register.
+
+
+# MicroPython adds ticks functions to time and heap functions to gc. Ticks count from
+# when the simulation starts, as they count from power-up on the Pico, and wrap at 2^30. The heap figures come from tracemalloc when it is running and
+# are for the whole process, not a single node.
+TICKS_PERIOD = 1 << 30
+STARTED = time.monotonic()
+
+
+def ticks_diff(end, start):
+    diff = (end - start) & (TICKS_PERIOD - 1)
+    return diff - TICKS_PERIOD if diff >= TICKS_PERIOD // 2 else diff
+
+
+def mem_alloc():
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+def install():
+    if STUBS_DIR not in sys.path:
+        sys.path.insert(0, STUBS_DIR)
+    if NETWORKING_DIR not in sys.path:
+        sys.path.insert(1, NETWORKING_DIR)
+
+    time.ticks_ms = lambda: int((time.monotonic() - STARTED) * 1000) & (TICKS_PERIOD - 1)
+    time.ticks_us = lambda: int((time.monotonic() - STARTED) * 1000000) & (TICKS_PERIOD - 1)
+    time.ticks_add = lambda ticks, delta: (ticks + delta) & (TICKS_PERIOD - 1)
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = lambda: HEAP_BYTES
+    importlib.import_module('uasyncio')
+
+
+# Loopback has no broadcast address, so each node's datagram socket is bound to the
+# node's own address and datagrams sent to the broadcast address are delivered to
+# every node in the simulation. This stands in for the socket module in pico.py.
+class DatagramSockets:
+    AF_INET = socket.AF_INET
+    SOCK_DGRAM = socket.SOCK_DGRAM
+    SOCK_STREAM = socket.SOCK_STREAM
+    SOL_SOCKET = socket.SOL_SOCKET
+    SO_REUSEADDR = socket.SO_REUSEADDR
+    SO_BROADCAST = socket.SO_BROADCAST
+
+    def __init__(self, simulation, node):
+        self.simulation = simulation
+        self.node = node
+
+    def getaddrinfo(self, host, port, *args):
+        if host == '0.0.0.0':
+            host = self.node.address
+        return socket.getaddrinfo(host, port, socket.AF_INET)
+
+    def socket(self, family=socket.AF_INET, kind=socket.SOCK_STREAM, *args):
+        return BroadcastSocket(self.simulation, socket.socket(family, kind, *args))
+
+
+class BroadcastSocket:
+    def __init__(self, simulation, wrapped):
+        self.simulation = simulation
+        self.wrapped = wrapped
+
+    def sendto(self, data, address):
+        host, port = address
+        if not host.endswith('.255'):
+            return self.wrapped.sendto(data, address)
+
+        for node in self.simulation.nodes:
+            self.wrapped.sendto(data, (node.address, port))
+        return len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+# Returns the node's address, whether given the node or the address itself.
+def address_of(node):
+    return node if node is None or isinstance(node, str) else node.address
+
+
+class Node:
+    def __init__(self, simulation, name, role, address, coordinator=None, button_event='none', logging=False,
+                 standby=None, primary=None):
+        self.simulation = simulation
+        self.name = name
+        self.role = role
+        self.address = address
+        self.tasks = set()  # The node's tasks, cancelled when it is stopped.
+        self.modules = load_node_modules({
+            'ssid': 'simulation',
+            'password': '',
+            'coordinator': address_of(coordinator),
+            'standby': address_of(standby),
+            'primary': address_of(primary),
+            'name': name,
+            'role': role,
+            'logging': logging,
+            'button_event': button_event,
+            'boot_state_file': None,  # Nodes share a directory, so fast boot is off.
+            'directory_file': None,
+        }, address, ROLE_MODULES[role])
+        self.pico = self.modules['pico']
+        self.box = self.modules[ROLE_MODULES[role]]
+
+    def module(self, name):
+        return self.modules[name]
+
+    async def start(self):
+        pico = self.pico
+        pico.PORT = self.simulation.port
+        pico.socket = DatagramSockets(self.simulation, self)
+        self.box.init()
+        pico.record_boot_phase('import')
+        pico.connect_to_network()
+        pico.size_connection_pool()
+        pico.user_task = getattr(self.box, 'background_tasks', None)
+
+        # Tasks started from the node's main loop inherit the context, so are tracked.
+        context = contextvars.copy_context()
+        context.run(importlib.import_module('uasyncio').node_tasks.set, self.tasks)
+        self.tasks.add(asyncio.create_task(pico.main_loop(), context=context))
+
+    # Powers the node off: it stops listening and its tasks and the connections it is
+    # serving are cancelled. Nodes talking to it find it gone as they would a Pico W.
+    def stop(self):
+        pico = self.pico
+        if pico.server is not None:
+            pico.server.close()
+        if pico.datagram_socket is not None:
+            pico.datagram_socket.close()
+        for task in list(self.tasks):
+            task.cancel()
+
+
+# Imports a fresh copy of the modules for a node: config from the values given, the
+# network stand-in with the node's address and then the box module, which imports the
+# rest. The copies are removed from sys.modules again so the next node gets its own.
+def load_node_modules(config_values, address, module_name):
+    config = types.ModuleType('config')
+    config.__dict__.update(config_values)
+
+    sys.modules['config'] = config
+    try:
+        network = importlib.import_module('network')
+        network.address = address
+        importlib.import_module(module_name)
+    finally:
+        modules = {}
+        for name, module in list(sys.modules.items()):
+            if is_node_module(name, module):
+                modules[name] = sys.modules.pop(name)
+
+    return modules
+
+
+def is_node_module(name, module):
+    if name in SHARED_MODULES:
+        return False
+    if name == 'config':
+        return True
+    path = getattr(module, '__file__', None)
+    return path is not None and os.path.dirname(os.path.abspath(path)) in (NETWORKING_DIR, STUBS_DIR)
+
+
+class Simulation:
+    def __init__(self, port=PORT, logging=False):
+        self.port = port
+        self.logging = logging
+        self.nodes = []
+
+    # The coordinator, standby and primary may be given as nodes or addresses, so a
+    # coordinator can be given the address of a standby not yet added.
+    def add_node(self, name, role, coordinator=None, button_event='none', standby=None, primary=None):
+        if FIRST_ADDRESS + len(self.nodes) > LAST_ADDRESS:
+            raise ValueError('No loopback address left for %s' % name)
+
+        node = Node(self, name, role, self.next_address(), coordinator, button_event, self.logging,
+                    standby, primary)
+        self.nodes.append(node)
+        return node
+
+    # Returns the address of the node that will be added after `later` more, the next by default.
+    def next_address(self, later=0):
+        return '127.0.0.%s' % (FIRST_ADDRESS + len(self.nodes) + later)
+
+    def node(self, name):
+        for node in self.nodes:
+            if node.name == name:
+                return node
+        return None
+
+    # Waits until every endpoint has registered with its coordinator.
+    async def settle(self):
+        deadline = time.ticks_add(time.ticks_ms(), SETTLE_TIMEOUT_MS)
+        for coordinator in [node for node in self.nodes if node.role == 'coordinator']:
+            directory = coordinator.module('directory').directory
+            endpoints = [node.name for node in self.nodes
+                         if node.module('config').coordinator == coordinator.address]
+            while any(name not in directory for name in endpoints):
+                if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                    raise RuntimeError('Endpoints did not register with %s' % coordinator.name)
+                await asyncio.sleep(0.05)
+
+    # Starts the nodes, coordinators first, then runs the scenario.
+    async def run(self, scenario=None):
+        for node in sorted(self.nodes, key=lambda node: node.role != 'coordinator'):
+            await node.start()
+            await asyncio.sleep(START_DELAY_MS / 1000)
+
+        await self.settle()
+        if scenario is not None:
+            return await scenario(self)
+
+
+install()
@@ -0,0 +1,59 @@
+# Runs the Halloween show on virtual nodes with CPython:
+#
+#   python simulation/show.py [--extra-paths N] [--seconds S] [--logging]
+#
+# The coordinator, both paths, the cauldron, both buttons and the door sensor are
+# started on loopback, the red button is pressed to start the enter script and after
+# the given time each node's metrics are printed. Extra path nodes can be added to see
+# how the coordinator copes with a larger show.
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness
+
+
+def build(simulation, extra_paths):
+    coordinator = simulation.add_node('coordinator', 'coordinator')
+    simulation.add_node('path-left', 'path', coordinator)
+    simulation.add_node('path-right', 'path', coordinator)
+    simulation.add_node('cauldron', 'cauldron', coordinator)
+    simulation.add_node('button-red', 'button', coordinator, button_event='ENTER_BTN_PRESSED')
+    simulation.add_node('button-blue', 'button', coordinator, button_event='DOOR_BTN_PRESSED')
+    simulation.add_node('sensor-door', 'sensor', coordinator)
+    for i in range(extra_paths):
+        simulation.add_node('path-%s' % (i + 1), 'path', coordinator)
+
+
+def print_metrics(simulation):
+    for node in simulation.nodes:
+        print('%s (%s)' % (node.name, node.address))
+        for line in node.pico.metrics_lines()[1:]:
+            print('  ' + line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the show on virtual nodes.')
+    parser.add_argument('--extra-paths', type=int, default=0, help='additional path nodes')
+    parser.add_argument('--seconds', type=float, default=10, help='how long to run the show for')
+    parser.add_argument('--port', type=int, default=harness.PORT, help='port every node listens on')
+    parser.add_argument('--logging', action='store_true', help='turn on logging in every node')
+    args = parser.parse_args()
+
+    simulation = harness.Simulation(args.port, args.logging)
+    build(simulation, args.extra_paths)
+
+    async def scenario(simulation):
+        print('%s nodes registered with the coordinator.' % len(simulation.node('coordinator').module('directory').directory))
+        simulation.node('button-red').box.button.press()
+        await asyncio.sleep(args.seconds)
+        print_metrics(simulation)
+
+    asyncio.run(simulation.run(scenario))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# CPython stand-in for MicroPython's machine module. Pins and PWM outputs remember what
+# they were set to so a simulation can check what a node would have done.
+FREQUENCY = 125000000
+
+reset_requested = False
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.state = 0 if value is None else value
+
+    def value(self, value=None):
+        if value is None:
+            return self.state
+        self.state = 1 if value else 0
+
+    def on(self):
+        self.state = 1
+
+    def off(self):
+        self.state = 0
+
+    def toggle(self):
+        self.state = 1 - self.state
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+
+class PWM:
+    def __init__(self, pin):
+        self.pin = pin
+        self.frequency = 0
+        self.duty = 0
+
+    def freq(self, value=None):
+        if value is None:
+            return self.frequency
+        self.frequency = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self.duty
+        self.duty = value
+
+    def deinit(self):
+        pass
+
+
+def freq(value=None):
+    return FREQUENCY
+
+
+# A simulated node cannot restart the process it shares with the other nodes, so the
+# request is only recorded.
+def reset():
+    global reset_requested
+    reset_requested = True
+
+
+def unique_id():
+    return b'\x00\x00\x00\x00\x00\x00\x00\x00'
@@ -0,0 +1,60 @@
+# CPython stand-in for MicroPython's network module. Each simulated node has its own copy
+# of this module with address set to the loopback address the node uses.
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 3
+STAT_NO_AP_FOUND = -2
+
+address = '127.0.0.1'
+netmask = '255.255.255.0'
+available = True  # Set to False to simulate the access point going away.
+bssid = b'\x02\x00\x00\x00\x00\x01'
+channel = 6
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self.enabled = False
+        self.connected = False
+        self.failed = False
+
+    def active(self, enabled=None):
+        if enabled is None:
+            return self.enabled
+        self.enabled = bool(enabled)
+
+    # Like the Pico W, the BSSID isn't one of the values that can be read.
+    def config(self, *args, **kwargs):
+        if len(args) == 0:
+            return None
+        if args[0] == 'channel':
+            return channel
+        raise ValueError('unknown config param')
+
+    def scan(self):
+        return [(b'simulation', bssid, channel, -50, 3, False)]
+
+    def connect(self, ssid=None, key=None, **kwargs):
+        self.connected = self.enabled and available
+        self.failed = self.enabled and not available
+
+    def disconnect(self):
+        self.connected = False
+        self.failed = False
+
+    def isconnected(self):
+        return self.connected and available
+
+    def status(self, *args):
+        if self.isconnected():
+            return STAT_GOT_IP
+        return STAT_NO_AP_FOUND if self.failed else STAT_IDLE
+
+    # Setting a static address is accepted but the node keeps the one it was given.
+    def ifconfig(self, addresses=None):
+        if addresses is None:
+            return address, netmask, address, address
@@ -0,0 +1,26 @@
+# CPython stand-in for picozero. Buttons are pressed and sensors moved by the simulation
+# rather than by hardware.
+class Button:
+    def __init__(self, pin, pull_up=True, bounce_time=0.02):
+        self.pin = pin
+        self.is_pressed = False
+        self.when_pressed = None
+        self.when_released = None
+
+    def press(self):
+        self.is_pressed = True
+        if self.when_pressed is not None:
+            self.when_pressed()
+
+    def release(self):
+        self.is_pressed = False
+        if self.when_released is not None:
+            self.when_released()
+
+
+class DistanceSensor:
+    def __init__(self, echo, trigger, max_distance=1):
+        self.echo = echo
+        self.trigger = trigger
+        self.max_distance = max_distance
+        self.distance = None  # Meters, or None when nothing is in range.
@@ -0,0 +1,29 @@
+# CPython stand-in for MicroPython's rp2 module. PIO programs are not assembled and a
+# state machine keeps the last data put to it, such as the colours of the NeoPixels.
+class PIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+
+
+def asm_pio(**kwargs):
+    def program(function):
+        return function
+    return program
+
+
+class StateMachine:
+    def __init__(self, id, program=None, freq=-1, **kwargs):
+        self.id = id
+        self.program = program
+        self.running = False
+        self.data = None
+
+    def active(self, value=None):
+        if value is None:
+            return self.running
+        self.running = bool(value)
+
+    def put(self, value, shift=0):
+        self.data = list(value) if hasattr(value, '__iter__') else [value]
@@ -0,0 +1,133 @@
+# CPython stand-in for MicroPython's uasyncio, built on asyncio. Only the parts used
+# by the networking code are provided.
+#
+# MicroPython streams differ from CPython's: the reader and writer are the same
+# object, close() does nothing and wait_closed() closes the socket, and write()
+# accepts strings. Stream wraps a CPython reader and writer to behave the same way.
+#
+# The harness can power a node off, so the tasks a node starts, and the connections
+# its server is handling, are added to the set in node_tasks for it to cancel.
+import asyncio as _asyncio
+import contextvars
+from asyncio import CancelledError, Event, Lock, TimeoutError, current_task, gather, sleep, wait_for
+
+node_tasks = contextvars.ContextVar('node_tasks', default=None)
+
+
+def track_task(task):
+    tasks = node_tasks.get()
+    if tasks is not None:
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    return task
+
+
+def create_task(coroutine):
+    return track_task(_asyncio.create_task(coroutine))
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(awaitable, ms):
+    return await _asyncio.wait_for(awaitable, ms / 1000)
+
+
+class Stream:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def get_extra_info(self, name):
+        return self.writer.get_extra_info(name)
+
+    async def read(self, n=-1):
+        return await self.reader.read(n)
+
+    async def readinto(self, buf):
+        data = await self.reader.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    async def readexactly(self, n):
+        try:
+            return await self.reader.readexactly(n)
+        except _asyncio.IncompleteReadError:
+            raise EOFError
+
+    async def readline(self):
+        return await self.reader.readline()
+
+    # The data is copied as the caller may reuse its buffer straight away.
+    def write(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode('utf-8')
+        self.writer.write(bytes(buf))
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def open_connection(host, port):
+    reader, writer = await _asyncio.open_connection(host, port)
+    stream = Stream(reader, writer)
+    return stream, stream
+
+
+async def start_server(callback, host, port, backlog=5):
+    # Connections still open when the loop stops are cancelled, which is not an error.
+    async def connected(reader, writer):
+        track_task(_asyncio.current_task())
+        stream = Stream(reader, writer)
+        try:
+            await callback(stream, stream)
+        except CancelledError:
+            pass
+
+    return await _asyncio.start_server(connected, host, port, backlog=backlog)
+
+
+# MicroPython runs the loop inside run_until_complete() even when it is already running,
+# which button callbacks rely on. Here the coroutine is scheduled as a task instead.
+class Loop:
+    def create_task(self, coroutine):
+        return create_task(coroutine)
+
+    def run_until_complete(self, coroutine):
+        try:
+            loop = _asyncio.get_running_loop()
+        except RuntimeError:
+            return _asyncio.run(coroutine)
+        return create_task(coroutine)
+
+    def run_forever(self):
+        _asyncio.get_event_loop().run_forever()
+
+    def stop(self):
+        _asyncio.get_event_loop().stop()
+
+
+loop = Loop()
+
+
+def get_event_loop():
+    return loop
+
+
+def new_event_loop():
+    return loop
+
+
+def run(coroutine):
+    return _asyncio.run(coroutine)
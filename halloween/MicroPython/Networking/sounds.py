@@ -3,7 +3,7 @@
 # Remember, this module does not play sounds. It responds to sound messages and
 # signals for the sound board to play sounds.
 
-import config
+import logger
 import messages
 import neopixels
 import pico
@@ -14,12 +14,14 @@ from machine import Pin
 # Custom sound messages that can be triggered.
 SOUNDS_OFF = '/sounds/off'  # Signal for all sounds to stop.
 SOUNDS_PLAY = '/sounds/play'  # The DATA header indicates the sound to play.
-SOUNDS_PLAY_1 = '/sounds/play/1'
-SOUNDS_PLAY_2 = '/sounds/play/2'
-SOUNDS_PLAY_3 = '/sounds/play/3'
-SOUNDS_PLAY_4 = '/sounds/play/4'
-SOUNDS_PLAY_5 = '/sounds/play/5'
-SOUNDS_PLAY_6 = '/sounds/play/6'
+SOUNDS_PLAY_NUM = '/sounds/play/{%s}' % pico.HEADER_DATA  # The sound to play is part of the route.
+
+# A sound that cannot be played within this time would be out of sync with the rest
+# of the show so is dropped instead.
+SOUNDS_PLAY_DEADLINE_MS = 500
+
+# Sending these again while they are in flight changes nothing, so the sends are shared.
+pico.idempotent_requests.add(SOUNDS_OFF)
 
 # Pins to trigger sounds. The first index is the pin to cancel all sounds.
 pins = [
@@ -50,13 +52,13 @@ async def play_sound(num):
 
 
 async def send_sounds_off_message(ip):
-    if config.logging: print("Sending sounds off message to %s." % ip)
-    await pico.send_message(ip, "GET", SOUNDS_OFF)
+    logger.debug("Sending sounds off message to %s.", ip)
+    await pico.send_nowait(ip, "GET", SOUNDS_OFF, priority=pico.PRIORITY_CUE)
 
 
 async def send_sounds_play_message(ip, num):
-    if config.logging: print("Sending play sound %s message to %s." % (num, ip))
-    await pico.send_message(ip, "GET", SOUNDS_PLAY, str(num))
+    logger.debug("Sending play sound %s message to %s.", num, ip)
+    await pico.send_datagram(ip, SOUNDS_PLAY, str(num), ack=True, deadline_ms=SOUNDS_PLAY_DEADLINE_MS)
 
 
 async def respond_to_sounds_off(method, request, headers, response_headers):
@@ -68,18 +70,18 @@ async def respond_to_sounds_off(method, request, headers, response_headers):
 
 
 async def respond_to_sounds_play(method, request, headers, response_headers):
-    if config.logging: print("Responding to sounds play message.")
+    logger.debug("Responding to sounds play message.")
     # Extract number of sound from data header and check range value
     data_header = headers[pico.HEADER_DATA]
     if len(data_header) <= 0:
-        if config.logging: print("No header data specified.")
+        logger.warning("No header data specified.")
         response_headers[messages.HEADER_CONTENT_TYPE] = messages.CONTENT_TYPE_PLAIN
         response_headers[pico.HEADER_DATA] = 'NO VALUE SPECIFIED FOR DATA HEADER'
         return response_headers[pico.HEADER_DATA]
 
     num = int(data_header)
     if num < 1 or num > 6:
-        if config.logging: print("Data %s is out of range." % num)
+        logger.warning("Data %s is out of range.", num)
         response_headers[messages.HEADER_CONTENT_TYPE] = messages.CONTENT_TYPE_PLAIN
         response_headers[pico.HEADER_DATA] = ('%s IS OUT OF RANGE' % num)
         return response_headers[pico.HEADER_DATA]
@@ -91,44 +93,10 @@ async def respond_to_sounds_play(method, request, headers, response_headers):
     return response_headers[pico.HEADER_DATA]
 
 
-async def respond_to_sounds_play_1(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '1'
-    return await respond_to_sounds_play(method, request, headers, response_headers)
-
-
-async def respond_to_sounds_play_2(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '2'
-    return await respond_to_sounds_play(method, request, headers, response_headers)
-
-
-async def respond_to_sounds_play_3(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '3'
-    return await respond_to_sounds_play(method, request, headers, response_headers)
-
-
-async def respond_to_sounds_play_4(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '4'
-    return await respond_to_sounds_play(method, request, headers, response_headers)
-
-
-async def respond_to_sounds_play_5(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '5'
-    return await respond_to_sounds_play(method, request, headers, response_headers)
-
-
-async def respond_to_sounds_play_6(method, request, headers, response_headers):
-    headers[pico.HEADER_DATA] = '6'
-    return await respond_to_sounds_play(method, request, headers, response_headers)
-
 
 def init():
     pico.message_responders[SOUNDS_OFF] = respond_to_sounds_off
     pico.message_responders[SOUNDS_PLAY] = respond_to_sounds_play
-    pico.message_responders[SOUNDS_PLAY_1] = respond_to_sounds_play_1
-    pico.message_responders[SOUNDS_PLAY_2] = respond_to_sounds_play_2
-    pico.message_responders[SOUNDS_PLAY_3] = respond_to_sounds_play_3
-    pico.message_responders[SOUNDS_PLAY_4] = respond_to_sounds_play_4
-    pico.message_responders[SOUNDS_PLAY_5] = respond_to_sounds_play_5
-    pico.message_responders[SOUNDS_PLAY_6] = respond_to_sounds_play_6
+    pico.add_route(SOUNDS_PLAY_NUM, respond_to_sounds_play)
 
 # There is no run() function as this is just designed to be used by other modules.